@@ -1,8 +1,6 @@
 from pydantic.dataclasses import dataclass
 from typing import List, Optional
 
-from shared.view_models import BoundingBox, Category
-
 
 @dataclass
 class DatasetDto:
@@ -30,11 +28,18 @@ class ImageDto:
     id: int
     name: str
     dataset_id: int
-    bboxes: List[BoundingBox]
-    categories: List[Category]
+    bboxes: List[List[int]]
+    categories: List[int]
     images_path: str
     dataset_name: str
-    model_bboxes: Optional[List[BoundingBox]] = None
-    model_categories: Optional[List[Category]] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    channels: Optional[int] = None
+    format: Optional[str] = None
+    byte_size: Optional[int] = None
+    content_hash: Optional[str] = None
+    dhash: Optional[int] = None
+    model_bboxes: Optional[List[List[int]]] = None
+    model_categories: Optional[List[int]] = None
     model_heatmap: Optional[str] = None
     model_activations: Optional[str] = None
\ No newline at end of file
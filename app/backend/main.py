@@ -1,5 +1,15 @@
-from .routers import datasets, models, images
+from .routers import datasets, models, images, stats
+from shared.metadata_cache import metadata_caches
 from shared.utils_fastapi import create_app
 
 
-app = create_app(routers = [datasets.router, models.router, images.router])
+app = create_app(routers = [datasets.router, models.router, images.router, stats.router])
+
+
+async def start_metadata_caches() -> None:
+    await metadata_caches.start(app.state.pool)
+
+
+app.add_event_handler("startup", start_metadata_caches)
+# The cache listener holds a pooled connection, so release it before the pool closes
+app.router.on_shutdown.insert(0, metadata_caches.stop)
@@ -5,6 +5,26 @@ import pydantic
 from shared.database import typed_fetch
 from ..dtos import DatasetDto
 from shared.database import BaseRepository
+from shared.metadata_cache import metadata_caches
+
+# A dataset with one row per model trained on it
+_DATASET_BY_NAME_QUERY = """
+    SELECT
+        ds.id,
+        ds.dataset_type_id,
+        ds.dataset_name,
+        ds.dataset_size,
+        ds.dataset_path,
+        ds.images_path,
+        m.id
+    FROM dataset ds
+    JOIN model_dataset mds on ds.id = mds.dataset_id
+    JOIN model m on mds.model_id = m.id
+    WHERE dataset_name=$1
+"""
+
+_datasets = metadata_caches.cache("datasets", tables=["dataset", "model_dataset", "model"])
+_dataset_type_ids = metadata_caches.cache("dataset_type_ids", tables=["dataset_type"])
 
 
 class DatasetsRepository(BaseRepository):
@@ -16,63 +36,61 @@ class DatasetsRepository(BaseRepository):
     async def get_all_datasets(self, ) -> List[DatasetDto]:
         """Get all datasets -- TODO: based on image_type??"""
 
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    ds.id,
-                    ds.dataset_type_id,
-                    ds.dataset_name,
-                    ds.dataset_size,
-                    ds.dataset_path,
-                    ds.images_path
-                FROM dataset ds
-            """
+        query_string = f"""
+            SELECT
+                ds.id,
+                ds.dataset_type_id,
+                ds.dataset_name,
+                ds.dataset_size,
+                ds.dataset_path,
+                ds.images_path
+            FROM dataset ds
+        """
 
-            result = await typed_fetch(self.connection, DatasetDto, query_string)
-            
-            return result
+        async def load() -> List[DatasetDto]:
+            return await typed_fetch(self.connection, DatasetDto, query_string, statement="datasets.get_all_datasets")
+
+        return await _datasets.get_or_load(("all",), load)
 
     async def get_dataset_by_name(self, name: str) -> DatasetDto:
         """Get dataset based on its name"""
         
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    ds.id,
-                    ds.dataset_type_id,
-                    ds.dataset_name,
-                    ds.dataset_size,
-                    ds.dataset_path,
-                    ds.images_path,
-                    m.id
-                FROM dataset ds
-                JOIN model_dataset mds on ds.id = mds.dataset_id
-                JOIN model m on mds.model_id = m.id
-                WHERE dataset_name=$1;
-            """
+        query_string = f"""
+            {_DATASET_BY_NAME_QUERY};
+        """
 
-            result = await typed_fetch(self.connection, DatasetDto, query_string, name)
- 
-            return [] if len(result) == 0 else result[0]
+        async def load() -> List[DatasetDto]:
+            return await typed_fetch(
+                self.connection, DatasetDto, query_string, name,
+                statement="datasets.get_dataset_by_name",
+            )
+
+        result = await _datasets.get_or_load(("name", name), load)
+        return [] if len(result) == 0 else result[0]
 
     async def get_dataset_by_id(self, dataset_id: int) -> DatasetDto:
         """Get dataset based on its id"""
 
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    ds.id,
-                    ds.dataset_type_id,
-                    ds.dataset_name,
-                    ds.dataset_size,
-                    ds.dataset_path,
-                    ds.images_path
-                FROM dataset ds
-                WHERE id=$1;
-            """
+        query_string = f"""
+            SELECT
+                ds.id,
+                ds.dataset_type_id,
+                ds.dataset_name,
+                ds.dataset_size,
+                ds.dataset_path,
+                ds.images_path
+            FROM dataset ds
+            WHERE id=$1;
+        """
 
-            result = await typed_fetch(self.connection, DatasetDto, query_string, dataset_id)
-            return [] if len(result) == 0 else result[0]
+        async def load() -> List[DatasetDto]:
+            return await typed_fetch(
+                self.connection, DatasetDto, query_string, dataset_id,
+                statement="datasets.get_dataset_by_id",
+            )
+
+        result = await _datasets.get_or_load(("id", dataset_id), load)
+        return [] if len(result) == 0 else result[0]
 
     async def create_dataset(self, dataset_type: str, dataset_name: str, dataset_size: int, dataset_path: str, images_path: str, ) -> None:
         """Create a new dataset"""
@@ -85,9 +103,9 @@ class DatasetsRepository(BaseRepository):
                 WHERE dst.name=$1;
             """
             
-            dataset_type_id = await self.connection.fetchval(
-                get_dataset_type_id_string,
+            dataset_type_id = await _dataset_type_ids.get_or_load(
                 dataset_type,
+                lambda: self.fetchval("datasets.get_dataset_type_id", get_dataset_type_id_string, dataset_type),
             )
             
             dataset_insert_query_string = f"""
@@ -96,7 +114,8 @@ class DatasetsRepository(BaseRepository):
                 RETURNING id;
             """
            
-            result = await self.connection.fetch(
+            result = await self.fetch(
+                "datasets.dataset_insert",
                 dataset_insert_query_string,
                 dataset_type_id,
                 dataset_name,
@@ -104,3 +123,6 @@ class DatasetsRepository(BaseRepository):
                 dataset_path,
                 images_path,
             )
+
+        # Other workers are told by the dataset trigger, this one should not wait for it
+        metadata_caches.invalidate("dataset")
@@ -1,11 +1,132 @@
 import json
-from typing import List, Optional
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+import asyncpg
 from asyncpg.connection import Connection
 import pydantic
-from shared.view_models import Annotations, Category
-from shared.database import typed_fetch
+from shared.view_models import Annotations, Category, Image, IngestSummary
+from shared.database import typed_cursor, typed_fetch
 from ..dtos import ImageDto
 from shared.database import BaseRepository
+from shared.exception_handlers import TenyksException
+from shared.metadata_cache import metadata_caches
+
+# Images of a dataset with their aggregated annotations in id order, for keyset pagination.
+# The lateral aggregate lets Postgres walk image ids in order instead of grouping the whole dataset.
+_IMAGES_BY_ID_QUERY = """
+    SELECT
+        im.id,
+        im.name,
+        im.dataset_id,
+        ann.bboxes,
+        ann.categories,
+        d.images_path,
+        d.dataset_name,
+        ic.width,
+        ic.height,
+        ic.channels,
+        ic.format,
+        ic.byte_size,
+        ic.content_hash,
+        ic.dhash
+    FROM image im
+    JOIN dataset d ON im.dataset_id=d.id
+    LEFT JOIN image_content ic ON im.content_id=ic.id
+    JOIN LATERAL (
+        SELECT
+            COALESCE(ARRAY_AGG(ARRAY[ib.x_min, ib.y_min, ib.x_max, ib.y_max] ORDER BY ib.id), '{}') bboxes,
+            COALESCE(ARRAY_AGG(ib.category ORDER BY ib.id), '{}') categories
+        FROM image_bbox ib
+        WHERE ib.image_id=im.id
+    ) ann ON TRUE
+    WHERE d.dataset_name=$1 AND im.id > $2
+    ORDER BY im.id
+"""
+
+# Box geometry, area and aspect ratio of a bounding box row aliased as b. These must match the
+# expressions indexed in the schema for the planner to use the GiST and expression indexes.
+_BBOX_BOX = "box(point(b.x_min, b.y_min), point(b.x_max, b.y_max))"
+_BBOX_AREA = "((b.x_max - b.x_min) * (b.y_max - b.y_min))"
+_BBOX_ASPECT = "((b.x_max - b.x_min)::float8 / NULLIF(b.y_max - b.y_min, 0))"
+
+# One image of a dataset with its aggregated annotations
+_IMAGE_BY_NAME_QUERY = """
+    SELECT
+        im.id,
+        im.name,
+        im.dataset_id,
+        ARRAY_AGG(ARRAY[ib.x_min, ib.y_min, ib.x_max, ib.y_max] ORDER BY ib.id) bboxes,
+        ARRAY_AGG(ib.category ORDER BY ib.id) categories,
+        d.images_path,
+        d.dataset_name,
+        ic.width,
+        ic.height,
+        ic.channels,
+        ic.format,
+        ic.byte_size,
+        ic.content_hash,
+        ic.dhash
+    FROM image im
+    JOIN dataset d ON im.dataset_id=d.id
+    LEFT JOIN image_content ic ON im.content_id=ic.id
+    JOIN image_bbox ib ON im.id=ib.image_id
+    WHERE d.dataset_name=$1 AND im.name=$2
+    GROUP by
+        im.id,d.images_path,d.dataset_name, im.name, ic.id
+"""
+
+# The content of every image in a dataset with every other image holding the same bytes
+_IMAGE_CONTENTS_QUERY = """
+    SELECT
+        im.id,
+        im.name,
+        ic.id content_id,
+        ic.content_hash,
+        ic.dhash,
+        twin.id twin_id,
+        twin.name twin_name,
+        twin_d.dataset_name twin_dataset_name
+    FROM image im
+    JOIN dataset d ON im.dataset_id=d.id
+    LEFT JOIN image_content ic ON im.content_id=ic.id
+    LEFT JOIN image twin ON twin.content_id=ic.id AND twin.id <> im.id
+    LEFT JOIN dataset twin_d ON twin.dataset_id=twin_d.id
+    WHERE d.dataset_name=$1
+    ORDER BY im.id, twin.id
+"""
+
+# Predicted boxes of a model for the content of an image
+_MODEL_IMAGE_BBOXES_QUERY = """
+    SELECT
+        im.id,
+        im.name,
+        im.dataset_id,
+        ARRAY_AGG(ARRAY[mib.x_min, mib.y_min, mib.x_max, mib.y_max] ORDER BY mib.id) model_bboxes,
+        ARRAY_AGG(mib.category ORDER BY mib.id) model_categories,
+        d.images_path,
+        d.dataset_name
+    FROM image im
+    JOIN dataset d ON im.dataset_id=d.id
+    JOIN model_image_bbox mib on im.content_id=mib.content_id
+    WHERE im.id=$1 AND mib.model_id=$2
+    GROUP by
+        im.id,d.images_path,d.dataset_name, im.name
+"""
+
+# Images of a dataset already ingested under the given names, compared with a new batch on ingest
+_EXISTING_IMAGES_QUERY = """
+    SELECT
+        im.id,
+        im.name,
+        im.image_etag,
+        im.annotation_etag,
+        im.content_id
+    FROM image im
+    WHERE im.dataset_id=$1 AND im.name = ANY($2::varchar[])
+"""
+
+# Name to id lookups resolved on every ingest batch and model result write
+_dataset_ids = metadata_caches.cache("dataset_ids", tables=["dataset"])
+_model_ids = metadata_caches.cache("model_ids", tables=["model"])
 
 
 class ImagesRepository(BaseRepository):
@@ -17,91 +138,157 @@ class ImagesRepository(BaseRepository):
     async def get_all_images(self, dataset_name: str) -> List[ImageDto]:
         """Get image based on its id"""
         
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    im.id,
-                    im.name,
-                    im.dataset_id,
-                    ARRAY_AGG(bbox_json) bboxes,
-                    ARRAY_AGG(category) categories,
-                    d.images_path,
-                    d.dataset_name
-                FROM image im
-                JOIN dataset d ON im.dataset_id=d.id
-                JOIN image_bbox ib ON im.id=ib.image_id
-                JOIN image_category ic ON ib.category_id =ic.id 
-                WHERE d.dataset_name=$1
-                GROUP by
-                    im.id,d.images_path,d.dataset_name, im.name;
-            """
-            image = await typed_fetch(self.connection, ImageDto, query_string, dataset_name)
-            return image
-            
+        query_string = f"""
+            SELECT
+                im.id,
+                im.name,
+                im.dataset_id,
+                ARRAY_AGG(ARRAY[ib.x_min, ib.y_min, ib.x_max, ib.y_max] ORDER BY ib.id) bboxes,
+                ARRAY_AGG(ib.category ORDER BY ib.id) categories,
+                d.images_path,
+                d.dataset_name
+            FROM image im
+            JOIN dataset d ON im.dataset_id=d.id
+            JOIN image_bbox ib ON im.id=ib.image_id
+            WHERE d.dataset_name=$1
+            GROUP by
+                im.id,d.images_path,d.dataset_name, im.name;
+        """
+        image = await typed_fetch(
+            self.connection, ImageDto, query_string, dataset_name, as_tuples=True,
+            statement="images.get_all_images",
+        )
+        return image
+        
+    async def get_images_page(self, dataset_name: str, after_id: int, limit: int) -> List[ImageDto]:
+        """Get the next page of images in a dataset ordered by id, starting after after_id"""
+
+        query_string = f"""
+            {_IMAGES_BY_ID_QUERY}
+            LIMIT $3;
+        """
+        return await typed_fetch(
+            self.connection, ImageDto, query_string, dataset_name, after_id, limit, as_tuples=True,
+            statement="images.get_images_page",
+        )
+
+    async def stream_images(self, dataset_name: str, batch_size: int = 1000) -> AsyncGenerator[ImageDto, None]:
+        """Stream every image in a dataset ordered by id through a server-side cursor"""
+
+        query_string = f"""
+            {_IMAGES_BY_ID_QUERY};
+        """
+        async for image in typed_cursor(
+            self.connection, ImageDto, query_string, dataset_name, 0, batch_size=batch_size, as_tuples=True,
+            statement="images.stream_images",
+        ):
+            yield image
+
     async def get_image_by_id(self, image_id: int) -> ImageDto:
         """Get image based on its id"""
         
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    im.id as image_id,
-                    im.dataset_id,
-                    ib.bbox_json,
-                    ic.category
-                FROM image im
-                JOIN image_bbox ib on im.id=ib.image_id
-                JOIN image_category ic on ib.category_id=ic.id
-                WHERE image_id=$1;
-            """
-            image = await typed_fetch(self.connection, ImageDto, query_string, image_id)
-            return image   
+        query_string = f"""
+            SELECT
+                im.id as image_id,
+                im.dataset_id,
+                ARRAY[ib.x_min, ib.y_min, ib.x_max, ib.y_max] bbox,
+                ib.category
+            FROM image im
+            JOIN image_bbox ib on im.id=ib.image_id
+            WHERE image_id=$1;
+        """
+        image = await typed_fetch(self.connection, ImageDto, query_string, image_id, statement="images.get_image_by_id")
+        return image   
 
-    async def get_image_by_name(self, image_name: str) -> ImageDto:
-        """Get image based on its id"""
+    async def get_image_by_name(self, dataset_name: str, image_name: str) -> ImageDto:
+        """Get image based on its name within a dataset"""
         
-        async with self.connection.transaction():
-            query_string = f"""              
-                SELECT
-                    im.id,
-                    im.name,
-                    im.dataset_id,
-                    ARRAY_AGG(bbox_json) bboxes,
-                    ARRAY_AGG(category) categories,
-                    d.images_path,
-                    d.dataset_name
-                FROM image im
-                JOIN dataset d ON im.dataset_id=d.id
-                JOIN image_bbox ib ON im.id=ib.image_id
-                JOIN image_category ic ON ib.category_id =ic.id 
-                WHERE im.name=$1
-                GROUP by
-                    im.id,d.images_path,d.dataset_name, im.name;
-            """
-            image = await typed_fetch(self.connection, ImageDto, query_string, image_name)
-            return image[0]
+        query_string = f"""
+            {_IMAGE_BY_NAME_QUERY};
+        """
+        image = await typed_fetch(
+            self.connection, ImageDto, query_string, dataset_name, image_name,
+            statement="images.get_image_by_name",
+        )
+        return image[0]
+
+    async def query_images_by_bbox(
+        self,
+        dataset_name: str,
+        model_name: Optional[str] = None,
+        region: Optional[List[int]] = None,
+        categories: Optional[List[int]] = None,
+        min_area: Optional[int] = None,
+        max_area: Optional[int] = None,
+        min_aspect: Optional[float] = None,
+        max_aspect: Optional[float] = None,
+        after_id: int = 0,
+        limit: int = 1000,
+    ) -> List[ImageDto]:
+        """
+        Get the next page of images in a dataset having boxes that match every given filter.
+
+        Ground truth boxes are searched unless a model name is given, in which case that
+        model's predictions for the image content are. Each image comes back with only its
+        matching boxes.
+        """
+
+        query_string, args = _images_by_bbox_query(
+            dataset_name,
+            model_name=model_name,
+            region=region,
+            categories=categories,
+            min_area=min_area,
+            max_area=max_area,
+            min_aspect=min_aspect,
+            max_aspect=max_aspect,
+            after_id=after_id,
+            limit=limit,
+        )
+        return await typed_fetch(
+            self.connection, ImageDto, query_string, *args, as_tuples=True,
+            statement="images.query_images_by_bbox",
+        )
+
+    async def get_image_contents(self, dataset_name: str) -> List[asyncpg.Record]:
+        """Get the content of every image in a dataset, along with every image sharing it in any dataset"""
+
+        query_string = f"""
+            {_IMAGE_CONTENTS_QUERY};
+        """
+        return await self.fetch("images.get_image_contents", query_string, dataset_name)
+
+    async def get_model_image_heatmap_path(self, dataset_name: str, image_name: str, model_name: str) -> Optional[str]:
+        """
+        Get the object path of the heatmap a model produced for an image. Results belong to the
+        image content, so one extracted through any dataset holding the same bytes is returned.
+        """
+
+        query_string = f"""
+            SELECT mih.result_path
+            FROM image im
+            JOIN dataset d ON im.dataset_id=d.id
+            JOIN model_image_heatmap mih ON mih.content_id=im.content_id
+            JOIN model m ON mih.model_id=m.id
+            WHERE d.dataset_name=$1 AND im.name=$2 AND m.name=$3
+            ORDER BY d.id
+            LIMIT 1;
+        """
+        return await self.fetchval(
+            "images.get_model_image_heatmap_path", query_string, dataset_name, image_name, model_name
+        )
 
     async def get_model_image_by_image_id_model_id(self, image_id: int, model_id: int) -> ImageDto:
         """Get image based on its model id and image id"""
 
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    im.id as image_id,
-                    im.dataset_id,
-                    im.image_path,
-                    ib.bbox_json,
-                    ic.category_json
-                FROM image im
-                JOIN image_bbox ib on im.id=ib.image_id
-                JOIN image_category ic on ib.id=ic.bbox_id
-                JOIN model_image_bbox mib on im.id=mib.image_id
-                JOIN model_image_category mic on mib.id=mic.bbox_id
-                JOIN model m on mib.model_id = m.id
-                --JOIN model_image_heatmap mih on 
-                WHERE image_id=$1 AND model_id=$2;
-            """
-            image = await typed_fetch(self.connection, ImageDto, query_string, image_id, model_id)
-            return image
+        query_string = f"""
+            {_MODEL_IMAGE_BBOXES_QUERY};
+        """
+        image = await typed_fetch(
+            self.connection, ImageDto, query_string, image_id, model_id,
+            statement="images.get_model_image_by_image_id_model_id",
+        )
+        return image
 
     async def create_image(
         self,
@@ -109,64 +296,228 @@ class ImagesRepository(BaseRepository):
         dataset_name: str,
         annotations: Annotations,
     ) -> ImageDto:
-        """Create a new image"""
+        """Create a new image with its annotations in a single statement"""
+
+        # Dataset names are only unique per path, the first dataset created under a name wins
+        image_insert_query_string = f"""
+            WITH im AS (
+                INSERT INTO image(dataset_id, name)
+                SELECT ds.id, $2
+                FROM dataset ds
+                WHERE ds.dataset_name=$1
+                ORDER BY ds.id
+                LIMIT 1
+                RETURNING id
+            ), ib AS (
+                INSERT INTO image_bbox(image_id, category, x_min, y_min, x_max, y_max)
+                SELECT im.id, u.category, u.x_min, u.y_min, u.x_max, u.y_max
+                FROM im, unnest($3::int[], $4::int[], $5::int[], $6::int[], $7::int[]) AS u(category, x_min, y_min, x_max, y_max)
+            )
+            SELECT id FROM im;
+        """
+
+        image_id = await self.fetchval(
+            "images.image_insert",
+            image_insert_query_string,
+            dataset_name,
+            name,
+            *_bbox_arrays(annotations),
+        )
+        if image_id is None:
+            raise TenyksException(f"Unknown dataset {dataset_name}")
+
+    async def create_images(self, dataset_name: str, images: List[Image]) -> IngestSummary:
+        """
+        Create or update many images with their annotations in a constant number of round trips.
+
+        Images already in the dataset with the same S3 ETags are left untouched, images whose
+        ETags changed (or are unknown) get their annotations replaced, and new images are written
+        with COPY using ids reserved up front from the identity sequences. Images with the same
+        content hash, in this dataset or any other, share one image_content row.
+        """
+
+        summary = IngestSummary()
+        images = list({image.name: image for image in images}.values())
+        if not images:
+            return summary
 
-        bboxes = [bbox for bbox in annotations.bboxes]
-        categories = [cat for cat in annotations.categories]
-        
         async with self.connection.transaction():
             get_dataset_id_string = f"""
-                SELECT 
-                    ds.id 
+                SELECT
+                    ds.id
                 FROM dataset ds
-                WHERE dataset_name=$1;
+                WHERE dataset_name=$1
+                ORDER BY ds.id
+                LIMIT 1;
             """
-            
-            dataset_id = await self.connection.fetchval(
-                get_dataset_id_string,
+
+            dataset_id = await _dataset_ids.get_or_load(
                 dataset_name,
+                lambda: self.fetchval("images.get_dataset_id", get_dataset_id_string, dataset_name),
             )
+            if dataset_id is None:
+                raise TenyksException(f"Unknown dataset {dataset_name}")
 
-            image_insert_query_string = f"""
-                INSERT INTO image(dataset_id, name)
-                VALUES ($1, $2)
-                RETURNING id;
+            get_existing_images_string = f"""
+                {_EXISTING_IMAGES_QUERY};
             """
-                
-            image_id = await self.connection.fetchval(
-                image_insert_query_string,
-                dataset_id,
-                name
-            )
 
-            category_insert_query_string = f"""
-                INSERT INTO image_category(category)
-                VALUES ($1)
-                RETURNING id;
-            """
-            category_ids = [ 
-                await self.connection.fetchval(
-                    category_insert_query_string,
-                    category
+            existing = {
+                record["name"]: record
+                for record in await self.fetch(
+                    "images.get_existing_images",
+                    get_existing_images_string,
+                    dataset_id,
+                    [image.name for image in images],
                 )
-                for category in categories
-            ]
+            }
 
-            image_bbox_insert_query_string = f"""
-                INSERT INTO image_bbox(image_id, category_id, bbox_json)
-                VALUES ($1, $2, $3)
-                RETURNING id;
-            """
-            
-            result = [
-                await self.connection.fetchval(
-                    image_bbox_insert_query_string,
-                    image_id,
-                    category_id,
-                    json.dumps(bboxes[i]),
-                )
-                for i, category_id in enumerate(category_ids)
-            ]
+            contents = await self._create_image_contents(images)
+
+            new_images = []
+            changed_images = []
+            for image in images:
+                record = existing.get(image.name)
+                content_id = contents[image.content_hash][0] if image.content_hash in contents else None
+                if record is None:
+                    new_images.append(image)
+                elif (
+                    image.image_etag is not None
+                    and (record["image_etag"], record["annotation_etag"]) == (image.image_etag, image.annotation_etag)
+                    and record["content_id"] == content_id
+                ):
+                    summary.unchanged += 1
+                else:
+                    changed_images.append((record["id"], image))
+
+            # New dataset images whose bytes are already held by another image
+            seen = set()
+            for image in new_images:
+                if image.content_hash in contents:
+                    if image.content_hash in seen or not contents[image.content_hash][1]:
+                        summary.duplicates += 1
+                    seen.add(image.content_hash)
+
+            if changed_images:
+                await self._replace_images(changed_images, contents)
+
+            image_ids = await self._reserve_ids("image", len(new_images))
+            await self.connection.copy_records_to_table(
+                "image",
+                records=[
+                    (
+                        image_id,
+                        dataset_id,
+                        image.name,
+                        image.image_etag,
+                        image.annotation_etag,
+                        contents[image.content_hash][0] if image.content_hash in contents else None,
+                    )
+                    for image_id, image in zip(image_ids, new_images)
+                ],
+                columns=["id", "dataset_id", "name", "image_etag", "annotation_etag", "content_id"],
+            )
+
+            await self._create_image_annotations(
+                list(zip(image_ids, new_images)) + changed_images
+            )
+
+        summary.inserted = len(new_images)
+        summary.updated = len(changed_images)
+        return summary
+
+    async def _create_image_contents(self, images: List[Image]) -> Dict[str, Tuple[int, bool]]:
+        """
+        Create the physical image rows of the given images, or fill in facts missing from existing
+        ones. Returns the id of every content hash and whether its row was created just now.
+        """
+
+        contents = {image.content_hash: image for image in images if image.content_hash is not None}
+        if not contents:
+            return {}
+
+        image_content_upsert_query_string = f"""
+            INSERT INTO image_content(content_hash, width, height, channels, format, byte_size, dhash)
+            SELECT *
+            FROM unnest($1::varchar[], $2::int[], $3::int[], $4::smallint[], $5::varchar[], $6::bigint[], $7::bigint[])
+            ON CONFLICT (content_hash) DO UPDATE
+            SET
+                width=COALESCE(EXCLUDED.width, image_content.width),
+                height=COALESCE(EXCLUDED.height, image_content.height),
+                channels=COALESCE(EXCLUDED.channels, image_content.channels),
+                format=COALESCE(EXCLUDED.format, image_content.format),
+                byte_size=COALESCE(EXCLUDED.byte_size, image_content.byte_size),
+                dhash=COALESCE(EXCLUDED.dhash, image_content.dhash)
+            RETURNING id, content_hash, xmax = 0 AS inserted;
+        """
+        records = await self.fetch(
+            "images.image_content_upsert",
+            image_content_upsert_query_string,
+            list(contents),
+            [image.width for image in contents.values()],
+            [image.height for image in contents.values()],
+            [image.channels for image in contents.values()],
+            [image.format for image in contents.values()],
+            [image.byte_size for image in contents.values()],
+            [image.dhash for image in contents.values()],
+        )
+        return {record["content_hash"]: (record["id"], record["inserted"]) for record in records}
+
+    async def _replace_images(self, images: List[Tuple[int, Image]], contents: Dict[str, Tuple[int, bool]]) -> None:
+        """Drop the annotations of already ingested images and record their new ETags and content"""
+
+        image_ids = [image_id for image_id, _ in images]
+
+        image_bbox_delete_query_string = f"""
+            DELETE FROM image_bbox
+            WHERE image_id = ANY($1::int[]);
+        """
+        await self.execute("images.image_bbox_delete", image_bbox_delete_query_string, image_ids)
+
+        image_update_query_string = f"""
+            UPDATE image im
+            SET
+                image_etag=u.image_etag,
+                annotation_etag=u.annotation_etag,
+                content_id=u.content_id
+            FROM unnest($1::int[], $2::varchar[], $3::varchar[], $4::int[]) AS u(id, image_etag, annotation_etag, content_id)
+            WHERE im.id=u.id;
+        """
+        await self.execute(
+            "images.image_update",
+            image_update_query_string,
+            image_ids,
+            [image.image_etag for _, image in images],
+            [image.annotation_etag for _, image in images],
+            [contents[image.content_hash][0] if image.content_hash in contents else None for _, image in images],
+        )
+
+    async def _create_image_annotations(self, images: List[Tuple[int, Image]]) -> None:
+        """COPY the bounding boxes and categories of images whose rows already exist"""
+
+        await self.connection.copy_records_to_table(
+            "image_bbox",
+            records=[
+                (image_id, category, *bbox)
+                for image_id, image in images
+                for bbox, category in zip(image.annotations.bboxes, image.annotations.categories)
+            ],
+            columns=["image_id", "category", "x_min", "y_min", "x_max", "y_max"],
+        )
+
+    async def _reserve_ids(self, table: str, count: int) -> List[int]:
+        """Reserve count ids from the identity sequence of a table"""
+
+        if count == 0:
+            return []
+
+        reserve_ids_query_string = f"""
+            SELECT nextval(pg_get_serial_sequence($1, 'id'))
+            FROM generate_series(1, $2);
+        """
+        records = await self.fetch("images.reserve_ids", reserve_ids_query_string, table, count)
+
+        return [record[0] for record in records]
 
     async def create_model_image_annotations(
         self,
@@ -174,116 +525,224 @@ class ImagesRepository(BaseRepository):
         model_name: str,
         model_annotations: Annotations,
     ) -> None:
-        """Create image model based features"""
-
-        # First need model id
-        model_get_query_string = f"""
-            SELECT m.id
-            FROM model m
-            WHERE m.name = $1;
         """
-
-        model_id = await self.connection.fetchval(
-            model_get_query_string,
-            model_name,
-        )
-        bboxes = [bbox for bbox in model_annotations.bboxes]
-        categories = [cat for cat in model_annotations.categories]
-
-        category_insert_query_string = f"""
-            INSERT INTO model_image_category(category)
-            VALUES ($1)
-            RETURNING id;
+        Create the predicted boxes of a model for the content of an image, replacing the boxes
+        of an earlier extraction of the same bytes through any dataset
         """
 
-        category_ids = [ 
-            await self.connection.fetchval(
-                category_insert_query_string,
-                category
+        model_id = await self._get_model_id(model_name)
+        content_id = await self._get_content_id(image_id)
+
+        model_image_bbox_insert_query_string = f"""
+            WITH deleted AS (
+                DELETE FROM model_image_bbox
+                WHERE content_id=$1 AND model_id=$2
             )
-            for category in categories
-        ]
-        
-        image_bbox_insert_query_string = f"""
-            INSERT INTO model_image_bbox(image_id, model_id, category_id, bbox_json)
-            VALUES ($1, $2, $3, $4)
+            INSERT INTO model_image_bbox(content_id, model_id, category, x_min, y_min, x_max, y_max)
+            SELECT $1, $2, u.category, u.x_min, u.y_min, u.x_max, u.y_max
+            FROM unnest($3::int[], $4::int[], $5::int[], $6::int[], $7::int[]) AS u(category, x_min, y_min, x_max, y_max)
             RETURNING id;
         """
-        
-        result = [
-            await self.connection.fetchval(
-                image_bbox_insert_query_string,
-                image_id,
-                model_id,
-                category_id,
-                json.dumps(bboxes[i]),
-            )
-            for i, category_id in enumerate(category_ids)
-        ]
+
+        bbox_arrays = _bbox_arrays(model_annotations)
+        records = await self.fetch(
+            "images.model_image_bbox_insert",
+            model_image_bbox_insert_query_string,
+            content_id,
+            model_id,
+            *bbox_arrays,
+        )
+        if len(records) != len(bbox_arrays[0]):
+            raise TenyksException(f"Stored {len(records)} of {len(bbox_arrays[0])} boxes of {model_name} for image {image_id}")
 
     async def create_model_image_heatmap(
         self,
         image_id: int,
         model_name: str,
         result_path: str,
+        dtype: Optional[str] = None,
+        shape: Optional[list] = None,
     ) -> None:
-        """Create image model based features"""
-
-        # First need model id
-        model_get_query_string = f"""
-            SELECT m.id
-            FROM model m
-            WHERE m.name = $1;
+        """
+        Create image model based features for the content of an image, replacing the result of
+        an earlier extraction of the same bytes through any dataset
         """
 
-        model_id = await self.connection.fetchval(
-            model_get_query_string,
-            model_name,
-        )
+        model_id = await self._get_model_id(model_name)
+        content_id = await self._get_content_id(image_id)
 
-        image_bbox_insert_query_string = f"""
-            INSERT INTO model_image_heatmap(image_id, model_id, result_path)
-            VALUES ($1, $2, $3)
-            RETURNING (image_id, model_id);
+        model_image_heatmap_insert_query_string = f"""
+            INSERT INTO model_image_heatmap(content_id, model_id, result_path, dtype, shape)
+            VALUES ($1, $2, $3, $4, $5::json)
+            ON CONFLICT (content_id, model_id) DO UPDATE
+            SET result_path=EXCLUDED.result_path, dtype=EXCLUDED.dtype, shape=EXCLUDED.shape
+            RETURNING content_id;
         """
-        
-        result = await self.connection.fetchval(
-            image_bbox_insert_query_string,
-            image_id,
+
+        stored = await self.fetchval(
+            "images.model_image_heatmap_insert",
+            model_image_heatmap_insert_query_string,
+            content_id,
             model_id,
             result_path,
+            dtype,
+            None if shape is None else json.dumps(shape),
         )
+        if stored is None:
+            raise TenyksException(f"Could not store the heatmap of {model_name} for image {image_id}")
 
     async def create_model_image_activations(
         self,
         image_id: int,
         model_name: str,
         result_path: str,
+        dtype: Optional[str] = None,
+        shape: Optional[list] = None,
     ) -> None:
-        """Create image model based features"""
+        """
+        Create image model based features for the content of an image, replacing the result of
+        an earlier extraction of the same bytes through any dataset
+        """
+
+        model_id = await self._get_model_id(model_name)
+        content_id = await self._get_content_id(image_id)
+
+        model_image_activations_insert_query_string = f"""
+            INSERT INTO model_image_activations(content_id, model_id, result_path, dtype, shape)
+            VALUES ($1, $2, $3, $4, $5::json)
+            ON CONFLICT (content_id, model_id) DO UPDATE
+            SET result_path=EXCLUDED.result_path, dtype=EXCLUDED.dtype, shape=EXCLUDED.shape
+            RETURNING content_id;
+        """
+
+        stored = await self.fetchval(
+            "images.model_image_activations_insert",
+            model_image_activations_insert_query_string,
+            content_id,
+            model_id,
+            result_path,
+            dtype,
+            None if shape is None else json.dumps(shape),
+        )
+        if stored is None:
+            raise TenyksException(f"Could not store the activations of {model_name} for image {image_id}")
+
+    async def _get_content_id(self, image_id: int) -> int:
+        """Resolve an image to the content its model results attach to"""
 
-        # First need model id
-        model_get_query_string = f"""
-            SELECT m.id
+        get_content_id_string = f"""
+            SELECT
+                im.content_id
+            FROM image im
+            WHERE im.id=$1;
+        """
+
+        content_id = await self.fetchval("images.get_content_id", get_content_id_string, image_id)
+        if content_id is None:
+            raise TenyksException(
+                f"Image {image_id} has no content hash to attach model results to, ingest it with its file facts first"
+            )
+        return content_id
+
+    async def _get_model_id(self, model_name: str) -> int:
+        """Resolve a model name to its id, cached until the model table changes"""
+
+        get_model_id_string = f"""
+            SELECT
+                m.id
             FROM model m
-            WHERE m.name = $1;
+            WHERE m.name=$1;
         """
 
-        model_id = await self.connection.fetchval(
-            model_get_query_string,
+        model_id = await _model_ids.get_or_load(
             model_name,
+            lambda: self.fetchval("images.get_model_id", get_model_id_string, model_name),
         )
+        if model_id is None:
+            raise TenyksException(f"Unknown model {model_name}")
+        return model_id
 
-        image_bbox_insert_query_string = f"""
-            INSERT INTO model_image_activations(image_id, model_id, result_path)
-            VALUES ($1, $2, $3)
-            RETURNING (image_id, model_id);
-        """
-        
-        result = await self.connection.fetchval(
-            image_bbox_insert_query_string,
-            image_id,
-            model_id,
-            result_path,
+
+def _images_by_bbox_query(
+    dataset_name: str,
+    model_name: Optional[str] = None,
+    region: Optional[List[int]] = None,
+    categories: Optional[List[int]] = None,
+    min_area: Optional[int] = None,
+    max_area: Optional[int] = None,
+    min_aspect: Optional[float] = None,
+    max_aspect: Optional[float] = None,
+    after_id: int = 0,
+    limit: int = 1000,
+) -> Tuple[str, list]:
+    """The query of ImagesRepository.query_images_by_bbox for the given filters, with its arguments"""
+
+    args = [dataset_name, after_id]
+
+    def arg(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    conditions = ["d.dataset_name=$1", "im.id > $2"]
+    if model_name is not None:
+        conditions.append(f"b.model_id=(SELECT m.id FROM model m WHERE m.name={arg(model_name)})")
+    if region is not None:
+        x_min, y_min, x_max, y_max = region
+        conditions.append(
+            f"{_BBOX_BOX} && box(point({arg(x_min)}::int, {arg(y_min)}::int), point({arg(x_max)}::int, {arg(y_max)}::int))"
         )
-  
\ No newline at end of file
+    if categories is not None:
+        conditions.append(f"b.category = ANY({arg(categories)}::int[])")
+    if min_area is not None:
+        conditions.append(f"{_BBOX_AREA} >= {arg(min_area)}::int")
+    if max_area is not None:
+        conditions.append(f"{_BBOX_AREA} <= {arg(max_area)}::int")
+    if min_aspect is not None:
+        conditions.append(f"{_BBOX_ASPECT} >= {arg(min_aspect)}::float8")
+    if max_aspect is not None:
+        conditions.append(f"{_BBOX_ASPECT} <= {arg(max_aspect)}::float8")
+
+    if model_name is None:
+        table, join = "image_bbox", "b.image_id=im.id"
+    else:
+        table, join = "model_image_bbox", "b.content_id=im.content_id"
+    query_string = f"""
+        SELECT
+            im.id,
+            im.name,
+            im.dataset_id,
+            ARRAY_AGG(ARRAY[b.x_min, b.y_min, b.x_max, b.y_max] ORDER BY b.id) bboxes,
+            ARRAY_AGG(b.category ORDER BY b.id) categories,
+            d.images_path,
+            d.dataset_name,
+            ic.width,
+            ic.height,
+            ic.channels,
+            ic.format,
+            ic.byte_size,
+            ic.content_hash,
+            ic.dhash
+        FROM {table} b
+        JOIN image im ON {join}
+        JOIN dataset d ON im.dataset_id=d.id
+        LEFT JOIN image_content ic ON im.content_id=ic.id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY
+            im.id, d.images_path, d.dataset_name, im.name, ic.id
+        ORDER BY im.id
+        LIMIT {arg(limit)};
+    """
+
+    return query_string, args
+
+
+def _bbox_arrays(annotations: Optional[Annotations]) -> List[List[int]]:
+    """Split annotations into category, x_min, y_min, x_max and y_max arrays for unnest"""
+
+    columns = [[], [], [], [], []]
+    if annotations is not None:
+        for bbox, category in zip(annotations.bboxes, annotations.categories):
+            for column, value in zip(columns, (category, *bbox)):
+                column.append(value)
+
+    return columns
@@ -5,6 +5,27 @@ import pydantic
 from shared.database import typed_fetch
 from ..dtos import DatasetDto, ModelDto
 from shared.database import BaseRepository
+from shared.exception_handlers import TenyksException
+from shared.metadata_cache import metadata_caches
+
+# A model with one row per dataset it was trained on
+_MODEL_BY_NAME_QUERY = """
+    SELECT
+        mo.id,
+        mo.name,
+        d.dataset_type_id,
+        d.dataset_name,
+        d.dataset_size,
+        d.dataset_path,
+        d.images_path
+    FROM model mo
+    JOIN model_dataset md on mo.id = md.model_id
+    JOIN dataset d on md.dataset_id = d.id
+    JOIN dataset_type dt on d.dataset_type_id = dt.id
+    WHERE mo.name=$1
+"""
+
+_models = metadata_caches.cache("models", tables=["model", "model_dataset", "dataset", "dataset_type"])
 
 
 class ModelsRepository(BaseRepository):
@@ -16,105 +37,96 @@ class ModelsRepository(BaseRepository):
     async def get_all_models(self) -> ModelDto:
         """Get model based on its name"""
         
-        async with self.connection.transaction():
-            query_string = f"""
-               SELECT
-                    mo.id,
-                    mo.name,
-                ARRAY_AGG(d.dataset_name) datasets
-                FROM model mo
-                JOIN model_dataset md on mo.id = md.model_id
-                JOIN dataset d on md.dataset_id = d.id
-                JOIN dataset_type dt on d.dataset_type_id = dt.id
-                GROUP by
-                    mo.id;
-            """
-            result = await typed_fetch(self.connection, ModelDto, query_string)
-            return result
+        query_string = f"""
+           SELECT
+                mo.id,
+                mo.name,
+            ARRAY_AGG(d.dataset_name) datasets
+            FROM model mo
+            JOIN model_dataset md on mo.id = md.model_id
+            JOIN dataset d on md.dataset_id = d.id
+            JOIN dataset_type dt on d.dataset_type_id = dt.id
+            GROUP by
+                mo.id;
+        """
+        async def load() -> List[ModelDto]:
+            return await typed_fetch(self.connection, ModelDto, query_string, statement="models.get_all_models")
+
+        return await _models.get_or_load(("all",), load)
 
     async def get_model_by_name(self, name: str) -> ModelDto:
         """Get model based on its name"""
         
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT
-                    mo.id,
-                    mo.name,
-                    d.dataset_type_id,
-                    d.dataset_name,
-                    d.dataset_size,
-                    d.dataset_path,
-                    d.images_path
-                FROM model mo
-                JOIN model_dataset md on mo.id = md.model_id
-                JOIN dataset d on md.dataset_id = d.id
-                JOIN dataset_type dt on d.dataset_type_id = dt.id
-                WHERE name=$1;
-            """
-            result = await typed_fetch(self.connection, ModelDto, query_string, name)
-            return result[0]
+        query_string = f"""
+            {_MODEL_BY_NAME_QUERY};
+        """
+        async def load() -> List[ModelDto]:
+            return await typed_fetch(self.connection, ModelDto, query_string, name, statement="models.get_model_by_name")
+
+        result = await _models.get_or_load(("name", name), load)
+        return result[0]
 
     async def get_model_by_id(self, modelid: int) -> ModelDto:
         """Get model based on its id"""
 
-        async with self.connection.transaction():
-            query_string = f"""
-                SELECT distinct on (mo.id, md.model_id)
-                     mo.id,
-                    mo.name,
-                    d.dataset_type_id,
-                    d.dataset_name,
-                    d.dataset_size,
-                    d.dataset_path,
-                    d.images_path
-                FROM model mo
-                INNER JOIN model_dataset md on mo.id = md.model_id
-                INNER JOIN dataset d on md.dataset_id = d.id
-                INNER JOIN dataset_type dt on d.dataset_type_id = dt.id
-                WHERE id=$1;
-            """
-            dataset = await typed_fetch(self.connection, ModelDto, query_string, modelid)
-            return dataset
+        query_string = f"""
+            SELECT distinct on (mo.id, md.model_id)
+                 mo.id,
+                mo.name,
+                d.dataset_type_id,
+                d.dataset_name,
+                d.dataset_size,
+                d.dataset_path,
+                d.images_path
+            FROM model mo
+            INNER JOIN model_dataset md on mo.id = md.model_id
+            INNER JOIN dataset d on md.dataset_id = d.id
+            INNER JOIN dataset_type dt on d.dataset_type_id = dt.id
+            WHERE mo.id=$1;
+        """
+        async def load() -> List[ModelDto]:
+            return await typed_fetch(
+                self.connection, ModelDto, query_string, modelid,
+                statement="models.get_model_by_id",
+            )
+
+        return await _models.get_or_load(("id", modelid), load)
 
     async def create_model(self, name: str, datasets: List[str]) -> None:
-        """Create a new model"""
-      
-        async with self.connection.transaction():
-            model_insert_query_string = f"""
+        """
+        Create a new model linked to every named dataset in a single statement. Dataset names
+        are only unique per path, so each name links the first dataset created under it.
+        """
+
+        model_insert_query_string = f"""
+            WITH mo AS (
                 INSERT INTO model(name)
                 VALUES ($1)
-                RETURNING id;
-            """
+                RETURNING id
+            ), ds AS (
+                SELECT DISTINCT ON (ds.dataset_name)
+                    ds.id,
+                    ds.dataset_name
+                FROM dataset ds
+                WHERE ds.dataset_name = ANY($2::varchar[])
+                ORDER BY ds.dataset_name, ds.id
+            )
+            INSERT INTO model_dataset(model_id, dataset_id)
+            SELECT
+                mo.id,
+                ds.id
+            FROM mo, ds
+            RETURNING dataset_id;
+        """
 
-            model_id = await self.connection.fetchval(
+        async with self.connection.transaction():
+            records = await self.fetch(
+                "models.model_insert",
                 model_insert_query_string,
                 name,
+                list(datasets),
             )
-            
-            get_dataset_id_query_string = f"""
-                SELECT 
-                    ds.id 
-                FROM dataset ds
-                WHERE ds.dataset_name=$1;
-            """
-            dataset_ids = [
-                await self.connection.fetchval(
-                    get_dataset_id_query_string,
-                    dataset,
-                ) 
-                for dataset in datasets
-            ]
-            
-            model_dataset_insert_query_string = f"""
-                INSERT INTO model_dataset(model_id, dataset_id)
-                VALUES ($1, $2);
-            """
-            
-            result = [
-                await self.connection.fetch(
-                    model_dataset_insert_query_string,
-                    model_id, dataset_id,
-                )
-                for dataset_id in dataset_ids
-            ]
+            if len(records) != len(set(datasets)):
+                raise TenyksException(f"Some of the datasets {sorted(set(datasets))} of model {name} do not exist")
 
+        metadata_caches.invalidate("model", "model_dataset")
@@ -1,12 +1,45 @@
+import dataclasses
+import io
 import json
+import os
 import re
-from fastapi import APIRouter, Depends, Request
+import numpy as np
+from asyncpg.pool import Pool
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
-from shared.types_common import ExtractionTypes, TenyksImagesRequest, TenyksModelImagesRequest, TenyksResponse, TenyksSuccess
-from shared.view_models import Annotations, BoundingBox, Category, Image
+from shared.array_codec import CONTENT_TYPE, decode_array
+from shared.heatmap_tiles import PYRAMID_EXTENSION, crop_heatmap, read_heatmap_region, read_pyramid_header
+from shared.image_info import near_duplicate_groups
+from shared.s3_utils import AwsConfig, s3_download_file, s3_download_range
+from shared.types_common import (
+    ExtractionTypes,
+    StatusGroup,
+    TenyksBboxQueryRequest,
+    TenyksDuplicatesRequest,
+    TenyksError,
+    TenyksHeatmapRegionRequest,
+    TenyksImagesBulkRequest,
+    TenyksImagesPageRequest,
+    TenyksImagesRequest,
+    TenyksModelImagesRequest,
+    TenyksResponse,
+    TenyksSuccess,
+)
+from shared.view_models import (
+    Annotations,
+    BoundingBox,
+    Category,
+    DuplicateGroup,
+    DuplicateImage,
+    DuplicatesReport,
+    Image,
+    ImagesPage,
+)
+from ..dtos import ImageDto
 from ..repos.images_repo import ImagesRepository
-from shared.database import get_repository
+from shared.database import get_pool, get_repository
 
 router = APIRouter(
     prefix="/api/images",
@@ -14,6 +47,13 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+awsConfig = AwsConfig(
+    endpoint_url=os.environ.get("AWS_ENDPOINT"),
+    region_name=os.environ.get("AWS_REGION"),
+    aws_access_key_id=os.environ.get("MINIO_ROOT_USER"),
+    aws_secret_access_key=os.environ.get("MINIO_ROOT_PASSWORD"),
+)
+
 
 @router.post(
     "/all",
@@ -27,23 +67,223 @@ async def get_all_images(
     """Get all images in a dataset based on dataset name."""
     dtos = await images_repo.get_all_images(dataset_name=request.dataset_name)
 
-    images = [
-        Image(
-            id=dto.id,
-            name=dto.name,
-            url=dto.images_path,
-            dataset_name=dto.dataset_name,
-            annotations=Annotations(
-                bboxes=[json.loads(bbox) for bbox in dto.bboxes],
-                categories=[cat for cat in dto.categories],
-            ),
-        )
-        for dto in dtos
-    ]
+    images = [_image_from_dto(dto) for dto in dtos]
 
     return TenyksResponse(response=TenyksSuccess(result=images))
 
 
+@router.post(
+    "/page",
+    response_model=TenyksResponse,
+    status_code=200,
+)
+async def get_images_page(
+    request: TenyksImagesPageRequest,
+    images_repo: ImagesRepository = Depends(get_repository(ImagesRepository)),
+) -> TenyksResponse:
+    """Get one page of images in a dataset, keyset paginated on image id."""
+
+    dtos = await images_repo.get_images_page(
+        dataset_name=request.dataset_name, after_id=request.after_id, limit=request.limit
+    )
+
+    page = ImagesPage(
+        images=[_image_from_dto(dto) for dto in dtos],
+        next_after_id=dtos[-1].id if len(dtos) == request.limit else None,
+    )
+
+    return TenyksResponse(response=TenyksSuccess(result=page))
+
+
+@router.post(
+    "/stream",
+    status_code=200,
+)
+async def stream_images(
+    request: TenyksImagesRequest,
+    pool: Pool = Depends(get_pool),
+) -> StreamingResponse:
+    """
+    Stream every image in a dataset as newline delimited JSON, one image per line. The body is
+    sent after the handler returns, so the connection is acquired for the life of the stream.
+    """
+
+    async def ndjson_lines():
+        async with pool.acquire() as conn:
+            async for dto in ImagesRepository(conn).stream_images(dataset_name=request.dataset_name):
+                yield json.dumps(dataclasses.asdict(_image_from_dto(dto))) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/query",
+    response_model=TenyksResponse,
+    status_code=200,
+)
+async def query_images_by_bbox(
+    request: TenyksBboxQueryRequest,
+    images_repo: ImagesRepository = Depends(get_repository(ImagesRepository)),
+) -> TenyksResponse:
+    """
+    Get one page of images with ground truth boxes, or a model's predicted boxes if a model
+    name is given, matching a region overlap, area, aspect ratio and category filter.
+    """
+
+    dtos = await images_repo.query_images_by_bbox(
+        dataset_name=request.dataset_name,
+        model_name=request.model_name,
+        region=request.region,
+        categories=request.categories,
+        min_area=request.min_area,
+        max_area=request.max_area,
+        min_aspect=request.min_aspect,
+        max_aspect=request.max_aspect,
+        after_id=request.after_id,
+        limit=request.limit,
+    )
+
+    images = []
+    for dto in dtos:
+        image = _image_from_dto(dto)
+        if request.model_name is not None:
+            image.model_annotations = image.annotations
+            image.annotations = Annotations(bboxes=[], categories=[])
+        images.append(image)
+
+    page = ImagesPage(
+        images=images,
+        next_after_id=dtos[-1].id if len(dtos) == request.limit else None,
+    )
+
+    return TenyksResponse(response=TenyksSuccess(result=page))
+
+
+@router.post(
+    "/heatmap",
+    status_code=200,
+)
+async def get_heatmap_region(
+    request: TenyksHeatmapRegionRequest,
+    images_repo: ImagesRepository = Depends(get_repository(ImagesRepository)),
+):
+    """
+    Get one level of a model heatmap, or a window of it, as a .npy array. Only the stored
+    tiles overlapping the window are read from S3. The level count is in X-Heatmap-Levels.
+    Heatmaps stored as a plain array before the tiled format are read whole and have one level.
+    """
+
+    result_path = await images_repo.get_model_image_heatmap_path(
+        dataset_name=request.dataset_name, image_name=request.image_name, model_name=request.model_name
+    )
+    if result_path is None:
+        error = TenyksError(
+            message=f"No heatmap of {request.model_name} for {request.dataset_name}/{request.image_name}",
+            type=StatusGroup.CLIENT_ERROR,
+        )
+        return TenyksResponse(response=error)
+
+    async def read_range(offset: int, length: int) -> bytes:
+        return await s3_download_range(file_path=result_path, offset=offset, length=length, aws_config=awsConfig)
+
+    try:
+        if result_path.endswith(f".{PYRAMID_EXTENSION}"):
+            header = await read_pyramid_header(read_range)
+            heatmap = await read_heatmap_region(read_range, level=request.level, region=request.region, header=header)
+            levels = len(header.levels)
+        else:
+            downloaded = await s3_download_file(file_path=result_path, aws_config=awsConfig)
+            heatmap = crop_heatmap(decode_array(downloaded.content.getvalue()), level=request.level, region=request.region)
+            levels = 1
+    except ValueError as exc:
+        return TenyksResponse(response=TenyksError(message=str(exc), type=StatusGroup.CLIENT_ERROR))
+
+    buffer = io.BytesIO()
+    np.save(buffer, heatmap, allow_pickle=False)
+    return Response(
+        content=buffer.getvalue(),
+        media_type=CONTENT_TYPE,
+        headers={"X-Heatmap-Levels": str(levels)},
+    )
+
+
+@router.post(
+    "/duplicates",
+    response_model=TenyksResponse,
+    status_code=200,
+)
+async def get_duplicates(
+    request: TenyksDuplicatesRequest,
+    images_repo: ImagesRepository = Depends(get_repository(ImagesRepository)),
+) -> TenyksResponse:
+    """
+    Report the images of a dataset whose bytes are also held by other images, in this or any
+    other dataset, and groups of near duplicates by difference hash within the dataset.
+    """
+
+    records = await images_repo.get_image_contents(dataset_name=request.dataset_name)
+
+    images = {}
+    exact = {}
+    dhashes = {}
+    for record in records:
+        images[record["id"]] = DuplicateImage(id=record["id"], name=record["name"], dataset_name=request.dataset_name)
+        if record["content_id"] is None:
+            continue
+        if record["dhash"] is not None:
+            dhashes[record["content_id"]] = record["dhash"]
+        group = exact.setdefault(record["content_id"], (record["content_hash"], {}))[1]
+        group[record["id"]] = images[record["id"]]
+        if record["twin_id"] is not None:
+            group[record["twin_id"]] = DuplicateImage(
+                id=record["twin_id"], name=record["twin_name"], dataset_name=record["twin_dataset_name"]
+            )
+
+    members = {}
+    for content_id, (_, group) in exact.items():
+        members[content_id] = [image for image in group.values() if image.dataset_name == request.dataset_name]
+
+    report = DuplicatesReport(
+        dataset_name=request.dataset_name,
+        images=len(images),
+        unique_contents=len(exact) + sum(1 for record in records if record["content_id"] is None),
+        exact=[
+            DuplicateGroup(images=list(group.values()), content_hash=content_hash)
+            for content_hash, group in exact.values()
+            if len(group) > 1
+        ],
+        near=[
+            DuplicateGroup(
+                images=[image for content_id in content_ids for image in members[content_id]],
+                distance=distance,
+            )
+            for content_ids, distance in near_duplicate_groups(dhashes, request.max_distance)
+        ],
+    )
+
+    return TenyksResponse(response=TenyksSuccess(result=report))
+
+
+def _image_from_dto(dto: ImageDto) -> Image:
+    return Image(
+        id=dto.id,
+        name=dto.name,
+        url=dto.images_path,
+        dataset_name=dto.dataset_name,
+        annotations=Annotations(
+            bboxes=dto.bboxes,
+            categories=dto.categories,
+        ),
+        width=dto.width,
+        height=dto.height,
+        channels=dto.channels,
+        format=dto.format,
+        byte_size=dto.byte_size,
+        content_hash=dto.content_hash,
+        dhash=dto.dhash,
+    )
+
+
 # @router.get(
 #     "/{image_id}",
 #     response_model=Image,
@@ -71,7 +311,7 @@ async def get_dataset_by_name(
 ) -> TenyksResponse:
     """Get an image from a dataset based on a known image id."""
     
-    image_dto = await images_repo.get_image_by_name(image_name)
+    image_dto = await images_repo.get_image_by_name(dataset_name=dataset_name, image_name=image_name)
     print(image_dto)
     print(image_dto)
     print(image_dto)
@@ -84,7 +324,7 @@ async def get_dataset_by_name(
                 url=image_dto.images_path,
                 dataset_name=image_dto.dataset_name,
                 annotations=Annotations(
-                    bboxes=[json.loads(bbox) for bbox in image_dto.bboxes],
+                    bboxes=image_dto.bboxes,
                     categories=image_dto.categories,
                 ),
             )
@@ -112,6 +352,23 @@ async def post_image(
 
     return dataset
 
+@router.post(
+    "/bulk",
+    response_model=TenyksResponse,
+    status_code=201,
+)
+async def post_images_bulk(
+    request: TenyksImagesBulkRequest,
+    images_repo: ImagesRepository = Depends(get_repository(ImagesRepository)),
+) -> TenyksResponse:
+    """Post a batch of images for a single dataset, skipping unchanged ones and updating changed ones."""
+
+    summary = await images_repo.create_images(
+        dataset_name=request.dataset_name, images=request.images
+    )
+
+    return TenyksResponse(response=TenyksSuccess(result=summary))
+
 @router.post(
     "/model",
     response_model=Image,
@@ -139,11 +396,19 @@ async def post_image(
         )
     elif extraction_type == ExtractionTypes.HEATMAP:
         dataset = await images_repo.create_model_image_heatmap(
-            image_id=image_id, model_name=model_name, result_path=path_to_extraction_result
+            image_id=image_id,
+            model_name=model_name,
+            result_path=path_to_extraction_result,
+            dtype=request.result_dtype,
+            shape=request.result_shape,
         )
     elif extraction_type == ExtractionTypes.ACTIVATIONS:
         dataset = await images_repo.create_model_image_activations(
-            image_id=image_id, model_name=model_name, result_path=path_to_extraction_result
+            image_id=image_id,
+            model_name=model_name,
+            result_path=path_to_extraction_result,
+            dtype=request.result_dtype,
+            shape=request.result_shape,
         )
     else:
         raise("Extraction type doesn't exist")
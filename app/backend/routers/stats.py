@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Response
+
+from shared.database import statements
+from shared.metadata_cache import metadata_caches
+from shared.types_common import TenyksResponse, TenyksSuccess
+
+router = APIRouter(
+    prefix="/api/stats",
+    tags=["stats"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get(
+    "/statements",
+    response_model=TenyksResponse,
+    status_code=200,
+)
+async def get_statement_stats() -> TenyksResponse:
+    """Get call counts and timings of every named repository statement, slowest in total first."""
+
+    return TenyksResponse(response=TenyksSuccess(result=statements.stats()))
+
+
+@router.delete(
+    "/statements",
+    status_code=204,
+)
+async def reset_statement_stats() -> Response:
+    """Reset the statement call counts and timings."""
+
+    statements.reset_stats()
+    return Response(status_code=204)
+
+
+@router.get(
+    "/caches",
+    response_model=TenyksResponse,
+    status_code=200,
+)
+async def get_cache_stats() -> TenyksResponse:
+    """Get the size, hit rate and invalidations of every metadata cache."""
+
+    return TenyksResponse(response=TenyksSuccess(result=metadata_caches.stats()))
+
+
+@router.delete(
+    "/caches",
+    status_code=204,
+)
+async def reset_cache_stats() -> Response:
+    """Reset the metadata cache counters, keeping the cached entries."""
+
+    metadata_caches.reset_stats()
+    return Response(status_code=204)
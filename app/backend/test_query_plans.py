@@ -0,0 +1,67 @@
+import json
+import os
+import asyncpg
+import pytest
+
+from backend.repos.datasets_repo import _DATASET_BY_NAME_QUERY
+from backend.repos.images_repo import (
+    _EXISTING_IMAGES_QUERY,
+    _IMAGE_BY_NAME_QUERY,
+    _IMAGE_CONTENTS_QUERY,
+    _IMAGES_BY_ID_QUERY,
+    _MODEL_IMAGE_BBOXES_QUERY,
+    _images_by_bbox_query,
+)
+from backend.repos.models_repo import _MODEL_BY_NAME_QUERY
+
+"""
+Plan regression tests for the hot repository queries.
+
+Sequential scans are disabled for the session, so the planner only falls back to one
+when no index can serve a query. On a near empty test schema that makes the plan
+independent of table sizes: a Seq Scan in the plan means an index is missing.
+"""
+
+HOT_QUERIES = {
+    "images_page": (f"{_IMAGES_BY_ID_QUERY} LIMIT $3", ["human_dataset", 0, 1000]),
+    "image_by_name": (_IMAGE_BY_NAME_QUERY, ["human_dataset", "11.jpg"]),
+    "existing_images_for_ingest": (_EXISTING_IMAGES_QUERY, [1, ["11.jpg", "12.jpg"]]),
+    "image_contents": (_IMAGE_CONTENTS_QUERY, ["human_dataset"]),
+    "model_image_bboxes": (_MODEL_IMAGE_BBOXES_QUERY, [1, 1]),
+    "bbox_region": _images_by_bbox_query("human_dataset", region=[0, 0, 20, 20]),
+    "model_bbox_area": _images_by_bbox_query("human_dataset", model_name="Hybrid Model", min_area=400),
+    "dataset_by_name": (_DATASET_BY_NAME_QUERY, ["human_dataset"]),
+    "model_by_name": (_MODEL_BY_NAME_QUERY, ["Hybrid Model"]),
+}
+
+
+@pytest.fixture
+async def conn():
+    if not os.getenv("PSQL_DATABASE") or not os.getenv("PSQL_SCHEMA"):
+        pytest.skip("PSQL_DATABASE and PSQL_SCHEMA must point at a database loaded with the test schema")
+
+    conn = await asyncpg.connect(
+        user=os.getenv("PSQL_USERNAME"),
+        password=os.getenv("PSQL_PASSWORD"),
+        host=os.getenv("PSQL_HOST", "postgres"),
+        database=os.getenv("PSQL_DATABASE"),
+        server_settings={"search_path": os.getenv("PSQL_SCHEMA"), "enable_seqscan": "off"},
+    )
+    yield conn
+    await conn.close()
+
+
+def _seq_scans(plan: dict) -> list:
+    scans = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        scans.extend(_seq_scans(child))
+    return scans
+
+
+@pytest.mark.parametrize("query_name", list(HOT_QUERIES))
+async def test_hot_query_does_not_seq_scan(conn, query_name):
+    query, args = HOT_QUERIES[query_name]
+    explain = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    plan = json.loads(explain)[0]["Plan"]
+
+    assert _seq_scans(plan) == []
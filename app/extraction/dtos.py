@@ -0,0 +1,36 @@
+from datetime import datetime
+from pydantic.dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ExtractionJobDto:
+    """DTO used to represent an extraction job row"""
+
+    id: int
+    status: str
+    dataset_name: str
+    model_name: str
+    extraction_type: str
+    image_name: Optional[str]
+    total: Optional[int]
+    done: int
+    failed: int
+    summary: Optional[str]
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+
+@dataclass
+class CachedResultDto:
+    """DTO used to represent an image and its cached extraction result, if there is one"""
+
+    image_id: int
+    content_hash: Optional[str]
+    cached: bool
+    result_path: Optional[str]
+    dtype: Optional[str]
+    shape: Optional[str]
+    predictions: Optional[str]
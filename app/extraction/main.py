@@ -1,5 +1,18 @@
 from .routers import extract
+from .services.executor import extraction_executor
+from .services.jobs import extraction_jobs
 from shared.utils_fastapi import create_app
 
 
-app = create_app(routers = [extract.router])
\ No newline at end of file
+app = create_app(routers = [extract.router])
+
+
+async def start_extraction_jobs() -> None:
+    await extraction_jobs.start(app.state.pool)
+
+
+app.add_event_handler("startup", extraction_executor.start)
+app.add_event_handler("startup", start_extraction_jobs)
+app.add_event_handler("shutdown", extraction_executor.shutdown)
+# Running jobs write their final state through the pool, so stop them before it closes
+app.router.on_shutdown.insert(0, extraction_jobs.stop)
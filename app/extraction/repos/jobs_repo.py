@@ -0,0 +1,180 @@
+from typing import Optional
+from asyncpg.connection import Connection
+from shared.database import BaseRepository, typed_fetch
+from shared.view_models import JobStatus
+from ..dtos import ExtractionJobDto
+
+# Error recorded on jobs the service stopped before they finished
+INTERRUPTED_JOB_ERROR = "Interrupted by a restart of the extraction service"
+
+
+class JobsRepository(BaseRepository):
+    """Jobs repository used to track background extractions"""
+
+    def __init__(self, conn: Connection) -> None:
+        super().__init__(conn)
+
+    async def get_job(self, job_id: int) -> Optional[ExtractionJobDto]:
+        """Get a job based on its id"""
+
+        query_string = f"""
+            SELECT
+                j.id,
+                j.status,
+                d.dataset_name,
+                m.name model_name,
+                j.extraction_type,
+                j.image_name,
+                j.total,
+                j.done,
+                j.failed,
+                j.summary::text summary,
+                j.error,
+                j.created_at,
+                j.started_at,
+                j.finished_at
+            FROM extraction_job j
+            JOIN dataset d ON j.dataset_id=d.id
+            JOIN model m ON j.model_id=m.id
+            WHERE j.id=$1;
+        """
+        result = await typed_fetch(self.connection, ExtractionJobDto, query_string, job_id, statement="jobs.get_job")
+        return result[0] if result else None
+
+    async def count_images(self, dataset_name: str) -> int:
+        """Count the images of a dataset"""
+
+        count_images_query_string = f"""
+            SELECT count(*)
+            FROM image im
+            JOIN dataset d ON im.dataset_id=d.id
+            WHERE d.dataset_name=$1;
+        """
+        return await self.fetchval("jobs.count_images", count_images_query_string, dataset_name)
+
+    async def create_job(
+        self, dataset_name: str, model_name: str, extraction_type: str, image_name: Optional[str]
+    ) -> Optional[int]:
+        """
+        Create a queued job, or nothing if the dataset or the model is unknown. Of several
+        datasets sharing the name, the first one created is used.
+        """
+
+        job_insert_query_string = f"""
+            WITH d AS (
+                SELECT id
+                FROM dataset
+                WHERE dataset_name=$1
+                ORDER BY id
+                LIMIT 1
+            )
+            INSERT INTO extraction_job(dataset_id, model_id, extraction_type, image_name)
+            SELECT d.id, m.id, $3, $4
+            FROM d, model m
+            WHERE m.name=$2
+            RETURNING id;
+        """
+        return await self.fetchval(
+            "jobs.job_insert",
+            job_insert_query_string,
+            dataset_name,
+            model_name,
+            extraction_type,
+            image_name,
+        )
+
+    async def start_job(self, job_id: int, total: int) -> bool:
+        """Move a queued job to running, unless it was cancelled before it started"""
+
+        job_start_query_string = f"""
+            UPDATE extraction_job
+            SET status=$2, total=$3, started_at=now()
+            WHERE id=$1 AND status=$4
+            RETURNING id;
+        """
+        started = await self.fetchval(
+            "jobs.job_start",
+            job_start_query_string,
+            job_id,
+            JobStatus.RUNNING.value,
+            total,
+            JobStatus.QUEUED.value,
+        )
+        return started is not None
+
+    async def update_progress(self, job_id: int, done: int, failed: int) -> None:
+        job_progress_query_string = f"""
+            UPDATE extraction_job
+            SET done=$2, failed=$3
+            WHERE id=$1 AND status=$4;
+        """
+        await self.execute(
+            "jobs.job_progress",
+            job_progress_query_string,
+            job_id,
+            done,
+            failed,
+            JobStatus.RUNNING.value,
+        )
+
+    async def finish_job(
+        self,
+        job_id: int,
+        status: JobStatus,
+        done: int,
+        failed: int,
+        summary: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Record the final state of a running job, a job cancelled meanwhile stays cancelled"""
+
+        job_finish_query_string = f"""
+            UPDATE extraction_job
+            SET status=$2, done=$3, failed=$4, summary=$5::json, error=$6, finished_at=now()
+            WHERE id=$1 AND status = ANY($7::varchar[]);
+        """
+        await self.execute(
+            "jobs.job_finish",
+            job_finish_query_string,
+            job_id,
+            status.value,
+            done,
+            failed,
+            summary,
+            error,
+            [JobStatus.RUNNING.value, status.value],
+        )
+
+    async def cancel_job(self, job_id: int) -> bool:
+        """Mark a queued or running job cancelled, returning False if it had already finished"""
+
+        job_cancel_query_string = f"""
+            UPDATE extraction_job
+            SET status=$2, finished_at=now()
+            WHERE id=$1 AND status = ANY($3::varchar[])
+            RETURNING id;
+        """
+        cancelled = await self.fetchval(
+            "jobs.job_cancel",
+            job_cancel_query_string,
+            job_id,
+            JobStatus.CANCELLED.value,
+            [JobStatus.QUEUED.value, JobStatus.RUNNING.value],
+        )
+        return cancelled is not None
+
+    async def fail_interrupted_jobs(self) -> None:
+        """Fail the jobs a previous run of the service left queued or running"""
+
+        jobs_interrupted_query_string = f"""
+            UPDATE extraction_job
+            SET status=$1, error=$3, finished_at=now()
+            WHERE status = ANY($2::varchar[]);
+        """
+        await self.execute(
+            "jobs.jobs_interrupted",
+            jobs_interrupted_query_string,
+            JobStatus.FAILED.value,
+            [JobStatus.QUEUED.value, JobStatus.RUNNING.value],
+            INTERRUPTED_JOB_ERROR,
+        )
@@ -0,0 +1,24 @@
+from typing import Optional
+from asyncpg.connection import Connection
+from shared.database import BaseRepository, typed_fetch
+from shared.view_models import Model
+
+
+class ModelsRepository(BaseRepository):
+    """Models repository used to resolve the models an extraction runs"""
+
+    def __init__(self, conn: Connection) -> None:
+        super().__init__(conn)
+
+    async def get_model_by_name(self, name: str) -> Optional[Model]:
+        """Get a registered model based on its name"""
+
+        query_string = f"""
+            SELECT
+                mo.id,
+                mo.name
+            FROM model mo
+            WHERE mo.name=$1;
+        """
+        result = await typed_fetch(self.connection, Model, query_string, name, statement="models.get_model_by_name")
+        return result[0] if result else None
@@ -0,0 +1,126 @@
+from datetime import timedelta
+from typing import List, Optional
+from asyncpg.connection import Connection
+from shared.database import BaseRepository, typed_fetch
+from ..dtos import CachedResultDto
+
+
+class ResultsRepository(BaseRepository):
+    """Results repository used to reuse extraction results across datasets and runs"""
+
+    def __init__(self, conn: Connection) -> None:
+        super().__init__(conn)
+
+    async def get_cached_results(
+        self, image_ids: List[int], model_name: str, extraction_type: str, params_hash: str
+    ) -> List[CachedResultDto]:
+        """Get the content hash of every image, along with its cached result if there is one"""
+
+        query_string = f"""
+            SELECT
+                im.id image_id,
+                ic.content_hash,
+                c.model_id IS NOT NULL cached,
+                c.result_path,
+                c.dtype,
+                c.shape::text shape,
+                c.predictions::text predictions
+            FROM image im
+            LEFT JOIN image_content ic ON im.content_id=ic.id
+            LEFT JOIN (
+                extraction_result_cache c
+                JOIN model m ON c.model_id=m.id AND m.name=$2
+            ) ON c.content_hash=ic.content_hash AND c.extraction_type=$3 AND c.params_hash=$4
+            WHERE im.id = ANY($1::int[]);
+        """
+        return await typed_fetch(
+            self.connection, CachedResultDto, query_string, image_ids, model_name, extraction_type, params_hash,
+            statement="results.get_cached_results",
+        )
+
+    async def touch_results(
+        self, content_hashes: List[str], model_name: str, extraction_type: str, params_hash: str
+    ) -> None:
+        """Mark cached results as used so garbage collection keeps them"""
+
+        results_touch_query_string = f"""
+            UPDATE extraction_result_cache c
+            SET last_used_at=now()
+            FROM model m
+            WHERE c.model_id=m.id AND m.name=$2 AND c.extraction_type=$3 AND c.params_hash=$4
+                AND c.content_hash = ANY($1::varchar[]);
+        """
+        await self.execute(
+            "results.results_touch",
+            results_touch_query_string,
+            content_hashes,
+            model_name,
+            extraction_type,
+            params_hash,
+        )
+
+    async def store_result(
+        self,
+        content_hash: str,
+        model_name: str,
+        extraction_type: str,
+        params_hash: str,
+        result_path: Optional[str] = None,
+        dtype: Optional[str] = None,
+        shape: Optional[str] = None,
+        predictions: Optional[str] = None,
+    ) -> None:
+        """Create or replace the cached result of an image content for a model"""
+
+        result_insert_query_string = f"""
+            INSERT INTO extraction_result_cache(
+                model_id, content_hash, extraction_type, params_hash, result_path, dtype, shape, predictions
+            )
+            SELECT m.id, $1, $3, $4, $5, $6, $7::json, $8::json
+            FROM model m
+            WHERE m.name=$2
+            ON CONFLICT (model_id, content_hash, extraction_type, params_hash) DO UPDATE
+            SET result_path=EXCLUDED.result_path,
+                dtype=EXCLUDED.dtype,
+                shape=EXCLUDED.shape,
+                predictions=EXCLUDED.predictions,
+                created_at=now(),
+                last_used_at=now();
+        """
+        await self.execute(
+            "results.result_insert",
+            result_insert_query_string,
+            content_hash,
+            model_name,
+            extraction_type,
+            params_hash,
+            result_path,
+            dtype,
+            shape,
+            predictions,
+        )
+
+    async def delete_orphaned_results(self, max_age: timedelta) -> List[Optional[str]]:
+        """
+        Delete cached results no image content points at any more, or unused for longer than
+        max_age, unless a stored model result still references their object. Returns the
+        object paths of the deleted entries.
+        """
+
+        results_gc_query_string = f"""
+            DELETE FROM extraction_result_cache c
+            WHERE (
+                c.last_used_at < now() - $1::interval
+                OR NOT EXISTS (
+                    SELECT 1
+                    FROM image_content ic
+                    JOIN image im ON im.content_id=ic.id
+                    WHERE ic.content_hash=c.content_hash
+                )
+            )
+            AND NOT EXISTS (SELECT 1 FROM model_image_heatmap mih WHERE mih.result_path=c.result_path)
+            AND NOT EXISTS (SELECT 1 FROM model_image_activations mia WHERE mia.result_path=c.result_path)
+            RETURNING c.result_path;
+        """
+        records = await self.fetch("results.results_gc", results_gc_query_string, max_age)
+        return [record["result_path"] for record in records]
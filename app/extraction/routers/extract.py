@@ -1,29 +1,20 @@
 
 from __future__ import annotations
-import io
-import json
-import os
-import re
-from fastapi import APIRouter, Depends
-from typing import List
-import requests
-
-from shared.encoders import NumpyEncoder
-from shared.s3_utils import s3_download_files, s3_download_file, AwsConfig
-from shared.view_models import Annotations, Image
-from shared.request_handlers import get_async_request_handler, post_async_request_handler
+from fastapi import APIRouter, Depends, Request
+
+from shared.database import get_repository
+from shared.exception_handlers import TenyksException
+from shared.view_models import JobStatus
 from shared.types_common import (
-    ExtractionTypes,
-    ImageSearchFilter,
     StatusGroup,
     TenyksError,
     TenyksExtractionRequest,
-    TenyksImagesRequest,
-    TenyksModelImagesRequest,
     TenyksResponse,
     TenyksSuccess,
 )
-from ..services.ml_extract_service import dispatch_extractor_service
+from ..repos.models_repo import ModelsRepository
+from ..services.dataset_extraction import build_extraction, collect_result_garbage
+from ..services.jobs import extraction_jobs
 
 router = APIRouter(
     prefix="/api/extract",
@@ -31,108 +22,90 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-backend_base_url = os.environ.get("BACKEND_BASE_URL", 'http://localhost:5000')
-
-awsConfig = AwsConfig(
-    endpoint_url=os.environ.get("AWS_ENDPOINT"),
-    region_name=os.environ.get("AWS_REGION"),
-    aws_access_key_id=os.environ.get("MINIO_ROOT_USER"),
-    aws_secret_access_key=os.environ.get("MINIO_ROOT_PASSWORD"),
-)
 
 @router.post("", response_model=TenyksResponse, status_code=201, )
-async def post_dataset(request: TenyksExtractionRequest) -> TenyksResponse:
+async def post_dataset(
+    request: TenyksExtractionRequest,
+    http_request: Request,
+    models_repo: ModelsRepository = Depends(get_repository(ModelsRepository)),
+) -> TenyksResponse:
     """
     On receiving an HTTP POST from the SDK user interface here, route a 
     call to the backend to gather all the necessary data for the single image for ML extraction
     """
 
-    extraction_type = request.type
-    dataset_name = request.dataset_name
-    model_name = request.model_name
-    image_search_filter = request.image_search_filter
-    image_name = request.image_name
-
-    ################# Call /images/all or images/{name} endpoint
-    images_endpoint = f"{backend_base_url}/images"
-    images_request = TenyksImagesRequest(dataset_name=dataset_name, image_name=image_name)
-  
-    try:
-        if image_search_filter == ImageSearchFilter.ALL:
-            url = f"{images_endpoint}/{image_search_filter}"
-            images_response = await post_async_request_handler(url=url, request=images_request)
-            list_of_image_dicts = json.loads(images_response.text)["response"]["result"]
-        elif image_search_filter == ImageSearchFilter.SINGLE:
-            images_response = await get_async_request_handler(url=images_endpoint, request=images_request)
-            list_of_image_dicts = [json.loads(images_response.text)["response"]["result"]]
-        else:
-            raise "Unknown search filter {image_search_filter}"
-    except Exception as e:
-        print(e)
-        images_response = []
-    
-    print(list_of_image_dicts)
-    print(type(list_of_image_dicts))
-    images = [
-        Image(
-            id=image_dict["id"],
-            name=image_dict["name"],
-            url=image_dict["url"],
-            dataset_name=image_dict["dataset_name"],
-            annotations=image_dict["annotations"],
-
-        ) 
-        for image_dict in list_of_image_dicts 
-    ]
-
-    img_path = f"{images[0].url}/{images[0].name}"
-    
-
-    ################# We got the image paths so do the actual ML processing...
-    
-    for image in images:
-        try:
-            img_path = f"{image.url}/{image.name}"
-            result = await s3_download_file(aws_config=awsConfig, file_path=img_path)
-
-            # Can be any of annotations(bboxes+categories), heatmap or activations
-            ml_extraction_result = dispatch_extractor_service(
-                model_id=0,
-                extraction_type=extraction_type,
-                img_path=result.content
-            )
-            
-            #TODO!!!!! UPLOAD ML RESULTS TO S3 !!!!!
-        except Exception as e:
-            print(e)      
-            result = io.BytesIO()
-        print(image)
-        print(image)
-        print(image)
-        print(image)
-
-        # Now update model output related image DB tables
-        model_images_request = TenyksModelImagesRequest(
-            image_id=image.id,
-            model_name=model_name,
-            dataset_name=dataset_name,
-            extraction_type=extraction_type,
-            result_path='dummy_path_1',
-            model_annotations=Annotations(
-                bboxes=[bbox for bbox in ml_extraction_result['bbox']],
-                categories=[cat for cat in ml_extraction_result['category_id']],
-            ) if extraction_type==ExtractionTypes.PREDICTIONS else None
+    model = await models_repo.get_model_by_name(request.model_name)
+    if model is None:
+        raise TenyksException(f"Unknown model {request.model_name}")
+
+    summary = await build_extraction(request, http_request.app.state.pool).run()
+
+    return TenyksResponse(response=TenyksSuccess(result=summary))
+
+
+@router.post("/jobs", response_model=TenyksResponse, status_code=202, )
+async def post_extraction_job(request: TenyksExtractionRequest) -> TenyksResponse:
+    """Queue an extraction as a background job and return it straight away"""
+
+    job_id = await extraction_jobs.submit(request)
+    if job_id is None:
+        error = TenyksError(
+            message=f"Unknown dataset {request.dataset_name} or model {request.model_name}",
+            type=StatusGroup.CLIENT_ERROR,
         )
-        try:
-            # Call to /images/model endpoint#    
-            model_images_endpoint = f"{images_endpoint}/model"
-            images_response = await post_async_request_handler(url=model_images_endpoint, request=model_images_request)
-        except Exception as e:
-            print(e)
-            TenyksResponse(
-                response=TenyksError(
-                    message="There was an error with the request: {e}",
-                    type= StatusGroup.INTERNAL_ERROR
-                )
-            )
-        return TenyksResponse(response=TenyksSuccess(result=ml_extraction_result))
\ No newline at end of file
+        return TenyksResponse(response=error)
+
+    job = await extraction_jobs.get(job_id)
+    return TenyksResponse(response=TenyksSuccess(result=job))
+
+
+@router.get("/jobs/{job_id}", response_model=TenyksResponse, status_code=200, )
+async def get_extraction_job(job_id: int) -> TenyksResponse:
+    """Status and progress of an extraction job"""
+
+    job = await extraction_jobs.get(job_id)
+    if job is None:
+        return TenyksResponse(response=_unknown_job(job_id))
+
+    return TenyksResponse(response=TenyksSuccess(result=job))
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=TenyksResponse, status_code=200, )
+async def cancel_extraction_job(job_id: int) -> TenyksResponse:
+    """Cancel a queued or running extraction job"""
+
+    if not await extraction_jobs.cancel(job_id):
+        job = await extraction_jobs.get(job_id)
+        if job is None:
+            return TenyksResponse(response=_unknown_job(job_id))
+        error = TenyksError(message=f"Extraction job {job_id} already {job.status.value}", type=StatusGroup.CLIENT_ERROR)
+        return TenyksResponse(response=error)
+
+    job = await extraction_jobs.get(job_id)
+    return TenyksResponse(response=TenyksSuccess(result=job))
+
+
+@router.get("/jobs/{job_id}/results", response_model=TenyksResponse, status_code=200, )
+async def get_extraction_job_results(job_id: int) -> TenyksResponse:
+    """Summary of a finished extraction job"""
+
+    job = await extraction_jobs.get(job_id)
+    if job is None:
+        return TenyksResponse(response=_unknown_job(job_id))
+    if job.status != JobStatus.SUCCEEDED:
+        error = TenyksError(message=f"Extraction job {job_id} is {job.status.value}", type=StatusGroup.CLIENT_ERROR)
+        return TenyksResponse(response=error)
+
+    return TenyksResponse(response=TenyksSuccess(result=job.summary))
+
+
+@router.post("/cache/gc", response_model=TenyksResponse, status_code=200, )
+async def collect_cache_garbage(http_request: Request) -> TenyksResponse:
+    """Drop orphaned or long unused cached results along with their stored objects"""
+
+    summary = await collect_result_garbage(http_request.app.state.pool)
+    return TenyksResponse(response=TenyksSuccess(result=summary))
+
+
+def _unknown_job(job_id: int) -> TenyksError:
+    return TenyksError(message=f"Unknown extraction job {job_id}", type=StatusGroup.CLIENT_ERROR)
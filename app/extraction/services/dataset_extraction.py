@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import AsyncIterable, List, Optional
+from asyncpg.pool import Pool
+
+from shared.array_codec import CONTENT_TYPE
+from shared.exception_handlers import TenyksException
+from shared.request_handlers import (
+    get_async_request_handler,
+    post_async_request_handler,
+    stream_async_request_handler,
+)
+from shared.heatmap_tiles import HEATMAP_TILE_SIZE
+from shared.s3_utils import s3_delete_files, s3_download_file, s3_upload_file, AwsConfig, DEFAULT_DOWNLOAD_CONCURRENCY
+from shared.types_common import (
+    ExtractionTypes,
+    ImageSearchFilter,
+    TenyksExtractionRequest,
+    TenyksImagesRequest,
+    TenyksModelImagesRequest,
+)
+from shared.view_models import Annotations, ExtractionSummary, Image, ResultCacheGcSummary
+from ..repos.results_repo import ResultsRepository
+from .executor import EXTRACTION_WORKERS, extraction_executor
+from .ml_extract_service import EXTRACTION_RESULT_COMPRESSION, EXTRACTION_RESULT_QUANTIZATION
+from .pipeline import Pipeline, Stage
+
+backend_base_url = os.environ.get("BACKEND_BASE_URL", 'http://localhost:5000')
+
+# Images handed to the model in one call, same shaped images within a batch run stacked
+EXTRACTION_BATCH_SIZE = int(os.environ.get("EXTRACTION_BATCH_SIZE", 16))
+
+# Images looked up in the result cache per query
+EXTRACTION_LOOKUP_BATCH_SIZE = int(os.environ.get("EXTRACTION_LOOKUP_BATCH_SIZE", 64))
+
+# Cached results unused for this many days are dropped by garbage collection
+EXTRACTION_CACHE_MAX_AGE = timedelta(days=float(os.environ.get("EXTRACTION_CACHE_MAX_AGE_DAYS", 30)))
+
+# Bump when the stored result layout changes so older cached results are not reused
+RESULT_FORMAT_VERSION = 1
+
+# Workers per extraction pipeline stage
+EXTRACTION_LOOKUP_CONCURRENCY = int(os.environ.get("EXTRACTION_LOOKUP_CONCURRENCY", 2))
+EXTRACTION_DOWNLOAD_CONCURRENCY = int(os.environ.get("EXTRACTION_DOWNLOAD_CONCURRENCY", DEFAULT_DOWNLOAD_CONCURRENCY))
+EXTRACTION_COMPUTE_CONCURRENCY = int(os.environ.get("EXTRACTION_COMPUTE_CONCURRENCY", EXTRACTION_WORKERS))
+EXTRACTION_UPLOAD_CONCURRENCY = int(os.environ.get("EXTRACTION_UPLOAD_CONCURRENCY", 8))
+EXTRACTION_PERSIST_CONCURRENCY = int(os.environ.get("EXTRACTION_PERSIST_CONCURRENCY", 8))
+
+awsConfig = AwsConfig(
+    endpoint_url=os.environ.get("AWS_ENDPOINT"),
+    region_name=os.environ.get("AWS_REGION"),
+    aws_access_key_id=os.environ.get("MINIO_ROOT_USER"),
+    aws_secret_access_key=os.environ.get("MINIO_ROOT_PASSWORD"),
+)
+
+
+@dataclass
+class StoredResult:
+    """Where an extraction result lives, whether it was just computed or found in the cache"""
+
+    result_path: Optional[str] = None
+    dtype: Optional[str] = None
+    shape: Optional[list] = None
+    predictions: Optional[dict] = None
+
+
+@dataclass
+class DatasetExtraction:
+    """An extraction pipeline, the images to run through it and how many results came from the cache"""
+
+    pipeline: Pipeline
+    images: AsyncIterable[Image]
+    cached: int = 0
+
+    async def run(self) -> ExtractionSummary:
+        stages = await self.pipeline.run(self.images)
+        return ExtractionSummary(
+            images=stages[-1].items_out,
+            failed=sum(stage.failed for stage in stages),
+            cached=self.cached,
+            stages=stages,
+        )
+
+
+def build_extraction(request: TenyksExtractionRequest, pool: Pool) -> DatasetExtraction:
+    """
+    Build the lookup, download, compute, upload and persist pipeline for an extraction request,
+    along with the stream of images to run through it.
+
+    Results are cached on (model, image content hash, extraction type, result parameters), so
+    images already extracted by the model, in this dataset or any other one, skip the download,
+    model call and upload unless the request forces a recompute.
+    """
+
+    extraction_type = request.type
+    dataset_name = request.dataset_name
+    model_name = request.model_name
+    image_search_filter = request.image_search_filter
+    image_name = request.image_name
+    params_hash = _params_hash(extraction_type)
+
+    ################# Call /images/all or images/{name} endpoint
+    images_endpoint = f"{backend_base_url}/images"
+    images_request = TenyksImagesRequest(dataset_name=dataset_name, image_name=image_name)
+  
+    if image_search_filter == ImageSearchFilter.ALL:
+        image_dicts = stream_async_request_handler(url=f"{images_endpoint}/stream", request=images_request)
+    elif image_search_filter == ImageSearchFilter.SINGLE:
+        image_dicts = _get_single_image_dict(images_endpoint=images_endpoint, images_request=images_request)
+    else:
+        raise TenyksException(f"Unknown search filter {image_search_filter}")
+
+    ################# We got the image paths so do the actual ML processing...
+
+    async def images():
+        async for image_dict in image_dicts:
+            yield Image(
+                id=image_dict["id"],
+                name=image_dict["name"],
+                url=image_dict["url"],
+                dataset_name=image_dict["dataset_name"],
+                annotations=image_dict["annotations"],
+                width=image_dict.get("width"),
+                height=image_dict.get("height"),
+                channels=image_dict.get("channels"),
+                format=image_dict.get("format"),
+                byte_size=image_dict.get("byte_size"),
+                content_hash=image_dict.get("content_hash"),
+            )
+
+    async def lookup(batch: List[Image]) -> list:
+        async with pool.acquire() as conn:
+            results_repo = ResultsRepository(conn)
+            dtos = await results_repo.get_cached_results(
+                [image.id for image in batch], model_name, extraction_type.value, params_hash
+            )
+            hits = [] if request.force_recompute else [dto.content_hash for dto in dtos if dto.cached]
+            if hits:
+                await results_repo.touch_results(hits, model_name, extraction_type.value, params_hash)
+
+        dtos_by_id = {dto.image_id: dto for dto in dtos}
+        items = []
+        for image in batch:
+            dto = dtos_by_id.get(image.id)
+            content_hash = dto.content_hash if dto is not None else None
+            stored = None
+            if dto is not None and dto.cached and not request.force_recompute:
+                stored = StoredResult(
+                    result_path=dto.result_path,
+                    dtype=dto.dtype,
+                    shape=None if dto.shape is None else json.loads(dto.shape),
+                    predictions=None if dto.predictions is None else json.loads(dto.predictions),
+                )
+                extraction.cached += 1
+            items.append((image, content_hash, stored))
+
+        return items
+
+    async def download(item):
+        image, content_hash, stored = item
+        if stored is not None:
+            return image, content_hash, stored, None
+
+        downloaded = await s3_download_file(file_path=f"{image.url}/{image.name}", aws_config=awsConfig)
+        return image, content_hash, None, downloaded.content
+
+    async def compute(batch: list) -> list:
+        # Can be any of annotations(bboxes+categories), heatmap or activations
+        misses = [item for item in batch if item[2] is None]
+        results = iter(await extraction_executor.run_batch(
+            model_name=model_name,
+            extraction_type=extraction_type,
+            contents=[content for *_, content in misses],
+        ) if misses else [])
+
+        computed = []
+        for image, content_hash, stored, _ in batch:
+            if stored is not None:
+                computed.append((image, content_hash, stored, None))
+                continue
+            result = next(results)
+            computed.append(None if result is None else (image, content_hash, None, result))
+
+        return computed
+
+    async def upload(item):
+        image, content_hash, stored, ml_extraction_result = item
+        if stored is not None:
+            return image, stored
+
+        if extraction_type == ExtractionTypes.PREDICTIONS:
+            stored = StoredResult(predictions=ml_extraction_result)
+        else:
+            encoded = ml_extraction_result.array
+            result_path = await s3_upload_file(
+                file_path=_result_path(
+                    model_name, extraction_type, dataset_name, image.name, content_hash, params_hash, encoded.extension
+                ),
+                content=encoded.content,
+                aws_config=awsConfig,
+                content_type=CONTENT_TYPE,
+            )
+            stored = StoredResult(result_path=result_path, dtype=encoded.dtype, shape=encoded.shape)
+
+        if content_hash is not None:
+            async with pool.acquire() as conn:
+                await ResultsRepository(conn).store_result(
+                    content_hash,
+                    model_name,
+                    extraction_type.value,
+                    params_hash,
+                    result_path=stored.result_path,
+                    dtype=stored.dtype,
+                    shape=None if stored.shape is None else json.dumps(stored.shape),
+                    predictions=None if stored.predictions is None else json.dumps(stored.predictions),
+                )
+
+        return image, stored
+
+    async def persist(item):
+        image, stored = item
+        response = await _post_model_image(
+            images_endpoint=images_endpoint,
+            image=image,
+            model_name=model_name,
+            dataset_name=dataset_name,
+            extraction_type=extraction_type,
+            stored=stored,
+        )
+        if not response.is_success:
+            raise TenyksException(f"Could not store {extraction_type} for {image.name}: {response.text}")
+        return image
+
+    pipeline = Pipeline([
+        Stage("lookup", lookup, concurrency=EXTRACTION_LOOKUP_CONCURRENCY, batch_size=EXTRACTION_LOOKUP_BATCH_SIZE),
+        Stage("download", download, concurrency=EXTRACTION_DOWNLOAD_CONCURRENCY),
+        Stage("compute", compute, concurrency=EXTRACTION_COMPUTE_CONCURRENCY, batch_size=EXTRACTION_BATCH_SIZE),
+        Stage("upload", upload, concurrency=EXTRACTION_UPLOAD_CONCURRENCY),
+        Stage("persist", persist, concurrency=EXTRACTION_PERSIST_CONCURRENCY),
+    ])
+    extraction = DatasetExtraction(pipeline=pipeline, images=images())
+    return extraction
+
+
+async def collect_result_garbage(pool: Pool, max_age: timedelta = EXTRACTION_CACHE_MAX_AGE) -> ResultCacheGcSummary:
+    """Drop orphaned or long unused cache entries and delete the objects only they referenced"""
+
+    async with pool.acquire() as conn:
+        result_paths = await ResultsRepository(conn).delete_orphaned_results(max_age)
+
+    object_paths = [path for path in result_paths if path is not None]
+    deleted = await s3_delete_files(object_paths, aws_config=awsConfig) if object_paths else 0
+    return ResultCacheGcSummary(entries=len(result_paths), objects=deleted)
+
+
+def _params_hash(extraction_type: ExtractionTypes) -> str:
+    """Hash of every setting that changes a stored result, so changing one misses the cache"""
+
+    params = {"format": RESULT_FORMAT_VERSION}
+    if extraction_type != ExtractionTypes.PREDICTIONS:
+        params["quantization"] = EXTRACTION_RESULT_QUANTIZATION.value
+        params["compression"] = EXTRACTION_RESULT_COMPRESSION
+    if extraction_type == ExtractionTypes.HEATMAP:
+        params["tile_size"] = HEATMAP_TILE_SIZE
+
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _result_path(
+    model_name: str,
+    extraction_type: ExtractionTypes,
+    dataset_name: str,
+    image_name: str,
+    content_hash: Optional[str],
+    params_hash: str,
+    extension: str,
+) -> str:
+    # Content addressed so every dataset holding the same image shares one object
+    if content_hash is not None:
+        return f"results/{model_name}/{extraction_type.value}/{content_hash}-{params_hash}.{extension}"
+    return f"results/{model_name}/{extraction_type.value}/{dataset_name}/{image_name}.{extension}"
+
+
+async def _post_model_image(
+    images_endpoint: str,
+    image: Image,
+    model_name: str,
+    dataset_name: str,
+    extraction_type: ExtractionTypes,
+    stored: StoredResult,
+):
+    """Update the model output related image DB tables with one extraction result"""
+
+    model_images_request = TenyksModelImagesRequest(
+        image_id=image.id,
+        model_name=model_name,
+        dataset_name=dataset_name,
+        extraction_type=extraction_type,
+        result_path=stored.result_path,
+        result_dtype=stored.dtype,
+        result_shape=stored.shape,
+        model_annotations=Annotations(
+            bboxes=[bbox for bbox in stored.predictions['bbox']],
+            categories=[cat for cat in stored.predictions['category_id']],
+        ) if extraction_type==ExtractionTypes.PREDICTIONS else None
+    )
+
+    # Call to /images/model endpoint#    
+    model_images_endpoint = f"{images_endpoint}/model"
+    return await post_async_request_handler(url=model_images_endpoint, request=model_images_request)
+
+
+async def _get_single_image_dict(images_endpoint: str, images_request: TenyksImagesRequest):
+    images_response = await get_async_request_handler(url=images_endpoint, request=images_request)
+    yield json.loads(images_response.text)["response"]["result"]
@@ -0,0 +1,117 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional
+
+from shared.types_common import ExtractionTypes
+from .ml_extract_service import dispatch_extractor_batch
+from .model_registry import EXTRACTION_WARM_MODELS, ModelRegistry
+
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+
+# Models loaded in a worker process, warmed by _init_worker
+_worker_models = ModelRegistry()
+
+
+def _init_worker(warm_models: List[str]) -> None:
+    _worker_models.warm(warm_models)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _run_extraction(model_name: str, extraction_type: ExtractionTypes, shm_name: str, sizes: List[int]) -> List[Any]:
+    """Run an extraction on a batch of images laid out back to back in shared memory, inside a worker"""
+
+    # Attaching registers the segment again with the resource tracker shared with the parent,
+    # which is a no-op, the parent unregisters it once when it unlinks the segment
+    shm = SharedMemory(name=shm_name)
+    images = []
+    try:
+        offset = 0
+        for size in sizes:
+            view = shm.buf[offset:offset + size]
+            try:
+                images.append(io.BytesIO(view))
+            finally:
+                view.release()
+            offset += size
+    finally:
+        shm.close()
+
+    return dispatch_extractor_batch(
+        model=_worker_models.get(model_name),
+        extraction_type=extraction_type,
+        img_paths=images,
+    )
+
+
+class ExtractionExecutor:
+    """
+    Runs CPU bound extraction in a pool of worker processes, each holding warm models.
+
+    Encoded images are copied once into a shared memory segment that the worker maps,
+    instead of being pickled through the pool's pipe, and decoding, inference and result
+    encoding all happen in the worker so the event loop only does I/O.
+    """
+
+    def __init__(self, workers: int = EXTRACTION_WORKERS, warm_models: List[str] = EXTRACTION_WARM_MODELS) -> None:
+        self._workers = workers
+        self._warm_models = warm_models
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def start(self) -> None:
+        """Start the workers and load their models before the first request arrives"""
+
+        if self._pool is not None:
+            return
+
+        # Workers must share this process' resource tracker rather than start their own, which
+        # would report every segment they attached to as leaked when they exit
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._workers, initializer=_init_worker, initargs=(self._warm_models,)
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, _warm_up) for _ in range(self._workers)])
+
+    def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, model_name: str, extraction_type: ExtractionTypes, content: io.BytesIO) -> Any:
+        """Run one extraction on an encoded image in a worker process"""
+
+        results = await self.run_batch(model_name, extraction_type, [content])
+        return results[0]
+
+    async def run_batch(self, model_name: str, extraction_type: ExtractionTypes, contents: List[io.BytesIO]) -> List[Any]:
+        """Run one extraction on a batch of encoded images in a single worker call"""
+
+        if self._pool is None:
+            await self.start()
+
+        sizes = [content.getbuffer().nbytes for content in contents]
+        shm = SharedMemory(create=True, size=max(sum(sizes), 1))
+        try:
+            offset = 0
+            for content, size in zip(contents, sizes):
+                with content.getbuffer() as buffer:
+                    shm.buf[offset:offset + size] = buffer
+                offset += size
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._pool, _run_extraction, model_name, extraction_type, shm.name, sizes
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+extraction_executor = ExtractionExecutor()
@@ -0,0 +1,176 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+from asyncpg.pool import Pool
+
+from shared.types_common import ImageSearchFilter, TenyksExtractionRequest
+from shared.view_models import ExtractionJob, ExtractionSummary, JobStatus, StageStats
+from ..dtos import ExtractionJobDto
+from ..repos.jobs_repo import INTERRUPTED_JOB_ERROR, JobsRepository
+from .dataset_extraction import build_extraction
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two progress writes of a running job
+EXTRACTION_JOB_PROGRESS_INTERVAL = float(os.environ.get("EXTRACTION_JOB_PROGRESS_INTERVAL", 2))
+
+
+class ExtractionJobs:
+    """
+    Runs extraction requests as background tasks and keeps their progress in the DB,
+    so a client can submit a job, poll it and fetch its results once it finished.
+
+    Jobs run in the extraction service process, a job still running when the service stops
+    is marked failed, as is one left queued or running by a crash on the next start.
+    """
+
+    def __init__(self) -> None:
+        self._pool: Optional[Pool] = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopping = False
+
+    async def start(self, pool: Pool) -> None:
+        self._pool = pool
+        async with pool.acquire() as conn:
+            await JobsRepository(conn).fail_interrupted_jobs()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, request: TenyksExtractionRequest) -> Optional[int]:
+        """Queue a job for the request, or nothing if its dataset or model is unknown"""
+
+        async with self._pool.acquire() as conn:
+            job_id = await JobsRepository(conn).create_job(
+                request.dataset_name,
+                request.model_name,
+                request.type.value,
+                request.image_name if request.image_search_filter == ImageSearchFilter.SINGLE else None,
+            )
+        if job_id is None:
+            return None
+
+        task = asyncio.create_task(self._run(job_id, request))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return job_id
+
+    async def cancel(self, job_id: int) -> bool:
+        """Cancel a queued or running job, returning False if it had already finished"""
+
+        async with self._pool.acquire() as conn:
+            cancelled = await JobsRepository(conn).cancel_job(job_id)
+        task = self._tasks.get(job_id)
+        if cancelled and task is not None:
+            task.cancel()
+        return cancelled
+
+    async def get(self, job_id: int) -> Optional[ExtractionJob]:
+        async with self._pool.acquire() as conn:
+            dto = await JobsRepository(conn).get_job(job_id)
+        return None if dto is None else _job_from_dto(dto)
+
+    async def _run(self, job_id: int, request: TenyksExtractionRequest) -> None:
+        stages: List[StageStats] = []
+        try:
+            async with self._pool.acquire() as conn:
+                jobs_repo = JobsRepository(conn)
+                if request.image_search_filter == ImageSearchFilter.SINGLE:
+                    total = 1
+                else:
+                    total = await jobs_repo.count_images(request.dataset_name)
+                if not await jobs_repo.start_job(job_id, total):
+                    return
+
+            extraction = build_extraction(request, self._pool)
+            stages = [stage.stats for stage in extraction.pipeline.stages]
+            reporter = asyncio.create_task(self._report_progress(job_id, stages))
+            try:
+                summary = await extraction.run()
+            finally:
+                reporter.cancel()
+
+            await self._finish(job_id, JobStatus.SUCCEEDED, stages, summary=summary)
+        except asyncio.CancelledError:
+            if self._stopping:
+                await asyncio.shield(self._finish(job_id, JobStatus.FAILED, stages, error=INTERRUPTED_JOB_ERROR))
+            else:
+                await asyncio.shield(self._finish(job_id, JobStatus.CANCELLED, stages))
+            raise
+        except Exception as exc:
+            logger.exception("Extraction job %s failed", job_id)
+            await self._finish(job_id, JobStatus.FAILED, stages, error=str(exc))
+
+    async def _report_progress(self, job_id: int, stages: List[StageStats]) -> None:
+        while True:
+            await asyncio.sleep(EXTRACTION_JOB_PROGRESS_INTERVAL)
+            done, failed = _progress(stages)
+            async with self._pool.acquire() as conn:
+                await JobsRepository(conn).update_progress(job_id, done, failed)
+
+    async def _finish(
+        self,
+        job_id: int,
+        status: JobStatus,
+        stages: List[StageStats],
+        summary: Optional[ExtractionSummary] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        done, failed = _progress(stages)
+        async with self._pool.acquire() as conn:
+            await JobsRepository(conn).finish_job(
+                job_id,
+                status,
+                done,
+                failed,
+                summary=None if summary is None else json.dumps(dataclasses.asdict(summary)),
+                error=error,
+            )
+
+
+def _progress(stages: List[StageStats]):
+    if not stages:
+        return 0, 0
+    return stages[-1].items_out, sum(stage.failed for stage in stages)
+
+
+def _job_from_dto(dto: ExtractionJobDto) -> ExtractionJob:
+    items_per_second = eta_seconds = None
+    if dto.started_at is not None:
+        end = dto.finished_at or datetime.now(dto.started_at.tzinfo)
+        elapsed = (end - dto.started_at).total_seconds()
+        processed = dto.done + dto.failed
+        if elapsed > 0 and processed:
+            items_per_second = processed / elapsed
+            if dto.finished_at is None and dto.total is not None:
+                eta_seconds = max(dto.total - processed, 0) / items_per_second
+
+    return ExtractionJob(
+        id=dto.id,
+        status=JobStatus(dto.status),
+        dataset_name=dto.dataset_name,
+        model_name=dto.model_name,
+        extraction_type=dto.extraction_type,
+        image_name=dto.image_name,
+        total=dto.total,
+        done=dto.done,
+        failed=dto.failed,
+        items_per_second=items_per_second,
+        eta_seconds=eta_seconds,
+        error=dto.error,
+        summary=None if dto.summary is None else ExtractionSummary(**json.loads(dto.summary)),
+        created_at=dto.created_at,
+        started_at=dto.started_at,
+        finished_at=dto.finished_at,
+    )
+
+
+extraction_jobs = ExtractionJobs()
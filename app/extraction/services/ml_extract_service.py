@@ -1,15 +1,61 @@
 from abc import ABC, abstractmethod
-import json
-from typing import Callable, List
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
 from asyncpg.connection import Connection
 import pydantic
 import numpy as np
+from PIL import Image as PILImage, UnidentifiedImageError
 
-from shared.encoders import NumpyEncoder
+from shared.array_codec import Quantization, encode_arrays
+from shared.heatmap_tiles import encode_heatmap_pyramid
 from shared.types_common import ExtractionTypes
 from shared.view_models import Activations, Annotations, Heatmap
 from shared.model_data import DummyModel
 
+# Storage precision and compression of heatmap and activations results
+EXTRACTION_RESULT_QUANTIZATION = Quantization(os.environ.get("EXTRACTION_RESULT_QUANTIZATION", Quantization.NONE.value))
+EXTRACTION_RESULT_COMPRESSION = os.environ.get("EXTRACTION_RESULT_COMPRESSION", "false").lower() == "true"
+
+
+def group_by_shape(images: List[Optional[np.ndarray]]) -> Dict[Tuple[int, ...], List[int]]:
+    """
+    Indices of images grouped by array shape, so each group can be stacked into one batch.
+    Images that could not be decoded are left out.
+    """
+
+    groups = defaultdict(list)
+    for i, image in enumerate(images):
+        if image is not None:
+            groups[image.shape].append(i)
+
+    return groups
+
+
+def _decode_image(img_path) -> Optional[np.ndarray]:
+    try:
+        with PILImage.open(img_path) as image:
+            return np.asarray(image)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+def _open_image(img_path) -> Optional[PILImage.Image]:
+    """Parse an image header without decoding its pixels, or nothing if it is not an image"""
+
+    try:
+        return PILImage.open(img_path)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+def _encode_heatmap(heatmap: np.ndarray):
+    return encode_heatmap_pyramid(heatmap, EXTRACTION_RESULT_QUANTIZATION, EXTRACTION_RESULT_COMPRESSION)
+
+
+def _encode_activations(layers: List[np.ndarray]):
+    return encode_arrays(layers, EXTRACTION_RESULT_QUANTIZATION, EXTRACTION_RESULT_COMPRESSION)
+
 
 class ExtractionTypeBase(ABC):
 
@@ -17,32 +63,82 @@ class ExtractionTypeBase(ABC):
     def run(self, img_path: str):
         pass
 
+    def run_batch(self, img_paths: List[str]) -> list:
+        """Run on many images at once, one result per image in input order"""
+
+        return [self.run(img_path) for img_path in img_paths]
+
+    def _run_stacked(self, img_paths: List[str], run_stack: Callable[[np.ndarray], list]) -> list:
+        """
+        Decode images, stack same shaped ones into batches and run each batch in one model call.
+        An image that cannot be decoded gets no result instead of failing the whole batch.
+        """
+
+        images = [_decode_image(img_path) for img_path in img_paths]
+        results = [None] * len(images)
+        for indices in group_by_shape(images).values():
+            batch = np.stack([images[i] for i in indices])
+            for i, result in zip(indices, run_stack(batch)):
+                results[i] = result
+
+        return results
+
 
 class HeatmapExtraction(ExtractionTypeBase):
-    def __init__(self, model_id):
-        self._model = DummyModel(model_id)
+    def __init__(self, model: DummyModel):
+        self._model = model
 
     def run(self, img_path: str) -> Heatmap: 
         """Get heatmap  for an image based on model id"""
            
         heatmap = self._model.get_img_heatmap(img_path=img_path)
-        return Heatmap(array=json.dumps(heatmap, cls=NumpyEncoder))
+        return Heatmap(array=_encode_heatmap(heatmap))
+
+    def run_batch(self, img_paths: List[str]) -> List[Heatmap]:
+        return self._run_stacked(
+            img_paths,
+            lambda batch: [
+                Heatmap(array=_encode_heatmap(heatmap))
+                for heatmap in self._model.get_batch_heatmaps(batch)
+            ],
+        )
 
 
 class ActivationsExtraction(ExtractionTypeBase):
-    def __init__(self, model_id):
-        self._model = DummyModel(model_id)
+    def __init__(self, model: DummyModel):
+        self._model = model
 
     def run(self, img_path: str) -> Activations:
         """Get activations for an image based on model id"""
  
         activations = self._model.get_img_activations(img_path=img_path)
-        return Activations(array=json.dumps(activations, cls=NumpyEncoder))
+        return Activations(array=_encode_activations(activations))
+
+    def run_batch(self, img_paths: List[str]) -> List[Optional[Activations]]:
+        """
+        Activations do not depend on pixel values here, so images are only opened to check their
+        header and are never decoded or stacked. An unreadable image gets no result.
+        """
+
+        images = [_open_image(img_path) for img_path in img_paths]
+        readable = [i for i, image in enumerate(images) if image is not None]
+        results = [None] * len(images)
+        try:
+            if readable:
+                layers = self._model.get_batch_activations([images[i] for i in readable])
+                for row, i in enumerate(readable):
+                    results[i] = Activations(array=_encode_activations([layer[row] for layer in layers]))
+        finally:
+            for image in images:
+                if image is not None:
+                    image.close()
+
+        return results
 
 
 class PredictionsExtraction(ExtractionTypeBase):
-    def __init__(self, model_id):
-        self._model = DummyModel(model_id)
+    def __init__(self, model: DummyModel):
+        self._model = model
 
     def run(self, img_path: str) -> Annotations:
         """Get bounding boxes and their respective categories for an image based on model id"""
@@ -50,12 +146,32 @@ class PredictionsExtraction(ExtractionTypeBase):
         bbox_and_categories = self._model.get_model_prediction(img_path=img_path)
         return bbox_and_categories
 
-def dispatch_extractor_service(model_id: int, extraction_type: ExtractionTypes, img_path: str):
+    def run_batch(self, img_paths: List[str]) -> List[dict]:
+        def run_stack(batch: np.ndarray) -> List[dict]:
+            bboxes, category_ids, counts = self._model.get_batch_predictions(batch)
+            return [
+                {"bbox": bboxes[i, :count].tolist(), "category_id": category_ids[i, :count].tolist()}
+                for i, count in enumerate(counts)
+            ]
+
+        return self._run_stacked(img_paths, run_stack)
+
+
+EXTRACTIONS = {
+    ExtractionTypes.HEATMAP: HeatmapExtraction,
+    ExtractionTypes.ACTIVATIONS: ActivationsExtraction,
+    ExtractionTypes.PREDICTIONS: PredictionsExtraction,
+}
+
+def dispatch_extractor_service(model: DummyModel, extraction_type: ExtractionTypes, img_path: str):
     """
     Add more ml feature extractions here if required, add the new implementation class above
     """
-    return {
-        ExtractionTypes.HEATMAP: lambda: HeatmapExtraction(model_id=model_id).run(img_path),
-        ExtractionTypes.ACTIVATIONS: lambda: ActivationsExtraction(model_id=model_id).run(img_path),
-        ExtractionTypes.PREDICTIONS: lambda: PredictionsExtraction(model_id=model_id).run(img_path),
-    }.get(extraction_type, lambda: None)()
+    extraction = EXTRACTIONS.get(extraction_type)
+    return None if extraction is None else extraction(model=model).run(img_path)
+
+def dispatch_extractor_batch(model: DummyModel, extraction_type: ExtractionTypes, img_paths: List[str]) -> list:
+    """Batched counterpart of dispatch_extractor_service, one result per image"""
+
+    extraction = EXTRACTIONS.get(extraction_type)
+    return [None] * len(img_paths) if extraction is None else extraction(model=model).run_batch(img_paths)
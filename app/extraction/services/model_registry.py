@@ -0,0 +1,94 @@
+import os
+import sys
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+
+from shared.model_data import DummyModel, get_models
+
+EXTRACTION_MODEL_CACHE_MB = int(os.environ.get("EXTRACTION_MODEL_CACHE_MB", 2048))
+
+# Models to load when a worker starts, every known model by default
+EXTRACTION_WARM_MODELS = [
+    name.strip()
+    for name in os.environ.get(
+        "EXTRACTION_WARM_MODELS", ",".join(model.model_name for model in get_models())
+    ).split(",")
+    if name.strip()
+]
+
+# Weights loaded for a model registered through the API under a name no bundled model has
+EXTRACTION_DEFAULT_MODEL_ID = int(os.environ.get("EXTRACTION_DEFAULT_MODEL_ID", 0))
+
+_MODEL_IDS_BY_NAME = {model.model_name: model.model_id for model in get_models()}
+
+
+def load_model(name: str) -> DummyModel:
+    """
+    Load the model registered under a name. Names are checked against the model table before
+    any work reaches a worker, so one without bundled weights runs on the default model.
+    """
+
+    return DummyModel(_MODEL_IDS_BY_NAME.get(name, EXTRACTION_DEFAULT_MODEL_ID))
+
+
+def model_size(model: DummyModel) -> int:
+    """Approximate memory held by a model, from its nbytes if it has one or its NumPy attributes"""
+
+    nbytes = getattr(model, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+
+    return sum(
+        value.nbytes for value in vars(model).values() if isinstance(value, np.ndarray)
+    ) or sys.getsizeof(model)
+
+
+class ModelRegistry:
+    """
+    Loaded models by name, evicted least recently used first once they exceed a memory budget.
+
+    The most recently used model is always kept, even when it alone is over budget.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], DummyModel] = load_model,
+        budget_bytes: int = EXTRACTION_MODEL_CACHE_MB * 1024 * 1024,
+    ) -> None:
+        self._loader = loader
+        self._budget_bytes = budget_bytes
+        self._models: "OrderedDict[str, Tuple[DummyModel, int]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, name: str) -> DummyModel:
+        entry = self._models.get(name)
+        if entry is not None:
+            self._models.move_to_end(name)
+            return entry[0]
+
+        model = self._loader(name)
+        size = model_size(model)
+        self._models[name] = (model, size)
+        self._size += size
+        self._evict()
+
+        return model
+
+    def warm(self, names: Iterable[str]) -> None:
+        for name in names:
+            self.get(name)
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._models)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _evict(self) -> None:
+        while self._size > self._budget_bytes and len(self._models) > 1:
+            _, (_, size) = self._models.popitem(last=False)
+            self._size -= size
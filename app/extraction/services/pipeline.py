@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, List, Optional
+
+from shared.view_models import StageStats
+
+logger = logging.getLogger(__name__)
+
+# Put on a stage's input queue once per worker when no more items will follow
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline, run by `concurrency` workers reading a bounded input queue.
+
+    fn is awaited with one item, or with a list of up to batch_size items when batch_size
+    is set, and returns the item (or one item per input) for the next stage. A None result
+    counts as a failed item and is dropped, as are all items of a call that raises, so one
+    bad image does not stop a run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Any], Awaitable[Any]],
+        concurrency: int = 1,
+        batch_size: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = batch_size
+        self.queue_size = queue_size or 2 * self.concurrency * (batch_size or 1)
+        self.stats = StageStats(name=name, concurrency=self.concurrency)
+        self.workers_left = self.concurrency
+        self._started: Optional[float] = None
+
+    async def work(self, input: asyncio.Queue, output: Optional[asyncio.Queue]) -> bool:
+        """Process items until the done marker, returning True for the last worker to finish"""
+
+        done = False
+        while not done:
+            items = []
+            while len(items) < (self.batch_size or 1):
+                item = await input.get()
+                if item is _DONE:
+                    done = True
+                    break
+                items.append(item)
+
+            if items:
+                await self._process(items, output)
+
+        self.workers_left -= 1
+        return self.workers_left == 0
+
+    async def _process(self, items: List[Any], output: Optional[asyncio.Queue]) -> None:
+        if self._started is None:
+            self._started = time.perf_counter()
+        self.stats.items_in += len(items)
+
+        start = time.perf_counter()
+        try:
+            results = await self.fn(items) if self.batch_size else [await self.fn(items[0])]
+        except Exception:
+            logger.exception(f"Pipeline stage {self.name} failed on {len(items)} items")
+            results = [None] * len(items)
+        finally:
+            end = time.perf_counter()
+            self.stats.busy_seconds += end - start
+            self.stats.elapsed_seconds = end - self._started
+
+        results = [result for result in results if result is not None]
+        self.stats.failed += len(items) - len(results)
+        self.stats.items_out += len(results)
+        if self.stats.elapsed_seconds > 0:
+            self.stats.items_per_second = self.stats.items_out / self.stats.elapsed_seconds
+
+        if output is not None:
+            for result in results:
+                await output.put(result)
+
+
+class Pipeline:
+    """
+    Stages connected by bounded asyncio queues.
+
+    Every stage runs at the same time, each with its own workers, so downloads, CPU work
+    and writes overlap. A full queue blocks the stage feeding it, which keeps a fast stage
+    from running ahead of a slow one and bounds the number of items held in memory.
+    """
+
+    def __init__(self, stages: List[Stage]) -> None:
+        self.stages = stages
+
+    async def run(self, source: AsyncIterable) -> List[StageStats]:
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+
+        async def feed() -> None:
+            async for item in source:
+                await queues[0].put(item)
+            await self._finish(0, queues)
+
+        async def work(i: int) -> None:
+            stage = self.stages[i]
+            output = queues[i + 1] if i + 1 < len(queues) else None
+            if await stage.work(queues[i], output) and output is not None:
+                await self._finish(i + 1, queues)
+
+        tasks = [asyncio.create_task(feed())]
+        for i, stage in enumerate(self.stages):
+            tasks += [asyncio.create_task(work(i)) for _ in range(stage.concurrency)]
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return [stage.stats for stage in self.stages]
+
+    async def _finish(self, i: int, queues: List[asyncio.Queue]) -> None:
+        for _ in range(self.stages[i].concurrency):
+            await queues[i].put(_DONE)
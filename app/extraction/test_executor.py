@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import pytest
+
+"""
+The resource tracker is a separate process writing to the stderr it inherited, so batches
+run in a child interpreter whose stderr is captured once the tracker has exited too.
+"""
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_BATCHES = """
+import asyncio, io
+from multiprocessing import resource_tracker
+from PIL import Image
+from extraction.services.executor import ExtractionExecutor
+from shared.types_common import ExtractionTypes
+
+def png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 6)).save(buffer, format="PNG")
+    return buffer
+
+async def main():
+    if {tracker_running}:
+        resource_tracker.ensure_running()
+    executor = ExtractionExecutor(workers=2, warm_models=[])
+    for _ in range(3):
+        results = await executor.run_batch("Hybrid Model", ExtractionTypes.PREDICTIONS, [png(), png()])
+        assert len(results) == 2 and all("bbox" in result for result in results)
+    executor.shutdown()
+
+asyncio.run(main())
+"""
+
+
+@pytest.mark.parametrize("tracker_running", [False, True])
+def test_run_batch_leaves_stderr_clean(tracker_running):
+    completed = subprocess.run(
+        [sys.executable, "-c", RUN_BATCHES.format(tracker_running=tracker_running)],
+        cwd=APP_DIR,
+        env={**os.environ, "PYTHONPATH": APP_DIR},
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stderr == ""
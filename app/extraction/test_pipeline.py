@@ -0,0 +1,97 @@
+import asyncio
+from typing import List
+
+from extraction.services.pipeline import Pipeline, Stage
+
+
+async def numbers(count: int):
+    for i in range(count):
+        yield i
+
+
+async def test_items_flow_through_every_stage():
+    collected = []
+
+    async def double(item):
+        return item * 2
+
+    async def collect(items):
+        collected.extend(items)
+        return items
+
+    stats = await Pipeline([
+        Stage("double", double, concurrency=3),
+        Stage("collect", collect, batch_size=4),
+    ]).run(numbers(10))
+
+    assert sorted(collected) == [i * 2 for i in range(10)]
+    assert [(s.name, s.items_in, s.items_out, s.failed) for s in stats] == [
+        ("double", 10, 10, 0),
+        ("collect", 10, 10, 0),
+    ]
+
+
+async def test_batches_are_at_most_batch_size():
+    sizes: List[int] = []
+
+    async def record(items):
+        sizes.append(len(items))
+        return items
+
+    await Pipeline([Stage("record", record, batch_size=4)]).run(numbers(10))
+
+    assert sum(sizes) == 10
+    assert max(sizes) <= 4
+
+
+async def test_failures_drop_items_without_stopping_the_run():
+    async def reject_odd(item):
+        return None if item % 2 else item
+
+    async def fail_on_zero(items):
+        if 0 in items:
+            raise ValueError("bad batch")
+        return items
+
+    stats = await Pipeline([
+        Stage("reject_odd", reject_odd),
+        Stage("fail_on_zero", fail_on_zero, batch_size=2),
+    ]).run(numbers(8))
+
+    reject, fail = stats
+    assert (reject.items_out, reject.failed) == (4, 4)
+    # 0 and 2 share the first batch, so both are dropped
+    assert (fail.items_in, fail.items_out, fail.failed) == (4, 2, 2)
+
+
+async def test_full_queue_holds_back_the_source():
+    fed = 0
+    release = asyncio.Event()
+
+    async def source():
+        nonlocal fed
+        for i in range(100):
+            fed += 1
+            yield i
+
+    async def slow(item):
+        await release.wait()
+        return item
+
+    run = asyncio.create_task(Pipeline([Stage("slow", slow, queue_size=5)]).run(source()))
+    await asyncio.sleep(0.05)
+
+    # One item in the worker, five in the queue and one waiting on put
+    assert fed <= 7
+    release.set()
+    stats = await run
+    assert stats[0].items_out == 100
+
+
+async def test_empty_source():
+    async def identity(item):
+        return item
+
+    stats = await Pipeline([Stage("a", identity, concurrency=2), Stage("b", identity)]).run(numbers(0))
+
+    assert [s.items_in for s in stats] == [0, 0]
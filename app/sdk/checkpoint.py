@@ -0,0 +1,52 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from shared.view_models import Image
+
+
+class IngestCheckpoint:
+    """
+    Append-only record of the images a backend has committed during ingest.
+
+    One JSON line is written per image once the batch holding it has been accepted, so
+    after a crash the next run knows which objects are already ingested, and with which
+    ETags, without downloading their annotations again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._etags: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]] = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    # A crash can leave a truncated last line behind
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._etags[(entry["dataset_name"], entry["name"])] = (
+                        entry["image_etag"],
+                        entry["annotation_etag"],
+                    )
+
+    def is_current(self, dataset_name: str, name: str, image_etag: str, annotation_etag: str) -> bool:
+        return self._etags.get((dataset_name, name)) == (image_etag, annotation_etag)
+
+    def record(self, images: List[Image]) -> None:
+        with open(self._path, "a") as file:
+            for image in images:
+                file.write(
+                    json.dumps(
+                        {
+                            "dataset_name": image.dataset_name,
+                            "name": image.name,
+                            "image_etag": image.image_etag,
+                            "annotation_etag": image.annotation_etag,
+                        }
+                    ) + "\n"
+                )
+                self._etags[(image.dataset_name, image.name)] = (image.image_etag, image.annotation_etag)
+            file.flush()
+            os.fsync(file.fileno())
@@ -4,15 +4,45 @@ import functools
 from re import S
 from dataclasses import dataclass
 import glob
+import io
 import os, json
+import threading
 from typing import Any, List, Optional
 
+import numpy as np
 from fastapi import FastAPI
 
 from shared.utils_fastapi import create_app
-from shared.s3_utils import s3_download_files, s3_get_file_count, s3_get_file_type, AwsConfig
-from shared.types_common import ExtractionTypes, ImageSearchFilter, TenyksExtractionRequest, TenyksResponse
-from shared.request_handlers import get_async_request_handler, post_async_request_handler
+from shared.manifest import DatasetManifest, load_or_build_manifest
+from sdk.checkpoint import IngestCheckpoint
+from shared.array_codec import CONTENT_TYPE, decode_array
+from shared.heatmap_tiles import PYRAMID_EXTENSION, decode_heatmap_pyramid
+from shared.image_info import probe_images
+from shared.s3_utils import (
+    s3_download_file,
+    s3_download_objects,
+    decode_json,
+    AwsConfig,
+    S3ClientManager,
+    DEFAULT_DOWNLOAD_CONCURRENCY,
+    DEFAULT_MAX_POOL_CONNECTIONS,
+)
+from shared.types_common import (
+    ExtractionTypes,
+    ImageSearchFilter,
+    TenyksBboxQueryRequest,
+    TenyksDuplicatesRequest,
+    TenyksExtractionRequest,
+    TenyksHeatmapRegionRequest,
+    TenyksImagesBulkRequest,
+    TenyksResponse,
+)
+from shared.request_handlers import (
+    HttpClientConfig,
+    HttpClientRegistry,
+    get_async_request_handler,
+    post_async_request_handler,
+)
 from shared.view_models import (
     Activations, 
     Annotations, 
@@ -21,7 +51,8 @@ from shared.view_models import (
     Dataset, 
     Image, 
     Model, 
-    Heatmap
+    Heatmap,
+    JobStatus,
 )
 
 """
@@ -50,20 +81,36 @@ class DatasetGetRequest:
 class ModelGetRequest:
     name: str
 
-def force_sync(fn):
-    """Turn an async fun to sync"""
-    import asyncio
+class _EventLoopThread:
+    """A single event loop running for the life of a sync client on a daemon thread"""
 
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        res = fn(*args, **kwargs)
-        if asyncio.iscoroutine(res):
-            return asyncio.run(res)
-        return res
-    return wrapper
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tenyks-sdk-loop", daemon=True)
+        self._thread.start()
 
-class TenyksSDK():
-    def __init__(self,) -> None:
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class AsyncTenyksSDK():
+    """
+    Coroutine based Tenyks client.
+
+    Connections to the backend, the extraction service and S3 are pooled on the client and
+    shared by every call, so several operations can run concurrently with asyncio.gather.
+    """
+
+    def __init__(
+        self,
+        http_config: Optional[HttpClientConfig] = None,
+        s3_max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    ) -> None:
         self._awsConfig = AwsConfig(
             endpoint_url=os.environ.get("AWS_ENDPOINT"),
             region_name=os.environ.get("AWS_REGION"),
@@ -74,28 +121,52 @@ class TenyksSDK():
         self._backend_base_url = os.environ.get("BACKEND_BASE_URL")
         self._extract_base_url = os.environ.get("EXTRACT_BASE_URL")
         self._app = create_app()
+        # Prefix listings shared by every manifest this client builds, until MANIFEST_MAX_AGE
+        self._listings = {}
+        self._http = HttpClientRegistry(http_config)
+        self._s3 = S3ClientManager(max_pool_connections=s3_max_pool_connections)
+
+    async def __aenter__(self) -> "AsyncTenyksSDK":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close every pooled connection held by the client"""
+
+        await self._http.aclose()
+        await self._s3.close()
 
     async def dataset(self, name: str) -> Model:
 
         dataset_request = DatasetGetRequest(name=name)
-        resp = await get_async_request_handler(url=f"{self._backend_base_url}/datasets", request=dataset_request)
+        resp = await get_async_request_handler(url=f"{self._backend_base_url}/datasets", request=dataset_request, client=self._http.get())
   
         return resp
 
-    @force_sync
-    async def save_dataset(self, name: str, dataset_path: str, images_path: str, annotations_path: Optional[str]=None, ):
-
-        dataset_type = await s3_get_file_type(aws_config=self._awsConfig, files_path=images_path)
-
-        size = await s3_get_file_count(aws_config=self._awsConfig, files_path=images_path, file_type_filter=dataset_type) 
+    async def save_dataset(
+        self,
+        name: str,
+        dataset_path: str,
+        images_path: str,
+        annotations_path: Optional[str]=None,
+        manifest_path: Optional[str]=None,
+    ):
+
+        manifest = await self._manifest(
+            images_path=images_path,
+            annotations_path=annotations_path,
+            manifest_path=manifest_path,
+        )
         dataset_request = Dataset(
             name=name,
-            size=size,
-            type=dataset_type,
+            size=manifest.size,
+            type=manifest.image_type,
             dataset_path=dataset_path,
             images_path=images_path,
         )
-        resp = await post_async_request_handler(url=f"{self._backend_base_url}/datasets", request=dataset_request)
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/datasets", request=dataset_request, client=self._http.get())
         print(resp)
         return resp
 
@@ -105,10 +176,9 @@ class TenyksSDK():
 
     #     return resp
 
-    @force_sync
     async def save_model(self, name: str, datasets: List[str]):
         model_request = Model(name=name, datasets=datasets)
-        resp = await post_async_request_handler(url=f"{self._backend_base_url}/models", request=model_request)
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/models", request=model_request, client=self._http.get())
         print(resp)
         return resp
         
@@ -121,36 +191,77 @@ class TenyksSDK():
     def images(self) -> Image:
         return self._image
 
-    @force_sync
-    async def save_images(self, dataset_name: str, images_path: str, annotations_path: str):
-        
-        images_dataset_type = await s3_get_file_type(aws_config=self._awsConfig, files_path=images_path)
-        annotations_dataset_type = await s3_get_file_type(aws_config=self._awsConfig, files_path=annotations_path)
-        images_dataset_size = await s3_get_file_count(aws_config=self._awsConfig, files_path=images_path, file_type_filter=images_dataset_type) 
-        annotations_dataset_size = await s3_get_file_count(aws_config=self._awsConfig, files_path=annotations_path, file_type_filter=annotations_dataset_type)
+    async def save_images(
+        self,
+        dataset_name: str,
+        images_path: str,
+        annotations_path: str,
+        batch_size: int = 1000,
+        download_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+        manifest_path: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+        near_duplicates: bool = False,
+    ):
+        """
+        Ingest every image/annotation pair under the given prefixes.
+
+        Ingest is incremental: the backend skips images whose S3 ETags are unchanged and
+        replaces the annotations of changed ones, so re-running after a failure or after
+        new files were added is safe. Image dimensions, channels, format, size and content
+        hash are read from a ranged GET of each image header and stored alongside. With a checkpoint_path, pairs committed by an earlier
+        run are skipped before their annotations are even downloaded. Images whose bytes are
+        already stored, in any dataset, share one content record. near_duplicates also stores
+        a difference hash of every image for duplicates() to compare, at the cost of
+        downloading each image in full. Images whose annotations still fail to download
+        after retries are skipped and listed, to be picked up by the next run.
+        """
+
+        manifest = await self._manifest(
+            images_path=images_path,
+            annotations_path=annotations_path,
+            manifest_path=manifest_path,
+        )
+        unpaired_images, unpaired_annotations = manifest.unpaired()
         responses = []
-        if images_dataset_size != annotations_dataset_size:
+        if unpaired_images or unpaired_annotations:
             raise ValueError(
                 (
-                    f"Image and annotation folders contain an unequal number of items!"
-                    f"Number of images ({images_dataset_size}) != Number of annotations ({annotations_dataset_size})"
+                    f"Image and annotation folders do not pair up one to one! "
+                    f"Images without annotations ({len(unpaired_images)}), "
+                    f"annotations without images ({len(unpaired_annotations)})"
                 )
             )
 
+        checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+        pairs_by_annotation_key = {
+            pair.annotation.key: pair
+            for pair in manifest.pairs()
+            if checkpoint is None
+            or not checkpoint.is_current(dataset_name, pair.name, pair.image.etag, pair.annotation.etag)
+        }
+        failed = []
         try:
-            async for image in s3_download_files(aws_config=self._awsConfig, files_path=annotations_path, file_type_filter='json'):
-                bbox_and_categories = image.content
-                image_request = Image(
-                    name=f"{''.join(image.name.split('.')[:-1])}.{images_dataset_type}",
-                    url=images_path,
-                    dataset_name=dataset_name,
-                    annotations=Annotations(
-                        bboxes=[bbox for bbox in bbox_and_categories['bbox']],
-                        categories=[cat for cat in bbox_and_categories['category_id']],
-                    )
-                )
-                resp = await post_async_request_handler(url=f"{self._backend_base_url}/images", request=image_request)
-                responses.append(resp)
+            batch = []
+            async for annotation in s3_download_objects(
+                keys=list(pairs_by_annotation_key),
+                aws_config=self._awsConfig,
+                concurrency=download_concurrency,
+                decode=decode_json,
+                clients=self._s3,
+            ):
+                if annotation.error is not None:
+                    failed.append((annotation.key, annotation.error))
+                    continue
+                bbox_and_categories = annotation.content
+                pair = pairs_by_annotation_key[annotation.key]
+                batch.append((pair, bbox_and_categories))
+                if len(batch) >= batch_size:
+                    images = await self._images_batch(dataset_name, images_path, batch, download_concurrency, near_duplicates)
+                    responses.append(await self._post_images_batch(dataset_name=dataset_name, images=images, checkpoint=checkpoint))
+                    batch = []
+            if batch:
+                images = await self._images_batch(dataset_name, images_path, batch, download_concurrency, near_duplicates)
+                responses.append(await self._post_images_batch(dataset_name=dataset_name, images=images, checkpoint=checkpoint))
         except StopAsyncIteration:
             pass
         except Exception as ex:
@@ -158,10 +269,106 @@ class TenyksSDK():
             print('IMAGES POST  ................Failed')
             raise
 
+        if failed:
+            # Left out of the checkpoint, so the next run picks them up again
+            print(f"Skipped {len(failed)} images whose annotations could not be downloaded:")
+            for key, error in failed:
+                print(f"  {key}: {error!r}")
+
         print(responses)
         return responses
 
-    @force_sync
+    async def _manifest(self, images_path: str, annotations_path: Optional[str], manifest_path: Optional[str]) -> DatasetManifest:
+        """Build a dataset manifest, reusing prefix listings made earlier by this client"""
+
+        return await load_or_build_manifest(
+            images_path=images_path,
+            aws_config=self._awsConfig,
+            annotations_path=annotations_path,
+            manifest_path=manifest_path,
+            listings=self._listings,
+            clients=self._s3,
+        )
+
+    async def _images_batch(
+        self, dataset_name: str, images_path: str, batch: list, concurrency: int, with_dhash: bool = False
+    ) -> List[Image]:
+        """Build the images of a batch of (pair, annotation) with the file facts read from their headers"""
+
+        infos = await probe_images(
+            [pair.image for pair, _ in batch],
+            aws_config=self._awsConfig,
+            concurrency=concurrency,
+            clients=self._s3,
+            with_dhash=with_dhash,
+        )
+        return [
+            Image(
+                name=pair.name,
+                url=images_path,
+                dataset_name=dataset_name,
+                image_etag=pair.image.etag,
+                annotation_etag=pair.annotation.etag,
+                annotations=Annotations(
+                    bboxes=[bbox for bbox in bbox_and_categories['bbox']],
+                    categories=[cat for cat in bbox_and_categories['category_id']],
+                ),
+                width=info.width,
+                height=info.height,
+                channels=info.channels,
+                format=info.format,
+                byte_size=info.byte_size,
+                content_hash=info.content_hash,
+                dhash=info.dhash,
+            )
+            for (pair, bbox_and_categories), info in zip(batch, infos)
+        ]
+
+    async def _post_images_batch(self, dataset_name: str, images: List[Image], checkpoint: Optional[IngestCheckpoint] = None):
+        """Send one batch of images to the bulk ingest endpoint and checkpoint it once committed"""
+
+        images_request = TenyksImagesBulkRequest(dataset_name=dataset_name, images=images)
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/images/bulk", request=images_request, client=self._http.get())
+        if checkpoint is not None and resp.is_success:
+            checkpoint.record(images)
+
+        return resp
+
+    async def query_images(
+        self,
+        dataset_name: str,
+        model_name: Optional[str] = None,
+        region: Optional[List[int]] = None,
+        categories: Optional[List[int]] = None,
+        min_area: Optional[int] = None,
+        max_area: Optional[int] = None,
+        min_aspect: Optional[float] = None,
+        max_aspect: Optional[float] = None,
+        after_id: int = 0,
+        limit: int = 1000,
+    ):
+        """
+        Find images whose ground truth boxes, or a model's predicted boxes if model_name is given,
+        overlap region ([x_min, y_min, x_max, y_max]) and fall within the category, area and
+        aspect ratio (width / height) filters. Results are paged on image id.
+        """
+
+        request = TenyksBboxQueryRequest(
+            dataset_name=dataset_name,
+            model_name=model_name,
+            region=region,
+            categories=categories,
+            min_area=min_area,
+            max_area=max_area,
+            min_aspect=min_aspect,
+            max_aspect=max_aspect,
+            after_id=after_id,
+            limit=limit,
+        )
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/images/query", request=request, client=self._http.get())
+
+        return resp
+
     async def extract(
         self,
         dataset_name: str,
@@ -169,18 +376,180 @@ class TenyksSDK():
         extraction_type: ExtractionTypes,
         image_search_filter: Optional[ImageSearchFilter] = ImageSearchFilter.ALL,
         image_name: Optional[str] = None,
+        force_recompute: bool = False,
     ) -> TenyksResponse:
         request=TenyksExtractionRequest(
             dataset_name=dataset_name,
             model_name=model_name,
             image_name=image_name, 
             type=extraction_type,
-            image_search_filter=image_search_filter
+            image_search_filter=image_search_filter,
+            force_recompute=force_recompute,
         )
-        resp = await post_async_request_handler(url=f"{self._extract_base_url}/extract", request=request)
+        resp = await post_async_request_handler(url=f"{self._extract_base_url}/extract", request=request, client=self._http.get())
         print(resp)
         return resp
 
+    async def submit_extraction(
+        self,
+        dataset_name: str,
+        model_name: str,
+        extraction_type: ExtractionTypes,
+        image_search_filter: Optional[ImageSearchFilter] = ImageSearchFilter.ALL,
+        image_name: Optional[str] = None,
+        force_recompute: bool = False,
+    ) -> dict:
+        """Queue an extraction as a background job and return the job without waiting for it"""
+
+        request=TenyksExtractionRequest(
+            dataset_name=dataset_name,
+            model_name=model_name,
+            image_name=image_name, 
+            type=extraction_type,
+            image_search_filter=image_search_filter,
+            force_recompute=force_recompute,
+        )
+        resp = await post_async_request_handler(url=f"{self._extract_base_url}/extract/jobs", request=request, client=self._http.get())
+
+        return _job_result(resp)
+
+    async def extraction_job(self, job_id: int) -> dict:
+        """Status, progress and ETA of an extraction job"""
+
+        resp = await self._http.get().get(url=f"{self._extract_base_url}/extract/jobs/{job_id}")
+
+        return _job_result(resp)
+
+    async def cancel_extraction(self, job_id: int) -> dict:
+        resp = await self._http.get().post(url=f"{self._extract_base_url}/extract/jobs/{job_id}/cancel")
+
+        return _job_result(resp)
+
+    async def wait_for_extraction(self, job_id: int, poll_interval: float = 2.0, timeout: Optional[float] = None) -> dict:
+        """Poll an extraction job until it finishes, raising TimeoutError after timeout seconds"""
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            job = await self.extraction_job(job_id)
+            if job["status"] in _FINISHED_JOB_STATUSES:
+                return job
+            if deadline is not None and loop.time() >= deadline:
+                raise TimeoutError(f"Extraction job {job_id} still {job['status']} after {timeout}s")
+            await asyncio.sleep(poll_interval)
+
+    async def extraction_result(self, result_path: str):
+        """Download a heatmap or activations result and decode it back to numpy arrays"""
+
+        downloaded = await s3_download_file(file_path=result_path, aws_config=self._awsConfig, clients=self._s3)
+        if result_path.endswith(f".{PYRAMID_EXTENSION}"):
+            return decode_heatmap_pyramid(downloaded.content.getvalue())
+
+        return decode_array(downloaded.content.getvalue())
+
+    async def heatmap_region(
+        self,
+        dataset_name: str,
+        model_name: str,
+        image_name: str,
+        level: int = 0,
+        region: Optional[List[int]] = None,
+    ) -> np.ndarray:
+        """
+        Read one level of a stored heatmap, or its [x_min, y_min, x_max, y_max] window in that
+        level's pixel coordinates. Level 0 is full resolution, every level above halves it.
+        """
+
+        request = TenyksHeatmapRegionRequest(
+            dataset_name=dataset_name,
+            model_name=model_name,
+            image_name=image_name,
+            level=level,
+            region=region,
+        )
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/images/heatmap", request=request, client=self._http.get())
+        if resp.headers.get("content-type") != CONTENT_TYPE:
+            raise RuntimeError(resp.json()["response"].get("message", resp.text))
+
+        return np.load(io.BytesIO(resp.content), allow_pickle=False)
+
+    async def duplicates(self, dataset_name: str, max_distance: int = 4) -> dict:
+        """
+        Report the images of a dataset stored more than once, in it or in any other dataset,
+        and its groups of near duplicates, whose difference hashes are at most max_distance
+        bits apart. Near duplicates need the dataset ingested with near_duplicates=True.
+        """
+
+        request = TenyksDuplicatesRequest(dataset_name=dataset_name, max_distance=max_distance)
+        resp = await post_async_request_handler(url=f"{self._backend_base_url}/images/duplicates", request=request, client=self._http.get())
+
+        return _job_result(resp)
+
+
+_FINISHED_JOB_STATUSES = {JobStatus.SUCCEEDED.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value}
+
+
+def _job_result(resp) -> dict:
+    body = resp.json()["response"]
+    if "result" not in body:
+        raise RuntimeError(body.get("message", resp.text))
+    return body["result"]
+
+def _run_on_loop(name: str):
+    """Expose an AsyncTenyksSDK coroutine as a blocking method running on the client loop"""
+
+    async_fn = getattr(AsyncTenyksSDK, name)
+
+    @functools.wraps(async_fn)
+    def wrapper(self, *args, **kwargs):
+        return self._loop.run(async_fn(self._client, *args, **kwargs))
+
+    return wrapper
+
+
+class TenyksSDK():
+    """
+    Blocking facade over AsyncTenyksSDK.
+
+    Every call runs on one persistent background event loop, so connections are kept
+    alive between calls instead of being torn down with a fresh loop each time.
+    """
+
+    def __init__(
+        self,
+        http_config: Optional[HttpClientConfig] = None,
+        s3_max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    ) -> None:
+        self._loop = _EventLoopThread()
+        self._client = AsyncTenyksSDK(http_config=http_config, s3_max_pool_connections=s3_max_pool_connections)
+
+    def __enter__(self) -> "TenyksSDK":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close pooled connections and stop the background loop"""
+
+        self._loop.run(self._client.aclose())
+        self._loop.stop()
+
+    dataset = _run_on_loop("dataset")
+    save_dataset = _run_on_loop("save_dataset")
+    save_model = _run_on_loop("save_model")
+    save_images = _run_on_loop("save_images")
+    query_images = _run_on_loop("query_images")
+    extract = _run_on_loop("extract")
+    submit_extraction = _run_on_loop("submit_extraction")
+    extraction_job = _run_on_loop("extraction_job")
+    cancel_extraction = _run_on_loop("cancel_extraction")
+    wait_for_extraction = _run_on_loop("wait_for_extraction")
+    extraction_result = _run_on_loop("extraction_result")
+    heatmap_region = _run_on_loop("heatmap_region")
+    duplicates = _run_on_loop("duplicates")
+
+
 def load_json(file_path: str) -> dict:
     with open(file_path, "rb") as file:
         result = json.load(file)
@@ -335,4 +704,33 @@ if __name__ == "__main__":
     #     extraction_type=ExtractionTypes.ACTIVATIONS
     # )
 
-  
+    # print("STEP 14.........")
+    # # Find images with a predicted box larger than 400 pixels overlapping the top left corner
+    # model_name = "Terminator Model"
+    # dataset_name = "terminator_dataset"
+    # result = tc.query_images(
+    #     dataset_name=dataset_name,
+    #     model_name=model_name,
+    #     region=[0, 0, 20, 20],
+    #     min_area=400,
+    # )
+
+    # print("STEP 15.........")
+    # # Run an extraction in the background and poll it until it finishes
+    # model_name = "Terminator Model"
+    # dataset_name = "terminator_dataset"
+    # job = tc.submit_extraction(
+    #     dataset_name=dataset_name,
+    #     model_name=model_name,
+    #     extraction_type=ExtractionTypes.HEATMAP
+    # )
+    # job = tc.wait_for_extraction(job["id"], poll_interval=5)
+
+    # print("STEP 16.........")
+    # # Overview of a heatmap two levels down, then the full resolution top left corner
+    # overview = tc.heatmap_region(dataset_name=dataset_name, model_name=model_name, image_name="1.jpg", level=2)
+    # corner = tc.heatmap_region(
+    #     dataset_name=dataset_name, model_name=model_name, image_name="1.jpg", region=[0, 0, 512, 512]
+    # )
+
+    tc.close()
@@ -28,7 +28,8 @@ def dataset_input(n):
 
 @pytest.fixture
 def tc():
-    return TenyksSDK()
+    with TenyksSDK() as client:
+        yield client
 
 @pytest.mark.parametrize('n', [""],)
 def test_we_can_save_a_dataset_succesfully(tc, dataset_input):
@@ -0,0 +1,108 @@
+import io
+from dataclasses import dataclass
+from enum import Enum, unique
+from typing import List, Union
+import numpy as np
+
+"""
+Binary encoding of extraction results (heatmaps, layer activations) for object storage.
+
+A single unquantized, uncompressed array is written as a plain .npy file, which numpy can
+read or memory map directly. Anything else is written as an .npz archive with one entry
+per array, deflated when compression is on. uint8 quantization is linear between the
+array minimum and maximum, which are stored next to the data so it can be restored.
+"""
+
+CONTENT_TYPE = "application/octet-stream"
+
+
+@unique
+class Quantization(str, Enum):
+    NONE = "none"
+    FLOAT16 = "float16"
+    UINT8 = "uint8"
+
+
+@dataclass
+class EncodedArray:
+    content: bytes
+    extension: str
+    dtype: str
+    shape: list
+
+
+def encode_array(
+    array: np.ndarray, quantization: Quantization = Quantization.NONE, compress: bool = False
+) -> EncodedArray:
+    """Encode one array, such as a heatmap"""
+
+    return _encode({"data": np.asarray(array)}, quantization, compress, single=True)
+
+
+def encode_arrays(
+    arrays: List[np.ndarray], quantization: Quantization = Quantization.NONE, compress: bool = False
+) -> EncodedArray:
+    """Encode a list of arrays of different shapes, such as the activations of every layer"""
+
+    entries = {f"layer_{i}": np.asarray(array) for i, array in enumerate(arrays)}
+    return _encode(entries, quantization, compress, single=False)
+
+
+def decode_array(content: bytes) -> Union[np.ndarray, List[np.ndarray]]:
+    """Decode the output of encode_array or encode_arrays back to float arrays"""
+
+    loaded = np.load(io.BytesIO(content), allow_pickle=False)
+    if isinstance(loaded, np.ndarray):
+        return loaded
+
+    with loaded:
+        names = [name for name in loaded.files if not name.endswith((".min", ".max"))]
+        arrays = {name: _dequantize(loaded, name) for name in names}
+
+    if list(arrays) == ["data"]:
+        return arrays["data"]
+    return [arrays[f"layer_{i}"] for i in range(len(arrays))]
+
+
+def _encode(entries: dict, quantization: Quantization, compress: bool, single: bool) -> EncodedArray:
+    stored = {}
+    for name, array in entries.items():
+        stored.update(_quantize(name, array, quantization))
+
+    buffer = io.BytesIO()
+    if single and quantization != Quantization.UINT8 and not compress:
+        np.save(buffer, stored["data"], allow_pickle=False)
+        extension = "npy"
+    else:
+        (np.savez_compressed if compress else np.savez)(buffer, **stored)
+        extension = "npz"
+
+    shapes = [list(array.shape) for array in entries.values()]
+    return EncodedArray(
+        content=buffer.getvalue(),
+        extension=extension,
+        dtype=str(stored[next(iter(entries))].dtype),
+        shape=shapes[0] if single else shapes,
+    )
+
+
+def _quantize(name: str, array: np.ndarray, quantization: Quantization) -> dict:
+    if quantization == Quantization.FLOAT16:
+        return {name: array.astype(np.float16)}
+    if quantization == Quantization.UINT8:
+        low, high = (float(array.min()), float(array.max())) if array.size else (0.0, 0.0)
+        scale = (high - low) / 255 or 1.0
+        quantized = np.rint((array - low) / scale).astype(np.uint8)
+        return {name: quantized, f"{name}.min": np.float64(low), f"{name}.max": np.float64(high)}
+
+    return {name: array}
+
+
+def _dequantize(loaded, name: str) -> np.ndarray:
+    array = loaded[name]
+    if array.dtype != np.uint8 or f"{name}.min" not in loaded.files:
+        return array
+
+    low, high = float(loaded[f"{name}.min"]), float(loaded[f"{name}.max"])
+    scale = (high - low) / 255 or 1.0
+    return array.astype(np.float32) * scale + low
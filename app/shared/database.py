@@ -1,8 +1,11 @@
-from dataclasses import dataclass, is_dataclass, fields
+import time
+from collections import namedtuple
+from dataclasses import MISSING, dataclass, is_dataclass, fields
 import pydantic
-from typing import AsyncGenerator, Callable, Type, List, TypeVar
+from typing import Any, AsyncGenerator, Callable, Dict, Optional, Type, List, Tuple, TypeVar
 import asyncpg
 from asyncpg.connection import Connection
+from asyncpg.cursor import Cursor
 from asyncpg.pool import Pool
 from fastapi import Depends
 from starlette.requests import Request
@@ -12,6 +15,84 @@ T = TypeVar("T")
 class Config:
     arbitrary_types_allowed = True
 
+
+@dataclass
+class StatementStats:
+    """Call counts and timings of one named repository statement"""
+
+    name: str
+    calls: int = 0
+    total_ms: float = 0.0
+    mean_ms: float = 0.0
+    max_ms: float = 0.0
+
+
+class StatementRegistry:
+    """
+    Times every call of the named repository statements.
+
+    Statements are prepared once per connection by asyncpg's own statement cache, bounded
+    by PSQL_STATEMENT_CACHE_SIZE, which evicts the least recently used query and prepares
+    a statement again when a schema change invalidated it. Calls are reported under their
+    name, so a name may cover several variants of a dynamically built query.
+    """
+
+    def __init__(self) -> None:
+        self._stats: Dict[str, StatementStats] = {}
+
+    async def fetch(self, conn: Connection, name: str, query: str, *args) -> List[asyncpg.Record]:
+        return await self._run(conn, name, query, "fetch", *args)
+
+    async def fetchrow(self, conn: Connection, name: str, query: str, *args) -> Optional[asyncpg.Record]:
+        return await self._run(conn, name, query, "fetchrow", *args)
+
+    async def fetchval(self, conn: Connection, name: str, query: str, *args) -> Any:
+        return await self._run(conn, name, query, "fetchval", *args)
+
+    async def execute(self, conn: Connection, name: str, query: str, *args) -> None:
+        await self._run(conn, name, query, "execute", *args)
+
+    async def cursor(self, conn: Connection, name: str, query: str, *args) -> Cursor:
+        """Open a cursor on a cached prepared statement, which must happen inside a transaction"""
+
+        start = time.perf_counter()
+        try:
+            return await conn.cursor(query, *args)
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def stats(self) -> List[StatementStats]:
+        return sorted(self._stats.values(), key=lambda stats: stats.total_ms, reverse=True)
+
+    def reset_stats(self) -> None:
+        self._stats = {}
+
+    async def _run(self, conn: Connection, name: str, query: str, method: str, *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return await getattr(conn, method)(query, *args)
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def _stats_for(self, name: str) -> StatementStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = StatementStats(name=name)
+
+        return stats
+
+    def _record(self, name: str, seconds: float) -> None:
+        stats = self._stats_for(name)
+        elapsed_ms = seconds * 1000
+        stats.calls += 1
+        stats.total_ms += elapsed_ms
+        stats.mean_ms = stats.total_ms / stats.calls
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+
+statements = StatementRegistry()
+
+
 @pydantic.dataclasses.dataclass(config=Config)
 class BaseRepository:
     conn: Connection
@@ -20,12 +101,26 @@ class BaseRepository:
     def connection(self) -> Connection:
         return self.conn
 
+    async def fetch(self, statement: str, query: str, *args) -> List[asyncpg.Record]:
+        return await statements.fetch(self.connection, statement, query, *args)
+
+    async def fetchrow(self, statement: str, query: str, *args) -> Optional[asyncpg.Record]:
+        return await statements.fetchrow(self.connection, statement, query, *args)
+
+    async def fetchval(self, statement: str, query: str, *args) -> Any:
+        return await statements.fetchval(self.connection, statement, query, *args)
+
+    async def execute(self, statement: str, query: str, *args) -> None:
+        await statements.execute(self.connection, statement, query, *args)
+
+
+def get_pool(request: Request) -> Pool:
+    """The pool itself, for handlers that use a connection after they return, such as streamed responses"""
 
-def _get_db_pool(request: Request) -> Pool:
     return request.app.state.pool
 
 async def _get_connection_from_pool(
-    pool: Pool = Depends(_get_db_pool),
+    pool: Pool = Depends(get_pool),
 ) -> AsyncGenerator[Connection, None]:
     async with pool.acquire() as conn:
         yield conn
@@ -40,35 +135,134 @@ def get_repository(
 
     return _get_repo
     
-async def typed_fetch(conn: Connection, typ: T, query: str, *args) -> List[T]:
-    """Maps all columns of a database record to a Python data class."""
+async def typed_fetch(
+    conn: Connection, typ: T, query: str, *args, as_tuples: bool = False, statement: Optional[str] = None
+) -> List[T]:
+    """
+    Maps all columns of a database record to a Python data class.
+
+    With as_tuples the rows come back as named tuples carrying the data class field names,
+    which are cheaper to build and hold than data class instances for bulk reads. Naming
+    the statement times the query under that name in the statement registry.
+    """
+
+    if not is_dataclass(typ):
+        raise TypeError(f"{typ} must be a dataclass type or List[dataclass] type")
+
+    if statement is None:
+        records = await conn.fetch(query, *args)
+    else:
+        records = await statements.fetch(conn, statement, query, *args)
+    return _typed_fetch(typ, records, as_tuples=as_tuples)
+
+async def typed_cursor(
+    conn: Connection,
+    typ: T,
+    query: str,
+    *args,
+    batch_size: int = 1000,
+    as_tuples: bool = False,
+    statement: Optional[str] = None,
+) -> AsyncGenerator[T, None]:
+    """
+    Stream rows of a query through a server-side cursor mapped to a Python data class.
+
+    Only batch_size rows are held in memory at a time. Cursors need a transaction, so one
+    is opened for the life of the generator.
+    """
 
     if not is_dataclass(typ):
         raise TypeError(f"{typ} must be a dataclass type or List[dataclass] type")
 
-    records = await conn.fetch(query, *args)
-    return _typed_fetch(typ, records)
-
-def _typed_fetch(typ: Type[T], records: List[asyncpg.Record]) -> List[T]:
-    results = []
-
-    for record in records:
-        result = object.__new__(typ)
-        if is_dataclass(typ):
-            for field in fields(typ):
-                key = field.name
-                value = record.get(key, None)
-
-                if value is not None:
-                    setattr(result, key, value)
-                elif field.default:
-                    setattr(result, key, field.default)
-                # else:
-                #     raise RuntimeError(
-                #         f"object field {key} without default value is missing a corresponding database record column"
-                #     )
+    async with conn.transaction():
+        if statement is None:
+            cursor = await conn.cursor(query, *args)
         else:
+            cursor = await statements.cursor(conn, statement, query, *args)
+        while True:
+            records = await cursor.fetch(batch_size)
+            if not records:
+                break
+            for result in _typed_fetch(typ, records, as_tuples=as_tuples):
+                yield result
+
+def _typed_fetch(typ: Type[T], records: List[asyncpg.Record], as_tuples: bool = False) -> List[T]:
+    if not records:
+        return []
+
+    mapper = record_mapper(typ, tuple(records[0].keys()), as_tuples=as_tuples)
+    return [mapper(record) for record in records]
+
+_mappers: Dict[Tuple[type, Tuple[str, ...], bool], Callable[[asyncpg.Record], T]] = {}
+_tuple_types: Dict[type, type] = {}
+
+def record_mapper(typ: Type[T], columns: Tuple[str, ...], as_tuples: bool = False) -> Callable[[asyncpg.Record], T]:
+    """
+    Get a function turning a record with the given columns into an instance of typ.
+
+    Mappers are compiled once per (type, column set) and cached. Pydantic validation is
+    skipped as before, but a NULL or missing column now takes the field default or
+    default_factory whenever there is one, and None otherwise.
+    """
+
+    key = (typ, columns, as_tuples)
+    mapper = _mappers.get(key)
+    if mapper is None:
+        mapper = _mappers[key] = _compile_mapper(typ, columns, as_tuples)
+
+    return mapper
+
+def record_tuple_type(typ: Type[T]) -> type:
+    """The named tuple type mirroring the fields of a data class"""
+
+    tuple_type = _tuple_types.get(typ)
+    if tuple_type is None:
+        tuple_type = _tuple_types[typ] = namedtuple(f"{typ.__name__}Record", [field.name for field in fields(typ)])
+
+    return tuple_type
+
+def _compile_mapper(typ: Type[T], columns: Tuple[str, ...], as_tuples: bool) -> Callable[[asyncpg.Record], T]:
+    if not is_dataclass(typ):
+        def map_record(record: asyncpg.Record) -> T:
+            result = object.__new__(typ)
             for key, value in record.items():
                 setattr(result, key, value)
-        results.append(result)
-    return results
\ No newline at end of file
+            return result
+
+        return map_record
+
+    namespace = {"typ": typ, "new": object.__new__, "tuple_new": tuple.__new__}
+    positions = {column: i for i, column in enumerate(columns)}
+    lines = []
+    values = []
+    for i, field in enumerate(fields(typ)):
+        if field.default is not MISSING:
+            namespace[f"default_{i}"] = field.default
+            fallback = f"default_{i}"
+        elif field.default_factory is not MISSING:
+            namespace[f"factory_{i}"] = field.default_factory
+            fallback = f"factory_{i}()"
+        else:
+            fallback = "None"
+
+        if field.name not in positions:
+            values.append(fallback)
+        elif fallback == "None":
+            values.append(f"record[{positions[field.name]}]")
+        else:
+            lines.append(f"    value_{i} = record[{positions[field.name]}]")
+            values.append(f"(value_{i} if value_{i} is not None else {fallback})")
+
+    if as_tuples:
+        namespace["typ"] = record_tuple_type(typ)
+        lines.append(f"    return tuple_new(typ, ({', '.join(values)},))")
+    else:
+        items = ", ".join(f"{field.name!r}: {value}" for field, value in zip(fields(typ), values))
+        lines.append("    result = new(typ)")
+        lines.append(f"    result.__dict__.update({{{items}}})")
+        lines.append("    return result")
+
+    source = "def map_record(record):\n" + "\n".join(lines)
+    exec(compile(source, f"<record mapper {typ.__name__}>", "exec"), namespace)
+
+    return namespace["map_record"]
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Tuple
+import numpy as np
+
+from .array_codec import EncodedArray, Quantization
+
+"""
+Tiled multi-resolution storage for heatmaps.
+
+A heatmap is stored as a pyramid in a single object: level 0 is the full resolution array
+and every following level halves both sides with a 2x2 mean, down to the first level that
+fits in one tile. Each level is cut into square tiles written row by row, so the tiles a
+window needs in one tile row form a single contiguous byte range.
+
+Layout: MAGIC, the header length as a little endian uint32, a JSON header holding the
+dtype, tile size, quantization range and the (offset, length) of every tile per level,
+then the tile bytes, with tile offsets relative to the end of the header. A region read
+fetches the header with one ranged GET and then one ranged GET per tile row it touches.
+"""
+
+PYRAMID_EXTENSION = "hmp"
+MAGIC = b"TNKHMP01"
+
+# Side of the square tiles, and how many bytes the first ranged GET reads to find the header
+HEATMAP_TILE_SIZE = int(os.environ.get("HEATMAP_TILE_SIZE", 256))
+HEATMAP_HEADER_PREFETCH = int(os.environ.get("HEATMAP_HEADER_PREFETCH", 64 * 1024))
+
+_PREFIX = struct.Struct("<8sI")
+
+ReadRange = Callable[[int, int], Awaitable[bytes]]
+
+
+@dataclass
+class PyramidLevel:
+    shape: Tuple[int, int]
+    tiles: List[Tuple[int, int]]
+
+    def grid(self, tile_size: int) -> Tuple[int, int]:
+        return -(-self.shape[0] // tile_size), -(-self.shape[1] // tile_size)
+
+
+@dataclass
+class PyramidHeader:
+    dtype: str
+    tile_size: int
+    compressed: bool
+    value_range: Optional[Tuple[float, float]]
+    levels: List[PyramidLevel]
+    data_start: int
+
+    @classmethod
+    def from_json(cls, content: bytes, data_start: int) -> "PyramidHeader":
+        header = json.loads(content)
+        return cls(
+            dtype=header["dtype"],
+            tile_size=header["tile_size"],
+            compressed=header["compressed"],
+            value_range=tuple(header["value_range"]) if header["value_range"] else None,
+            levels=[
+                PyramidLevel(shape=tuple(level["shape"]), tiles=[tuple(tile) for tile in level["tiles"]])
+                for level in header["levels"]
+            ],
+            data_start=data_start,
+        )
+
+
+def encode_heatmap_pyramid(
+    heatmap: np.ndarray,
+    quantization: Quantization = Quantization.NONE,
+    compress: bool = False,
+    tile_size: int = HEATMAP_TILE_SIZE,
+) -> EncodedArray:
+    levels = _pyramid(np.asarray(heatmap, dtype=np.float64), tile_size)
+
+    value_range = None
+    if quantization == Quantization.UINT8:
+        value_range = (float(levels[0].min()), float(levels[0].max())) if levels[0].size else (0.0, 0.0)
+
+    tiles_by_level = []
+    for level in levels:
+        stored = _quantize(level, quantization, value_range)
+        tiles = []
+        for row in range(0, stored.shape[0], tile_size):
+            for col in range(0, stored.shape[1], tile_size):
+                tile = np.ascontiguousarray(stored[row:row + tile_size, col:col + tile_size]).tobytes()
+                tiles.append(zlib.compress(tile, 1) if compress else tile)
+        tiles_by_level.append((stored, tiles))
+
+    offset = 0
+    header_levels = []
+    for stored, tiles in tiles_by_level:
+        entries = []
+        for tile in tiles:
+            entries.append([offset, len(tile)])
+            offset += len(tile)
+        header_levels.append({"shape": list(stored.shape), "tiles": entries})
+
+    header = json.dumps({
+        "dtype": str(tiles_by_level[0][0].dtype),
+        "tile_size": tile_size,
+        "compressed": compress,
+        "value_range": value_range,
+        "levels": header_levels,
+    }).encode()
+
+    content = b"".join(
+        [_PREFIX.pack(MAGIC, len(header)), header] + [tile for _, tiles in tiles_by_level for tile in tiles]
+    )
+    return EncodedArray(
+        content=content,
+        extension=PYRAMID_EXTENSION,
+        dtype=str(tiles_by_level[0][0].dtype),
+        shape=list(levels[0].shape),
+    )
+
+
+async def read_pyramid_header(read_range: ReadRange) -> PyramidHeader:
+    """Read the header of a stored pyramid, with a second ranged GET only if it is unusually large"""
+
+    prefix = await read_range(0, HEATMAP_HEADER_PREFETCH)
+    end = _header_end(prefix)
+    if len(prefix) < end:
+        prefix += await read_range(len(prefix), end - len(prefix))
+
+    return PyramidHeader.from_json(prefix[_PREFIX.size:end], data_start=end)
+
+
+async def read_heatmap_region(
+    read_range: ReadRange,
+    level: int = 0,
+    region: Optional[List[int]] = None,
+    header: Optional[PyramidHeader] = None,
+) -> np.ndarray:
+    """
+    Read the [x_min, y_min, x_max, y_max] window of a pyramid level, in that level's pixel
+    coordinates, fetching only the tiles it overlaps. The whole level is read without a region.
+    """
+
+    header = header or await read_pyramid_header(read_range)
+    window = _window([pyramid_level.shape for pyramid_level in header.levels], level, region)
+    ranges = _tile_row_ranges(header, level, window)
+    row_bytes = await asyncio.gather(*[read_range(offset, length) for _, offset, length in ranges])
+
+    return _assemble(header, level, window, ranges, row_bytes)
+
+
+def decode_heatmap_pyramid(content: bytes, level: int = 0, region: Optional[List[int]] = None) -> np.ndarray:
+    """Decode a level, or a window of it, from an object that was already downloaded"""
+
+    end = _header_end(content)
+    header = PyramidHeader.from_json(content[_PREFIX.size:end], data_start=end)
+    window = _window([pyramid_level.shape for pyramid_level in header.levels], level, region)
+    ranges = _tile_row_ranges(header, level, window)
+    row_bytes = [content[offset:offset + length] for _, offset, length in ranges]
+
+    return _assemble(header, level, window, ranges, row_bytes)
+
+
+def crop_heatmap(heatmap: np.ndarray, level: int = 0, region: Optional[List[int]] = None) -> np.ndarray:
+    """Window of a heatmap stored as a plain array before the tiled format, which only has level 0"""
+
+    x_min, y_min, x_max, y_max = _window([heatmap.shape], level, region)
+    return heatmap[y_min:max(y_max, y_min), x_min:max(x_max, x_min)]
+
+
+def _header_end(prefix: bytes) -> int:
+    if len(prefix) < _PREFIX.size:
+        raise ValueError("Not a tiled heatmap")
+    magic, header_length = _PREFIX.unpack_from(prefix)
+    if magic != MAGIC:
+        raise ValueError("Not a tiled heatmap")
+
+    return _PREFIX.size + header_length
+
+
+def _window(shapes: List[Tuple[int, int]], level: int, region: Optional[List[int]]) -> Tuple[int, int, int, int]:
+    if not 0 <= level < len(shapes):
+        raise ValueError(f"Level {level} out of range, the heatmap has {len(shapes)} levels")
+
+    height, width = shapes[level]
+    x_min, y_min, x_max, y_max = region or [0, 0, width, height]
+    return max(x_min, 0), max(y_min, 0), min(x_max, width), min(y_max, height)
+
+
+def _tile_row_ranges(header: PyramidHeader, level: int, window: Tuple[int, int, int, int]) -> List[Tuple[int, int, int]]:
+    """(tile row, absolute offset, length) of the contiguous bytes each overlapped tile row needs"""
+
+    x_min, y_min, x_max, y_max = window
+    if x_min >= x_max or y_min >= y_max:
+        return []
+
+    pyramid_level = header.levels[level]
+    tile_size = header.tile_size
+    cols = pyramid_level.grid(tile_size)[1]
+    col_start, col_end = x_min // tile_size, (x_max - 1) // tile_size
+
+    ranges = []
+    for row in range(y_min // tile_size, (y_max - 1) // tile_size + 1):
+        first = pyramid_level.tiles[row * cols + col_start]
+        last = pyramid_level.tiles[row * cols + col_end]
+        ranges.append((row, header.data_start + first[0], last[0] + last[1] - first[0]))
+
+    return ranges
+
+
+def _assemble(
+    header: PyramidHeader,
+    level: int,
+    window: Tuple[int, int, int, int],
+    ranges: List[Tuple[int, int, int]],
+    row_bytes: List[bytes],
+) -> np.ndarray:
+    x_min, y_min, x_max, y_max = window
+    out = np.empty((max(y_max - y_min, 0), max(x_max - x_min, 0)), dtype=header.dtype)
+
+    pyramid_level = header.levels[level]
+    tile_size = header.tile_size
+    cols = pyramid_level.grid(tile_size)[1]
+    col_start, col_end = x_min // tile_size, (x_max - 1) // tile_size
+    for (row, row_offset, _), content in zip(ranges, row_bytes):
+        base = row_offset - header.data_start
+        for col in range(col_start, col_end + 1):
+            offset, length = pyramid_level.tiles[row * cols + col]
+            tile = _decode_tile(content[offset - base:offset - base + length], header, pyramid_level, row, col)
+            top, left = row * tile_size, col * tile_size
+            y0, y1 = max(y_min, top), min(y_max, top + tile.shape[0])
+            x0, x1 = max(x_min, left), min(x_max, left + tile.shape[1])
+            out[y0 - y_min:y1 - y_min, x0 - x_min:x1 - x_min] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    return _dequantize(out, header)
+
+
+def _pyramid(heatmap: np.ndarray, tile_size: int) -> List[np.ndarray]:
+    levels = [heatmap]
+    while max(levels[-1].shape) > tile_size:
+        level = levels[-1]
+        padded = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2)), mode="edge")
+        levels.append(padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).mean(axis=(1, 3)))
+
+    return levels
+
+
+def _quantize(level: np.ndarray, quantization: Quantization, value_range: Optional[Tuple[float, float]]) -> np.ndarray:
+    if quantization == Quantization.FLOAT16:
+        return level.astype(np.float16)
+    if quantization == Quantization.UINT8:
+        low, high = value_range
+        scale = (high - low) / 255 or 1.0
+        return np.clip(np.rint((level - low) / scale), 0, 255).astype(np.uint8)
+
+    return level
+
+
+def _dequantize(array: np.ndarray, header: PyramidHeader) -> np.ndarray:
+    if header.value_range is None:
+        return array
+
+    low, high = header.value_range
+    scale = (high - low) / 255 or 1.0
+    return array.astype(np.float32) * scale + low
+
+
+def _decode_tile(content: bytes, header: PyramidHeader, level: PyramidLevel, row: int, col: int) -> np.ndarray:
+    tile_size = header.tile_size
+    shape = (
+        min(tile_size, level.shape[0] - row * tile_size),
+        min(tile_size, level.shape[1] - col * tile_size),
+    )
+    if header.compressed:
+        content = zlib.decompress(content)
+
+    return np.frombuffer(content, dtype=header.dtype).reshape(shape)
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import io
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+from PIL import Image as PILImage, UnidentifiedImageError
+
+from .s3_utils import AwsConfig, ManifestEntry, S3ClientManager, s3_download_file, s3_download_object_range
+
+# Bytes fetched to parse an image header, the whole object is only read if the header is longer
+IMAGE_HEADER_BYTES = int(os.environ.get("IMAGE_HEADER_BYTES", 64 * 1024))
+
+
+@dataclass
+class ImageInfo:
+    """File level facts about an image, known without decoding its pixels"""
+
+    byte_size: int
+    content_hash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    channels: Optional[int] = None
+    format: Optional[str] = None
+    dhash: Optional[int] = None
+
+
+def parse_image_header(content: bytes) -> Optional[ImageInfo]:
+    """
+    Read dimensions, channels and format from the start of an image file. PIL only parses
+    the header on open, pixel data is never decoded. Returns nothing if the header does
+    not fit in content.
+    """
+
+    try:
+        with PILImage.open(io.BytesIO(content)) as image:
+            return ImageInfo(
+                byte_size=len(content),
+                width=image.width,
+                height=image.height,
+                channels=len(image.getbands()),
+                format=image.format,
+            )
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+
+
+def dhash(content: bytes) -> Optional[int]:
+    """
+    64 bit difference hash: the sign of the horizontal gradients of a 9x8 grayscale thumbnail,
+    as a signed integer so it fits a BIGINT. JPEGs are decoded at a reduced scale.
+    """
+
+    try:
+        with PILImage.open(io.BytesIO(content)) as image:
+            image.draft("L", (64, 64))
+            pixels = list(image.convert("L").resize((9, 8), PILImage.BILINEAR).getdata())
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def near_duplicate_groups(hashes: Dict[Hashable, int], max_distance: int) -> List[Tuple[List[Hashable], int]]:
+    """
+    Group keys whose difference hashes are at most max_distance bits apart, returning each
+    group with the largest distance that joined it.
+
+    The 64 bits are cut into max_distance + 1 bands. Two hashes that close must agree on at
+    least one whole band, so only keys sharing a band are compared instead of every pair.
+    """
+
+    bands = max_distance + 1
+    bounds = [round(64 * i / bands) for i in range(bands + 1)]
+    buckets = defaultdict(list)
+    for key, value in hashes.items():
+        unsigned = value & 0xFFFFFFFFFFFFFFFF
+        for band in range(bands):
+            width = bounds[band + 1] - bounds[band]
+            buckets[(band, (unsigned >> bounds[band]) & ((1 << width) - 1))].append(key)
+
+    parents = {key: key for key in hashes}
+
+    def root(key):
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    distances = defaultdict(int)
+    compared = set()
+    for keys in buckets.values():
+        for i, a in enumerate(keys):
+            for b in keys[i + 1:]:
+                if (a, b) in compared:
+                    continue
+                compared.add((a, b))
+                distance = hamming_distance(hashes[a], hashes[b])
+                if distance <= max_distance:
+                    ra, rb = root(a), root(b)
+                    merged = max(distances.pop(ra, 0), distances.pop(rb, 0), distance)
+                    parents[rb] = ra
+                    distances[ra] = merged
+
+    groups = defaultdict(list)
+    for key in hashes:
+        groups[root(key)].append(key)
+
+    return [(keys, distances[group]) for group, keys in groups.items() if len(keys) > 1]
+
+
+async def probe_image(
+    entry: ManifestEntry,
+    aws_config: AwsConfig,
+    clients: Optional[S3ClientManager] = None,
+    with_dhash: bool = False,
+) -> ImageInfo:
+    """
+    Describe an image from a ranged GET of its header. The whole object is downloaded only
+    when the header does not fit in IMAGE_HEADER_BYTES, the ETag is not the MD5 of the
+    bytes (multipart uploads, SSE-KMS and SSE-C), in which case the content hash is
+    computed from the bytes, or a dhash is asked for.
+    """
+
+    content_hash = None
+    content = None
+    info = None
+    if "-" not in entry.etag and entry.size > IMAGE_HEADER_BYTES and not with_dhash:
+        header = await s3_download_object_range(
+            entry.key, 0, IMAGE_HEADER_BYTES, aws_config=aws_config, clients=clients
+        )
+        if header.etag_is_md5:
+            content_hash = entry.etag
+            info = parse_image_header(header.content)
+
+    if info is None:
+        content = (await s3_download_file(entry.key, aws_config=aws_config, clients=clients)).content.getvalue()
+        info = parse_image_header(content) or ImageInfo(byte_size=entry.size)
+        content_hash = hashlib.md5(content).hexdigest()
+
+    info.byte_size = entry.size
+    info.content_hash = content_hash
+    if with_dhash:
+        info.dhash = dhash(content)
+    return info
+
+
+async def probe_images(
+    entries: List[ManifestEntry],
+    aws_config: AwsConfig,
+    concurrency: int,
+    clients: Optional[S3ClientManager] = None,
+    with_dhash: bool = False,
+) -> List[ImageInfo]:
+    """Probe many images with at most concurrency requests in flight, in input order"""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(entry: ManifestEntry) -> ImageInfo:
+        async with semaphore:
+            return await probe_image(entry, aws_config=aws_config, clients=clients, with_dhash=with_dhash)
+
+    return await asyncio.gather(*[probe(entry) for entry in entries])
@@ -0,0 +1,192 @@
+import dataclasses
+import json
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .s3_utils import AwsConfig, ManifestEntry, S3ClientManager, s3_list_objects
+
+IMAGE_EXTENSIONS = {"jpeg", "jpg", "png", "gif", "tiff", "bmp", "svg"}
+ANNOTATION_EXTENSIONS = {"json"}
+
+# Seconds a prefix listing, in memory or persisted with a manifest, is trusted before listing again
+MANIFEST_MAX_AGE = float(os.environ.get("MANIFEST_MAX_AGE", 15 * 60))
+
+# Prefix to (time listed, entries)
+Listings = Dict[str, Tuple[float, List[ManifestEntry]]]
+
+
+@dataclass
+class ManifestPair:
+    """An image and the annotation file sharing its stem"""
+
+    name: str
+    image: ManifestEntry
+    annotation: ManifestEntry
+
+
+@dataclass
+class DatasetManifest:
+    """Everything known about a dataset prefix after a single listing pass"""
+
+    images_path: str
+    annotations_path: Optional[str]
+    images: List[ManifestEntry]
+    annotations: List[ManifestEntry]
+    # When the oldest listing the manifest was built from was made, as a unix timestamp
+    listed_at: float = 0.0
+
+    def is_fresh(self, max_age: float = MANIFEST_MAX_AGE) -> bool:
+        return time.time() - self.listed_at < max_age
+
+    @property
+    def image_type(self) -> Optional[str]:
+        """The most common image extension in the dataset"""
+
+        counts = Counter(entry.extension for entry in self.images)
+        return counts.most_common(1)[0][0] if counts else None
+
+    @property
+    def size(self) -> int:
+        return len(self.images)
+
+    def pairs(self) -> List[ManifestPair]:
+        """Pair images with annotations by their stem relative to each prefix"""
+
+        annotations = {
+            _relative_stem(entry.key, self.annotations_path): entry
+            for entry in self.annotations
+        }
+
+        pairs = []
+        for entry in self.images:
+            annotation = annotations.get(_relative_stem(entry.key, self.images_path))
+            if annotation is not None:
+                pairs.append(
+                    ManifestPair(
+                        name=_relative_name(entry.key, self.images_path),
+                        image=entry,
+                        annotation=annotation,
+                    )
+                )
+
+        return pairs
+
+    def unpaired(self) -> Tuple[List[ManifestEntry], List[ManifestEntry]]:
+        """Images without an annotation and annotations without an image"""
+
+        image_stems = {_relative_stem(entry.key, self.images_path) for entry in self.images}
+        annotation_stems = {_relative_stem(entry.key, self.annotations_path) for entry in self.annotations}
+
+        return (
+            [entry for entry in self.images if _relative_stem(entry.key, self.images_path) not in annotation_stems],
+            [entry for entry in self.annotations if _relative_stem(entry.key, self.annotations_path) not in image_stems],
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(dataclasses.asdict(self), file)
+
+    @classmethod
+    def load(cls, path: str) -> "DatasetManifest":
+        with open(path, "r") as file:
+            data = json.load(file)
+
+        return cls(
+            images_path=data["images_path"],
+            annotations_path=data["annotations_path"],
+            images=[ManifestEntry(**entry) for entry in data["images"]],
+            annotations=[ManifestEntry(**entry) for entry in data["annotations"]],
+            listed_at=data.get("listed_at", 0.0),
+        )
+
+
+async def build_manifest(
+    images_path: str,
+    aws_config: AwsConfig,
+    annotations_path: Optional[str] = None,
+    listings: Optional[Listings] = None,
+    clients: Optional[S3ClientManager] = None,
+    max_age: float = MANIFEST_MAX_AGE,
+) -> DatasetManifest:
+    """
+    Build a dataset manifest with one listing pass per prefix.
+
+    Listings found in `listings` are reused while younger than max_age and new ones are
+    added to it, so a caller holding on to the dict does not list the same prefix twice
+    in a row but still sees files added since.
+    """
+
+    listings = {} if listings is None else listings
+    listed_at = []
+
+    async def listing(prefix: str) -> List[ManifestEntry]:
+        if prefix not in listings or time.time() - listings[prefix][0] >= max_age:
+            started = time.time()
+            entries = [entry async for entry in s3_list_objects(files_path=prefix, aws_config=aws_config, clients=clients)]
+            listings[prefix] = (started, entries)
+        listed_at.append(listings[prefix][0])
+        return listings[prefix][1]
+
+    images = [entry for entry in await listing(images_path) if entry.extension.lower() in IMAGE_EXTENSIONS]
+    annotations = [] if annotations_path is None else [
+        entry for entry in await listing(annotations_path) if entry.extension.lower() in ANNOTATION_EXTENSIONS
+    ]
+
+    return DatasetManifest(
+        images_path=images_path,
+        annotations_path=annotations_path,
+        images=images,
+        annotations=annotations,
+        listed_at=min(listed_at),
+    )
+
+
+async def load_or_build_manifest(
+    images_path: str,
+    aws_config: AwsConfig,
+    annotations_path: Optional[str] = None,
+    manifest_path: Optional[str] = None,
+    listings: Optional[Listings] = None,
+    clients: Optional[S3ClientManager] = None,
+    max_age: float = MANIFEST_MAX_AGE,
+) -> DatasetManifest:
+    """
+    Load a persisted manifest for the same prefixes if it is younger than max_age, otherwise
+    list the prefixes again and persist the new manifest. Files added or changed after the
+    listing are seen once it expires.
+    """
+
+    if manifest_path and os.path.exists(manifest_path):
+        manifest = DatasetManifest.load(manifest_path)
+        if (
+            manifest.images_path == images_path
+            and manifest.annotations_path == annotations_path
+            and manifest.is_fresh(max_age)
+        ):
+            return manifest
+
+    manifest = await build_manifest(
+        images_path=images_path,
+        aws_config=aws_config,
+        annotations_path=annotations_path,
+        listings=listings,
+        clients=clients,
+        max_age=max_age,
+    )
+    if manifest_path:
+        manifest.save(manifest_path)
+
+    return manifest
+
+
+def _relative_name(key: str, prefix: Optional[str]) -> str:
+    prefix = (prefix or "").rstrip("/")
+    return key[len(prefix):].lstrip("/") if prefix and key.startswith(prefix) else key
+
+
+def _relative_stem(key: str, prefix: Optional[str]) -> str:
+    name = _relative_name(key, prefix)
+    return name.rsplit(".", 1)[0] if "." in name.split("/")[-1] else name
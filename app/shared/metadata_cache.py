@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+from asyncpg.connection import Connection
+from asyncpg.pool import Pool
+
+"""
+Read-through caches for metadata rows that rarely change: datasets, models, dataset types
+and the name to id lookups over them.
+
+Every cache is bounded by a time to live and an entry count, evicting the least recently
+used entry first. Triggers on the cached tables NOTIFY the tenyks_metadata channel with the
+table name on every committed write, and each worker keeps one pooled connection LISTENing
+on it to clear the caches reading that table, so workers stay coherent with each other.
+While that connection is down notifications may be missed, so caches are bypassed until
+it is back and cleared when it is.
+"""
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "tenyks_metadata"
+
+# Seconds a cached entry is served for, and the most entries kept per cache
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", 300))
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", 1024))
+# Seconds between two attempts to bring the LISTEN connection back
+METADATA_CACHE_RECONNECT_INTERVAL = float(os.environ.get("METADATA_CACHE_RECONNECT_INTERVAL", 5))
+
+
+@dataclass
+class CacheStats:
+    """Hits, misses and evictions of one metadata cache"""
+
+    name: str
+    tables: List[str]
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    expirations: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    hit_rate: float = 0.0
+
+
+class MetadataCache:
+    """
+    A TTL and LRU bounded mapping filled by loaders on miss.
+
+    Loads racing an invalidation are not stored, so a value read before a write committed
+    cannot outlive the notification of that write. A load returning None is not stored
+    either, so a row that is missing now is looked up again once it is created. Cached
+    values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, name: str, tables: Iterable[str], ttl: float, max_size: int, enabled: Callable[[], bool]) -> None:
+        self.name = name
+        self.tables = list(tables)
+        self._ttl = ttl
+        self._max_size = max_size
+        self._enabled = enabled
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generation = 0
+        self._stats = CacheStats(name=name, tables=self.tables)
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        if not self._enabled():
+            self._stats.bypassed += 1
+            return await load()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return value
+            del self._entries[key]
+            self._stats.expirations += 1
+
+        self._stats.misses += 1
+        generation = self._generation
+        value = await load()
+        if value is not None and generation == self._generation:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+        return value
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+        self._stats.invalidations += 1
+
+    def stats(self) -> CacheStats:
+        stats = self._stats
+        stats.size = len(self._entries)
+        lookups = stats.hits + stats.misses
+        stats.hit_rate = stats.hits / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self) -> None:
+        self._stats = CacheStats(name=self.name, tables=self.tables)
+
+
+class MetadataCaches:
+    """The metadata caches of a process and the LISTEN connection keeping them coherent"""
+
+    def __init__(self) -> None:
+        self._caches: Dict[str, MetadataCache] = {}
+        self._listening = False
+        self._task: Optional[asyncio.Task] = None
+
+    def cache(
+        self,
+        name: str,
+        tables: Iterable[str],
+        ttl: float = METADATA_CACHE_TTL,
+        max_size: int = METADATA_CACHE_SIZE,
+    ) -> MetadataCache:
+        """Create a cache cleared by any write to the given tables"""
+
+        cache = self._caches[name] = MetadataCache(name, tables, ttl, max_size, enabled=lambda: self._listening)
+        return cache
+
+    async def start(self, pool: Pool) -> None:
+        self._task = asyncio.create_task(self._listen(pool))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def invalidate(self, *tables: str) -> None:
+        """Clear the caches reading any of the given tables, or every cache without tables"""
+
+        for cache in self._caches.values():
+            if not tables or set(tables) & set(cache.tables):
+                cache.invalidate()
+
+    def stats(self) -> List[CacheStats]:
+        return [cache.stats() for cache in self._caches.values()]
+
+    def reset_stats(self) -> None:
+        for cache in self._caches.values():
+            cache.reset_stats()
+
+    async def _listen(self, pool: Pool) -> None:
+        while True:
+            try:
+                async with pool.acquire() as conn:
+                    terminated = asyncio.Event()
+
+                    def on_notification(connection: Connection, pid: int, channel: str, table: str) -> None:
+                        self.invalidate(table)
+
+                    def on_termination(connection: Connection) -> None:
+                        terminated.set()
+
+                    conn.add_termination_listener(on_termination)
+                    await conn.add_listener(NOTIFY_CHANNEL, on_notification)
+                    # Writes may have gone by unnoticed while no connection was listening
+                    self.invalidate()
+                    self._listening = True
+                    try:
+                        await terminated.wait()
+                    finally:
+                        self._listening = False
+                        conn.remove_termination_listener(on_termination)
+                        if not conn.is_closed():
+                            await conn.remove_listener(NOTIFY_CHANNEL, on_notification)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Metadata cache listener failed, caches are bypassed until it reconnects")
+
+            await asyncio.sleep(METADATA_CACHE_RECONNECT_INTERVAL)
+
+
+metadata_caches = MetadataCaches()
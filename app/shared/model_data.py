@@ -22,8 +22,9 @@ class DummyModel:
         # Dummy heatmap generation
         # A heatmap is represented as a numpy array of shape (H * W), where H and W are the image height and width
         # The values represent the heatmap intensities
-        np_img = np.asarray(Image.open(img_path))
-        h, w = np_img.shape[0], np_img.shape[1]
+        # Only the header is parsed for the size, the pixels are never decoded
+        with Image.open(img_path) as image:
+            w, h = image.size
         # Values are generated randomly for the dummy models
         heatmap = np.random.uniform(0, 1, size=(h, w))
         return heatmap
@@ -64,6 +65,38 @@ class DummyModel:
         target['category_id'] = category_ids
         return target
 
+    def get_batch_heatmaps(self, images):
+        # Batched dummy heatmap generation for N images of the same size
+        # images is a stacked numpy array of shape (N * H * W [* C]) and the heatmaps are returned
+        # stacked in one array of shape (N * H * W)
+        n, h, w = images.shape[0], images.shape[1], images.shape[2]
+        return np.random.uniform(0, 1, size=(n, h, w))
+
+    def get_batch_activations(self, images):
+        # Batched dummy activation generation for N images, given as a stacked array or a list
+        # One array of shape (N * layer size) is returned per model layer
+        n = len(images)
+        return [
+            np.random.uniform(0, 1, size=(n, *np.atleast_1d(layer_size)))
+            for layer_size in self.layer_sizes
+        ]
+
+    def get_batch_predictions(self, images, max_bboxes=10):
+        # Batched dummy bounding box predictions for N images, padded to max_bboxes per image
+        # Returns bboxes of shape (N * max_bboxes * 4), category ids of shape (N * max_bboxes) and
+        # the number of predictions per image. Padding entries are set to -1
+        n = images.shape[0]
+        counts = np.random.randint(0, max_bboxes + 1, size=n)
+        category_ids = np.random.randint(0, 4, size=(n, max_bboxes))
+        mins = np.random.randint(0, 41, size=(n, max_bboxes, 2))
+        sizes = np.random.randint(5, 41, size=(n, max_bboxes, 2))
+        bboxes = np.concatenate([mins, mins + sizes], axis=2)
+
+        padding = np.arange(max_bboxes)[None, :] >= counts[:, None]
+        bboxes[padding] = -1
+        category_ids[padding] = -1
+        return bboxes, category_ids, counts
+
 
 
 def get_models():
@@ -1,37 +1,145 @@
+import asyncio
 import dataclasses
+import importlib.util
 import json
-from typing import Any
+import logging
+import os
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 import httpx
 from dataclasses import dataclass
 from fastapi import Response
 
+logger = logging.getLogger(__name__)
 
-async def get_async_request_handler(url, request: dataclass) -> dict:
+
+@dataclass
+class HttpClientConfig:
+    """Connection pool settings shared by every client a registry creates"""
+
+    max_connections: int = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+    max_keepalive_connections: int = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+    keepalive_expiry: float = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30))
+    timeout: float = float(os.environ.get("HTTP_TIMEOUT", 60))
+    http2: bool = os.environ.get("HTTP2", "false").lower() == "true"
+
+
+class HttpClientRegistry:
+    """
+    Long lived httpx clients, one per name, so requests reuse keep-alive connections.
+
+    A client is bound to the event loop it was created on, so asking for one from a
+    different loop replaces it instead of handing out a client that cannot be used.
+    Replaced clients are closed on their own loop if it is running in another thread,
+    or kept until aclose() is called from it. Clients of a loop that was closed cannot
+    be closed anymore and are dropped, their sockets close when they are collected.
+    """
+
+    def __init__(self, config: Optional[HttpClientConfig] = None) -> None:
+        self._config = config or HttpClientConfig()
+        self._clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        self._replaced: List[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = []
+
+    def get(self, name: str = "default") -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(name)
+        if entry is not None and entry[0] is loop and not entry[1].is_closed:
+            return entry[1]
+
+        if entry is not None:
+            self._replaced.append(entry)
+        self._close_replaced()
+
+        client = self._create_client()
+        self._clients[name] = (loop, client)
+        return client
+
+    async def aclose(self) -> None:
+        """Close every client created on this loop or on a loop running in another thread"""
+
+        loop = asyncio.get_running_loop()
+        clients = list(self._clients.values()) + self._replaced
+        self._clients, self._replaced = {}, []
+        for client_loop, client in clients:
+            if client.is_closed or client_loop.is_closed():
+                continue
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), client_loop))
+            else:
+                self._replaced.append((client_loop, client))
+
+    def _close_replaced(self) -> None:
+        replaced, self._replaced = self._replaced, []
+        for client_loop, client in replaced:
+            if client.is_closed or client_loop.is_closed():
+                continue
+            if client_loop.is_running() and client_loop is not asyncio.get_running_loop():
+                asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+            else:
+                self._replaced.append((client_loop, client))
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = self._config.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=self._config.timeout,
+            limits=httpx.Limits(
+                max_connections=self._config.max_connections,
+                max_keepalive_connections=self._config.max_keepalive_connections,
+                keepalive_expiry=self._config.keepalive_expiry,
+            ),
+        )
+
+
+http_clients = HttpClientRegistry()
+
+
+async def get_async_request_handler(url, request: dataclass, client: Optional[httpx.AsyncClient] = None) -> dict:
 
     headers = {"Content-type": "application/json"}
     params = dataclasses.asdict(request)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url=url, headers=headers, params=params)
-      
-        try:
-            response.raise_for_status()
-        except httpx.HTTPError as exc:
-            print(f"Error while requesting {exc.response.text}.")
-            print(f"Error while requesting {exc.request.url!r}.")
+    client = client or http_clients.get()
+    response = await client.get(url=url, headers=headers, params=params)
+
+    try:
+        response.raise_for_status()
+    except httpx.HTTPError as exc:
+        print(f"Error while requesting {exc.response.text}.")
+        print(f"Error while requesting {exc.request.url!r}.")
 
     return response
 
-async def post_async_request_handler(url, request: dataclass) -> dict:
+async def post_async_request_handler(url, request: dataclass, client: Optional[httpx.AsyncClient] = None) -> dict:
     headers = {"content-type": "application/json"}
     data = json.dumps(dataclasses.asdict(request))
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url=url, headers=headers, data=data)
-        try:
-            response.raise_for_status()
-        except httpx.HTTPError as exc:
-            print(f"Error while requesting {exc.response.text}.")
-            print(f"Error while requesting {exc.request.url!r}.")
-
-    return response
\ No newline at end of file
+
+    client = client or http_clients.get()
+    response = await client.post(url=url, headers=headers, data=data)
+    try:
+        response.raise_for_status()
+    except httpx.HTTPError as exc:
+        print(f"Error while requesting {exc.response.text}.")
+        print(f"Error while requesting {exc.request.url!r}.")
+
+    return response
+
+async def stream_async_request_handler(
+    url, request: dataclass, client: Optional[httpx.AsyncClient] = None
+) -> AsyncGenerator[dict, None]:
+    """POST a request and yield each line of a newline delimited JSON response as it arrives"""
+
+    headers = {"content-type": "application/json"}
+    data = json.dumps(dataclasses.asdict(request))
+
+    client = client or http_clients.get()
+    async with client.stream("POST", url=url, headers=headers, data=data) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                yield json.loads(line)
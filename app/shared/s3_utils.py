@@ -1,12 +1,28 @@
+import asyncio
 import json
 import os
 import dataclasses
-from typing import Any     
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session 
+from aiohttp import ClientError as AiohttpClientError
+from botocore.exceptions import ClientError, HTTPClientError
 from dataclasses import dataclass
 from io import BytesIO
 
-@dataclass
+DEFAULT_DOWNLOAD_CONCURRENCY = int(os.environ.get("S3_DOWNLOAD_CONCURRENCY", 16))
+DEFAULT_DOWNLOAD_BUFFER_SIZE = int(os.environ.get("S3_DOWNLOAD_BUFFER_SIZE", 64))
+DEFAULT_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 64))
+# Extra attempts at a GET failing with a transient error, and the first delay between them in seconds
+DEFAULT_DOWNLOAD_RETRIES = int(os.environ.get("S3_DOWNLOAD_RETRIES", 3))
+DEFAULT_DOWNLOAD_RETRY_DELAY = float(os.environ.get("S3_DOWNLOAD_RETRY_DELAY", 0.5))
+
+# S3 error codes worth retrying besides 5xx responses
+_TRANSIENT_ERROR_CODES = {"SlowDown", "Throttling", "ThrottlingException", "RequestTimeout", "RequestLimitExceeded"}
+
+@dataclass(frozen=True)
 class AwsConfig:
     endpoint_url: str
     region_name: str
@@ -18,67 +34,346 @@ class AwsConfig:
 class DownloadedFile:
     name: str
     content: BytesIO
+    key: Optional[str] = None
+    # Set instead of content when the object could not be downloaded or decoded
+    error: Optional[Exception] = None
+
+
+class S3ClientManager:
+    """
+    Long lived aiobotocore S3 clients keyed by AwsConfig.
+
+    Creating a client resolves credentials and builds a new connection pool, so clients
+    are kept open until close() is called. A client is bound to the event loop it was
+    created on and is replaced if requested from a different loop. Replaced clients are
+    closed on their own loop if it is running in another thread, or kept until close()
+    is called from it, and dropped once their loop is closed.
+    """
+
+    def __init__(self, max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS) -> None:
+        self._session = get_session()
+        self._max_pool_connections = max_pool_connections
+        self._clients: Dict[AwsConfig, Tuple[asyncio.AbstractEventLoop, AsyncExitStack, Any]] = {}
+        self._replaced: List[Tuple[asyncio.AbstractEventLoop, AsyncExitStack, Any]] = []
+
+    async def get(self, aws_config: AwsConfig) -> Any:
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(aws_config)
+        if entry is not None and entry[0] is loop:
+            return entry[2]
+
+        exit_stack = AsyncExitStack()
+        client = await exit_stack.enter_async_context(
+            self._session.create_client(
+                "s3",
+                config=AioConfig(max_pool_connections=self._max_pool_connections),
+                **dataclasses.asdict(aws_config),
+            )
+        )
+
+        # Another coroutine may have created a client for the same config meanwhile
+        entry = self._clients.get(aws_config)
+        if entry is not None and entry[0] is loop:
+            await exit_stack.aclose()
+            return entry[2]
+
+        if entry is not None:
+            self._replaced.append(entry)
+        self._close_replaced()
+
+        self._clients[aws_config] = (loop, exit_stack, client)
+        return client
+
+    async def close(self) -> None:
+        """Close every client created on this loop or on a loop running in another thread"""
+
+        loop = asyncio.get_running_loop()
+        clients = list(self._clients.values()) + self._replaced
+        self._clients, self._replaced = {}, []
+        for entry in clients:
+            client_loop, exit_stack, _ = entry
+            if client_loop.is_closed():
+                continue
+            if client_loop is loop:
+                await exit_stack.aclose()
+            elif client_loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(exit_stack.aclose(), client_loop))
+            else:
+                self._replaced.append(entry)
+
+    def _close_replaced(self) -> None:
+        replaced, self._replaced = self._replaced, []
+        for entry in replaced:
+            client_loop, exit_stack, _ = entry
+            if client_loop.is_closed():
+                continue
+            if client_loop.is_running() and client_loop is not asyncio.get_running_loop():
+                asyncio.run_coroutine_threadsafe(exit_stack.aclose(), client_loop)
+            else:
+                self._replaced.append(entry)
+
+
+s3_clients = S3ClientManager()
+
+
+@dataclass
+class ManifestEntry:
+    key: str
+    size: int
+    etag: str
+    extension: str
+
+
+async def s3_list_objects(
+    files_path: str, aws_config: AwsConfig, clients: Optional[S3ClientManager] = None
+) -> AsyncGenerator[ManifestEntry, None]:
+    """List every object under a prefix in a single ListObjectsV2 pass"""
+
+    bucket = os.environ.get("AWS_BUCKET")
+    s3 = await (clients or s3_clients).get(aws_config)
+    paginator = s3.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(Bucket=bucket, Prefix=files_path):
+        for c in page.get("Contents", []):
+            key = c["Key"]
+            if key.endswith("/"):
+                continue
+            file_name = key.split("/")[-1]
+            yield ManifestEntry(
+                key=key,
+                size=c["Size"],
+                etag=c["ETag"].strip('"'),
+                extension=file_name.split(".")[-1] if "." in file_name else "",
+            )
+
+
+async def s3_download_files(
+    files_path: str,
+    file_type_filter: str,
+    aws_config: AwsConfig,
+    concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+    ordered: bool = False,
+    buffer_size: int = DEFAULT_DOWNLOAD_BUFFER_SIZE,
+    clients: Optional[S3ClientManager] = None,
+) -> AsyncGenerator[DownloadedFile, None]:
+    """Download and json decode every file of the given type under a prefix"""
+
+    async for downloaded in s3_download_objects(
+        keys=s3_list_keys(files_path=files_path, file_type_filter=file_type_filter, aws_config=aws_config, clients=clients),
+        aws_config=aws_config,
+        concurrency=concurrency,
+        ordered=ordered,
+        buffer_size=buffer_size,
+        decode=decode_json,
+        clients=clients,
+    ):
+        yield downloaded
 
 
-async def s3_get_file_type(files_path: str, aws_config: AwsConfig) -> str:
+async def s3_list_keys(
+    files_path: str, file_type_filter: str, aws_config: AwsConfig, clients: Optional[S3ClientManager] = None
+) -> AsyncGenerator[str, None]:
+    """List the keys of every file of the given type under a prefix"""
+
+    async for entry in s3_list_objects(files_path=files_path, aws_config=aws_config, clients=clients):
+        if entry.extension == file_type_filter:
+            yield entry.key
+
+
+async def s3_download_objects(
+    keys: Union[Iterable[str], AsyncIterable[str]],
+    aws_config: AwsConfig,
+    concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+    ordered: bool = False,
+    buffer_size: int = DEFAULT_DOWNLOAD_BUFFER_SIZE,
+    decode: Callable[[bytes], Any] = BytesIO,
+    clients: Optional[S3ClientManager] = None,
+    retries: int = DEFAULT_DOWNLOAD_RETRIES,
+    retry_delay: float = DEFAULT_DOWNLOAD_RETRY_DELAY,
+) -> AsyncGenerator[DownloadedFile, None]:
+    """
+    Download objects with up to `concurrency` GETs in flight.
+
+    No more than concurrency + buffer_size downloads are ever started and not yet consumed,
+    so memory stays flat however many keys are fed in. With ordered=True files are yielded
+    in key order, otherwise as soon as each one completes.
+
+    Throttling, 5xx and connection errors are retried up to `retries` times with exponential
+    backoff. An object that still fails, or cannot be decoded, is yielded with its error set
+    and no content, so one bad key does not end the whole download.
+    """
+
     bucket = os.environ.get("AWS_BUCKET")
-    session = get_session()
-    print(files_path)
-    print(aws_config)
-    async with session.create_client("s3", **dataclasses.asdict(aws_config)) as s3:
-        paginator = s3.get_paginator("list_objects")
-        async for page in paginator.paginate(Bucket=bucket, Prefix=files_path):
+    window = concurrency + buffer_size
+    semaphore = asyncio.Semaphore(concurrency)
+    s3 = await (clients or s3_clients).get(aws_config)
+
+    async def get(key: str) -> bytes:
+        for attempt in range(retries + 1):
             try:
-                return page.get("Contents", [])[0]["Key"].split(".")[-1]
-            except Exception as e:
-                return str(e)
-                
-async def s3_get_file_count(files_path: str, file_type_filter: str, aws_config: AwsConfig) -> str:
-    totalCount = 0
-  
+                async with semaphore:
+                    response = await s3.get_object(Bucket=bucket, Key=key)
+                    # this will ensure the connection is correctly re-used/closed
+                    async with response["Body"] as stream:
+                        return await stream.read()
+            except Exception as ex:
+                if attempt == retries or not _is_transient(ex):
+                    raise
+            await asyncio.sleep(retry_delay * 2 ** attempt)
+
+    async def download(key: str) -> DownloadedFile:
+        name = key.split("/")[-1]
+        try:
+            return DownloadedFile(name=name, content=decode(await get(key)), key=key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            return DownloadedFile(name=name, content=None, key=key, error=ex)
+
+    pending = deque() if ordered else set()
+    try:
+        async for key in _aiter(keys):
+            task = asyncio.ensure_future(download(key))
+            if ordered:
+                pending.append(task)
+            else:
+                pending.add(task)
+            while len(pending) >= window:
+                for downloaded in await _next_downloaded(pending, ordered):
+                    yield downloaded
+
+        while pending:
+            for downloaded in await _next_downloaded(pending, ordered):
+                yield downloaded
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _next_downloaded(pending: Union[deque, set], ordered: bool) -> list:
+    if ordered:
+        return [await pending.popleft()]
+
+    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    pending.difference_update(done)
+    return [task.result() for task in done]
+
+
+def _is_transient(ex: Exception) -> bool:
+    if not isinstance(ex, ClientError):
+        return isinstance(ex, (HTTPClientError, AiohttpClientError, asyncio.TimeoutError, OSError))
+
+    status = ex.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+    return status >= 500 or status == 429 or ex.response.get("Error", {}).get("Code") in _TRANSIENT_ERROR_CODES
+
+
+async def _aiter(items: Union[Iterable, AsyncIterable]) -> AsyncGenerator:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+def decode_json(content: bytes) -> Any:
+    return json.loads(content.decode("utf-8"))
+
+
+async def s3_download_file(file_path: str, aws_config: AwsConfig, clients: Optional[S3ClientManager] = None) -> str: 
     bucket = os.environ.get("AWS_BUCKET")
-    session = get_session()
-    async with session.create_client("s3", **dataclasses.asdict(aws_config)) as s3:
-        totalCount = 0 
-        paginator = s3.get_paginator("list_objects")
-        async for page in paginator.paginate(Bucket=bucket, Prefix=files_path): 
-            for c in page.get("Contents", []):
-                if c["Key"].split(".")[-1] == file_type_filter:
-                    totalCount += 1
-        
-    return totalCount
-
-async def s3_download_files(files_path: str, file_type_filter: str, aws_config: AwsConfig) -> str: 
+
+    s3 = await (clients or s3_clients).get(aws_config)
+    s3_object = await s3.get_object(Bucket=bucket, Key=file_path)
+    async with s3_object["Body"] as stream:
+        image_dl = await stream.read()
+
+    return DownloadedFile(
+            name=file_path.split("/")[-1],
+            content=BytesIO(image_dl),
+            key=file_path,
+        )
+
+
+@dataclass
+class ObjectRange:
+    content: bytes
+    # True when the object's ETag is the MD5 of its bytes, which S3 only keeps for
+    # unencrypted and SSE-S3 single part uploads
+    etag_is_md5: bool
+
+
+async def s3_download_object_range(
+    file_path: str,
+    offset: int,
+    length: int,
+    aws_config: AwsConfig,
+    clients: Optional[S3ClientManager] = None,
+) -> ObjectRange:
+    """Download length bytes of an object starting at offset, with what its ETag can be trusted for"""
+
     bucket = os.environ.get("AWS_BUCKET")
-    # keys = [key async for key in self._s3_reader(files_path=files_path, file_type_filter=file_type_filter)]
-
-    session = get_session()
-    async with session.create_client("s3", **dataclasses.asdict(aws_config)) as s3:
-        
-        paginator = s3.get_paginator("list_objects")
-        async for page in paginator.paginate(Bucket=bucket, Prefix=files_path): 
-            for c in page.get('Contents', []):
-                response = await s3.get_object(Bucket=bucket, Key=c["Key"])
-                # this will ensure the connection is correctly re-used/closed
-                async with response["Body"] as stream: 
-                    content = (await stream.read()).decode("utf-8")
-                    content = json.loads(content)  
-                    yield DownloadedFile(
-                        name=c["Key"].split("/")[-1],
-                        content=content
-                    )
-
-
-async def s3_download_file(file_path: str, aws_config: AwsConfig) -> str: 
+
+    s3 = await (clients or s3_clients).get(aws_config)
+    s3_object = await s3.get_object(Bucket=bucket, Key=file_path, Range=f"bytes={offset}-{offset + length - 1}")
+    async with s3_object["Body"] as stream:
+        content = await stream.read()
+
+    etag = s3_object.get("ETag", "").strip('"')
+    return ObjectRange(
+        content=content,
+        etag_is_md5=(
+            "-" not in etag
+            and s3_object.get("ServerSideEncryption") in (None, "AES256")
+            and s3_object.get("SSECustomerAlgorithm") is None
+        ),
+    )
+
+
+async def s3_download_range(
+    file_path: str,
+    offset: int,
+    length: int,
+    aws_config: AwsConfig,
+    clients: Optional[S3ClientManager] = None,
+) -> bytes:
+    """Download length bytes of an object starting at offset, fewer if the object ends first"""
+
+    object_range = await s3_download_object_range(file_path, offset, length, aws_config=aws_config, clients=clients)
+    return object_range.content
+
+
+async def s3_upload_file(
+    file_path: str,
+    content: bytes,
+    aws_config: AwsConfig,
+    content_type: Optional[str] = None,
+    clients: Optional[S3ClientManager] = None,
+) -> str:
+    """Upload content to a key in the bucket and return the key"""
+
+    bucket = os.environ.get("AWS_BUCKET")
+
+    s3 = await (clients or s3_clients).get(aws_config)
+    extra_args = {"ContentType": content_type} if content_type else {}
+    await s3.put_object(Bucket=bucket, Key=file_path, Body=content, **extra_args)
+
+    return file_path
+
+
+async def s3_delete_files(
+    file_paths: List[str], aws_config: AwsConfig, clients: Optional[S3ClientManager] = None
+) -> int:
+    """Delete keys from the bucket, up to 1000 per request, and return how many were deleted"""
+
     bucket = os.environ.get("AWS_BUCKET")
-    # keys = [key async for key in self._s3_reader(files_path=files_path, file_type_filter=file_type_filter)]
 
-    session = get_session()
-    async with session.create_client("s3", **dataclasses.asdict(aws_config)) as s3:  
-        s3_object = await s3.get_object(Bucket=bucket, Key=file_path)
-        image_dl = await s3_object['Body'].read()
+    s3 = await (clients or s3_clients).get(aws_config)
+    deleted = 0
+    for start in range(0, len(file_paths), 1000):
+        chunk = file_paths[start:start + 1000]
+        response = await s3.delete_objects(
+            Bucket=bucket, Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+        )
+        deleted += len(chunk) - len(response.get("Errors", []))
 
-        return DownloadedFile(
-                name=file_path.split("/")[-1],
-                content=BytesIO(image_dl)
-            )
\ No newline at end of file
+    return deleted
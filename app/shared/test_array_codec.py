@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from shared.array_codec import Quantization, decode_array, encode_array, encode_arrays
+
+TOLERANCES = {Quantization.NONE: 0, Quantization.FLOAT16: 1e-3, Quantization.UINT8: 1 / 255}
+
+
+def heatmap() -> np.ndarray:
+    return np.random.default_rng(0).uniform(0, 1, size=(12, 17))
+
+
+def layers() -> list:
+    rng = np.random.default_rng(1)
+    return [rng.uniform(-2, 3, size=(10, 20)), rng.uniform(0, 1, size=64), rng.uniform(0, 1, size=(2, 3, 4))]
+
+
+@pytest.mark.parametrize("quantization", list(Quantization))
+@pytest.mark.parametrize("compress", [False, True])
+def test_single_array_round_trip(quantization, compress):
+    array = heatmap()
+    encoded = encode_array(array, quantization, compress)
+
+    decoded = decode_array(encoded.content)
+
+    assert encoded.shape == [12, 17]
+    assert decoded.shape == array.shape
+    np.testing.assert_allclose(decoded, array, atol=TOLERANCES[quantization] * (array.max() - array.min()))
+
+
+@pytest.mark.parametrize("quantization", list(Quantization))
+@pytest.mark.parametrize("compress", [False, True])
+def test_layers_round_trip_in_order(quantization, compress):
+    arrays = layers()
+    encoded = encode_arrays(arrays, quantization, compress)
+
+    decoded = decode_array(encoded.content)
+
+    assert encoded.extension == "npz"
+    assert encoded.shape == [list(array.shape) for array in arrays]
+    assert len(decoded) == len(arrays)
+    for result, array in zip(decoded, arrays):
+        np.testing.assert_allclose(result, array, atol=TOLERANCES[quantization] * (array.max() - array.min()))
+
+
+def test_plain_array_is_a_npy_file():
+    encoded = encode_array(heatmap())
+
+    assert encoded.extension == "npy"
+    assert encoded.dtype == "float64"
+    assert encoded.content.startswith(b"\x93NUMPY")
+
+
+@pytest.mark.parametrize(
+    "quantization, compress, extension, dtype",
+    [
+        (Quantization.FLOAT16, False, "npy", "float16"),
+        (Quantization.UINT8, False, "npz", "uint8"),
+        (Quantization.NONE, True, "npz", "float64"),
+    ],
+)
+def test_stored_format(quantization, compress, extension, dtype):
+    encoded = encode_array(heatmap(), quantization, compress)
+
+    assert (encoded.extension, encoded.dtype) == (extension, dtype)
+
+
+def test_constant_array_survives_uint8():
+    array = np.full((4, 4), 0.25)
+
+    np.testing.assert_allclose(decode_array(encode_array(array, Quantization.UINT8).content), array)
+
+
+def test_empty_array():
+    decoded = decode_array(encode_array(np.zeros((0, 5)), Quantization.UINT8).content)
+
+    assert decoded.shape == (0, 5)
@@ -0,0 +1,112 @@
+from typing import List, Tuple
+import numpy as np
+import pytest
+
+from shared.array_codec import Quantization
+from shared.heatmap_tiles import (
+    crop_heatmap,
+    decode_heatmap_pyramid,
+    encode_heatmap_pyramid,
+    read_heatmap_region,
+    read_pyramid_header,
+)
+
+
+class RangeReader:
+    """Serves ranged reads of one object and records them"""
+
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.reads: List[Tuple[int, int]] = []
+
+    async def __call__(self, offset: int, length: int) -> bytes:
+        self.reads.append((offset, length))
+        return self.content[offset:offset + length]
+
+
+def heatmap(height: int, width: int) -> np.ndarray:
+    return np.arange(height * width, dtype=np.float64).reshape(height, width) / (height * width)
+
+
+def test_round_trip_of_every_level():
+    array = heatmap(37, 50)
+    content = encode_heatmap_pyramid(array, tile_size=8).content
+
+    np.testing.assert_array_equal(decode_heatmap_pyramid(content), array)
+    level_1 = decode_heatmap_pyramid(content, level=1)
+    assert level_1.shape == (19, 25)
+    np.testing.assert_allclose(level_1[0, 0], array[:2, :2].mean())
+    # The last level fits in one tile
+    assert max(decode_heatmap_pyramid(content, level=3).shape) <= 8
+
+
+@pytest.mark.parametrize(
+    "region",
+    [
+        [0, 0, 8, 8],
+        [7, 7, 9, 9],
+        [8, 16, 24, 32],
+        [45, 30, 50, 37],
+        [-5, -5, 3, 3],
+        [40, 30, 100, 100],
+    ],
+)
+def test_windows_across_tile_edges(region):
+    array = heatmap(37, 50)
+    content = encode_heatmap_pyramid(array, tile_size=8).content
+
+    x_min, y_min, x_max, y_max = region
+    expected = array[max(y_min, 0):y_max, max(x_min, 0):x_max]
+    np.testing.assert_array_equal(decode_heatmap_pyramid(content, region=region), expected)
+
+
+def test_empty_window():
+    content = encode_heatmap_pyramid(heatmap(16, 16), tile_size=8).content
+
+    assert decode_heatmap_pyramid(content, region=[10, 10, 10, 12]).shape == (2, 0)
+
+
+@pytest.mark.parametrize("quantization", list(Quantization))
+@pytest.mark.parametrize("compress", [False, True])
+def test_quantized_and_compressed_round_trip(quantization, compress):
+    array = heatmap(20, 30)
+    content = encode_heatmap_pyramid(array, quantization, compress, tile_size=8).content
+
+    tolerance = {Quantization.NONE: 0, Quantization.FLOAT16: 1e-3, Quantization.UINT8: 1 / 255}[quantization]
+    np.testing.assert_allclose(decode_heatmap_pyramid(content, region=[3, 5, 27, 19]), array[5:19, 3:27], atol=tolerance)
+
+
+async def test_region_read_fetches_only_overlapping_tile_rows():
+    array = heatmap(64, 64)
+    reader = RangeReader(encode_heatmap_pyramid(array, tile_size=16).content)
+
+    header = await read_pyramid_header(reader)
+    reader.reads.clear()
+    region = await read_heatmap_region(reader, region=[20, 20, 40, 40], header=header)
+
+    np.testing.assert_array_equal(region, array[20:40, 20:40])
+    # Rows 1 and 2 of the 4x4 grid, two tiles wide each
+    assert len(reader.reads) == 2
+    assert all(length == 2 * 16 * 16 * 8 for _, length in reader.reads)
+
+
+async def test_not_a_pyramid():
+    with pytest.raises(ValueError):
+        await read_pyramid_header(RangeReader(b"\x93NUMPY"))
+    with pytest.raises(ValueError):
+        decode_heatmap_pyramid(b"\x93NUMPY\x01\x00v\x00{'descr': '<f8'}")
+
+
+def test_level_out_of_range():
+    content = encode_heatmap_pyramid(heatmap(8, 8), tile_size=8).content
+
+    with pytest.raises(ValueError):
+        decode_heatmap_pyramid(content, level=1)
+
+
+def test_crop_plain_heatmap():
+    array = heatmap(10, 12)
+
+    np.testing.assert_array_equal(crop_heatmap(array, region=[2, 3, 20, 7]), array[3:7, 2:])
+    with pytest.raises(ValueError):
+        crop_heatmap(array, level=1)
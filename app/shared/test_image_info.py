@@ -0,0 +1,180 @@
+import hashlib
+import io
+import random
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from shared.image_info import dhash, hamming_distance, near_duplicate_groups, probe_image
+from shared.s3_utils import AwsConfig, ManifestEntry
+
+AWS_CONFIG = AwsConfig(endpoint_url=None, region_name=None, aws_access_key_id=None, aws_secret_access_key=None)
+
+
+def flip(value: int, *bits: int) -> int:
+    unsigned = value & 0xFFFFFFFFFFFFFFFF
+    for bit in bits:
+        unsigned ^= 1 << bit
+    return unsigned - (1 << 64) if unsigned >= 1 << 63 else unsigned
+
+
+def brute_force_groups(hashes: dict, max_distance: int) -> set:
+    parents = {key: key for key in hashes}
+
+    def root(key):
+        while parents[key] != key:
+            key = parents[key]
+        return key
+
+    keys = list(hashes)
+    for i, a in enumerate(keys):
+        for b in keys[i + 1:]:
+            if hamming_distance(hashes[a], hashes[b]) <= max_distance:
+                parents[root(b)] = root(a)
+
+    groups = {}
+    for key in keys:
+        groups.setdefault(root(key), set()).add(key)
+    return {frozenset(group) for group in groups.values() if len(group) > 1}
+
+
+class FakeBody:
+    def __init__(self, content: bytes) -> None:
+        self._content = content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self) -> bytes:
+        return self._content
+
+
+class FakeS3:
+    """Serves one object with the given ETag and encryption headers, recording the ranges read"""
+
+    def __init__(self, content: bytes, etag: str, **headers) -> None:
+        self.content = content
+        self.etag = etag
+        self.headers = headers
+        self.ranges = []
+
+    async def get(self, aws_config):
+        return self
+
+    async def get_object(self, Bucket, Key, Range=None):
+        self.ranges.append(Range)
+        content = self.content
+        if Range is not None:
+            start, end = map(int, Range[len("bytes="):].split("-"))
+            content = content[start:end + 1]
+        return {"Body": FakeBody(content), "ETag": f'"{self.etag}"', **self.headers}
+
+
+def png(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    PILImage.fromarray(array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 4, 10])
+def test_groups_match_pairwise_comparison(max_distance):
+    rng = random.Random(max_distance)
+    hashes = {}
+    for i in range(40):
+        base = rng.getrandbits(64) - (1 << 63)
+        hashes[f"{i}"] = base
+        # Near copies with flips spread over every band, including the sign bit
+        for j in range(3):
+            hashes[f"{i}.{j}"] = flip(base, *rng.sample(range(64), rng.randint(0, max_distance + 2)))
+
+    groups = near_duplicate_groups(hashes, max_distance)
+
+    assert {frozenset(keys) for keys, _ in groups} == brute_force_groups(hashes, max_distance)
+
+
+def test_group_distance_is_the_largest_joining_distance():
+    hashes = {"a": 0, "b": flip(0, 0, 63), "c": flip(0, 0, 63, 31), "far": flip(0, *range(20))}
+
+    groups = near_duplicate_groups(hashes, max_distance=2)
+
+    assert groups == [(["a", "b", "c"], 2)]
+
+
+def test_groups_are_transitive():
+    # a and c are 4 bits apart, but each is 2 bits from b
+    hashes = {"a": 0, "b": flip(0, 1, 2), "c": flip(0, 1, 2, 40, 41)}
+
+    groups = near_duplicate_groups(hashes, max_distance=2)
+
+    assert [sorted(keys) for keys, _ in groups] == [["a", "b", "c"]]
+
+
+def test_no_groups_without_near_duplicates():
+    assert near_duplicate_groups({"a": 0, "b": -1}, max_distance=3) == []
+    assert near_duplicate_groups({}, max_distance=3) == []
+
+
+def test_dhash_survives_resizing_and_fits_a_bigint():
+    gradient = np.tile(np.linspace(0, 255, 64, dtype=np.uint8)[::-1], (48, 1))
+    noise = np.random.default_rng(0).integers(0, 255, size=(48, 64), dtype=np.uint8)
+    image = np.clip(gradient.astype(int) + noise // 8, 0, 255).astype(np.uint8)
+    resized = np.asarray(PILImage.fromarray(image).resize((128, 96)))
+
+    original = dhash(png(image))
+
+    assert -(1 << 63) <= original < 1 << 63
+    assert hamming_distance(original, dhash(png(resized))) <= 4
+    assert hamming_distance(original, dhash(png(noise))) > 10
+
+
+def test_dhash_of_a_non_image():
+    assert dhash(b"not an image") is None
+
+
+def large_png() -> bytes:
+    # Noise does not compress, so the file is larger than the header read
+    return png(np.random.default_rng(0).integers(0, 255, size=(200, 300, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("headers", [{}, {"ServerSideEncryption": "AES256"}])
+async def test_plain_md5_etag_is_the_content_hash(headers):
+    content = large_png()
+    etag = hashlib.md5(content).hexdigest()
+    s3 = FakeS3(content, etag, **headers)
+
+    info = await probe_image(ManifestEntry("a.png", len(content), etag, "png"), AWS_CONFIG, clients=s3)
+
+    assert info.content_hash == etag
+    assert (info.width, info.height, info.channels) == (300, 200, 3)
+    # Only the header was read
+    assert s3.ranges == ["bytes=0-65535"]
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{"ServerSideEncryption": "aws:kms"}, {"SSECustomerAlgorithm": "AES256"}],
+)
+async def test_encrypted_etag_is_not_taken_for_an_md5(headers):
+    content = large_png()
+    # Single part, so no "-", but not the MD5 of the bytes either
+    etag = "0123456789abcdef0123456789abcdef"
+    s3 = FakeS3(content, etag, **headers)
+
+    info = await probe_image(ManifestEntry("a.png", len(content), etag, "png"), AWS_CONFIG, clients=s3)
+
+    assert info.content_hash == hashlib.md5(content).hexdigest()
+    assert (info.width, info.height) == (300, 200)
+
+
+async def test_multipart_etag_hashes_the_bytes():
+    content = large_png()
+    etag = "0123456789abcdef0123456789abcdef-2"
+    s3 = FakeS3(content, etag)
+
+    info = await probe_image(ManifestEntry("a.png", len(content), etag, "png"), AWS_CONFIG, clients=s3)
+
+    assert info.content_hash == hashlib.md5(content).hexdigest()
+    assert s3.ranges == [None]
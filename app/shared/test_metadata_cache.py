@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+
+from shared import metadata_cache
+from shared.metadata_cache import MetadataCache, MetadataCaches
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Loader:
+    """Returns the next value on every call and counts the calls"""
+
+    def __init__(self, *values) -> None:
+        self.values = list(values)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.values.pop(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metadata_cache.time, "monotonic", clock)
+    return clock
+
+
+def cache(ttl: float = 10, max_size: int = 3, enabled: bool = True) -> MetadataCache:
+    return MetadataCache("test", ["model"], ttl=ttl, max_size=max_size, enabled=lambda: enabled)
+
+
+async def test_entries_expire_after_ttl(clock):
+    models = cache(ttl=10)
+    load = Loader(1, 2)
+
+    assert await models.get_or_load("a", load) == 1
+    clock.now += 9
+    assert await models.get_or_load("a", load) == 1
+    clock.now += 1
+    assert await models.get_or_load("a", load) == 2
+
+    stats = models.stats()
+    assert (stats.hits, stats.misses, stats.expirations, load.calls) == (1, 2, 1, 2)
+
+
+async def test_least_recently_used_entry_is_evicted(clock):
+    models = cache(max_size=2)
+
+    await models.get_or_load("a", Loader(1))
+    await models.get_or_load("b", Loader(2))
+    # Reading a makes b the least recently used entry
+    await models.get_or_load("a", Loader())
+    await models.get_or_load("c", Loader(3))
+
+    load = Loader(4, 5)
+    assert await models.get_or_load("a", load) == 1
+    assert await models.get_or_load("b", load) == 4
+    assert models.stats().evictions == 2
+
+
+async def test_load_racing_an_invalidation_is_not_stored(clock):
+    models = cache()
+    loading = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load():
+        loading.set()
+        await release.wait()
+        return "read before the write"
+
+    task = asyncio.create_task(models.get_or_load("a", slow_load))
+    await loading.wait()
+    models.invalidate()
+    release.set()
+
+    assert await task == "read before the write"
+    assert await models.get_or_load("a", Loader("read after the write")) == "read after the write"
+
+
+async def test_missing_rows_are_not_cached(clock):
+    models = cache()
+    load = Loader(None, 7)
+
+    assert await models.get_or_load("a", load) is None
+    assert await models.get_or_load("a", load) == 7
+    assert models.stats().size == 1
+
+
+async def test_disabled_cache_is_bypassed(clock):
+    models = cache(enabled=False)
+    load = Loader(1, 2)
+
+    assert await models.get_or_load("a", load) == 1
+    assert await models.get_or_load("a", load) == 2
+    assert models.stats().bypassed == 2
+
+
+async def test_invalidate_clears_caches_reading_the_table(clock):
+    caches = MetadataCaches()
+    caches._listening = True
+    models = caches.cache("models", tables=["model", "dataset"])
+    types = caches.cache("types", tables=["dataset_type"])
+    await models.get_or_load("a", Loader(1))
+    await types.get_or_load("a", Loader(1))
+
+    caches.invalidate("dataset")
+    assert (models.stats().size, types.stats().size) == (0, 1)
+
+    caches.invalidate()
+    assert types.stats().size == 0
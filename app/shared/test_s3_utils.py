@@ -0,0 +1,88 @@
+import asyncio
+from typing import Dict, List
+import pytest
+from botocore.exceptions import ClientError
+
+from shared.s3_utils import AwsConfig, decode_json, s3_download_objects
+
+AWS_CONFIG = AwsConfig(endpoint_url=None, region_name=None, aws_access_key_id=None, aws_secret_access_key=None)
+
+
+class FakeBody:
+    def __init__(self, content: bytes) -> None:
+        self._content = content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self) -> bytes:
+        return self._content
+
+
+class FakeS3:
+    """Serves objects from a dict, raising the queued errors of a key before its content"""
+
+    def __init__(self, objects: Dict[str, bytes], errors: Dict[str, List[Exception]]) -> None:
+        self.objects = objects
+        self.errors = errors
+        self.calls: Dict[str, int] = {}
+
+    async def get(self, aws_config):
+        return self
+
+    async def get_object(self, Bucket, Key):
+        self.calls[Key] = self.calls.get(Key, 0) + 1
+        if self.errors.get(Key):
+            raise self.errors[Key].pop(0)
+        return {"Body": FakeBody(self.objects[Key])}
+
+
+def client_error(code: str, status: int) -> ClientError:
+    return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "GetObject")
+
+
+async def download(s3: FakeS3, keys: List[str], **kwargs) -> Dict[str, object]:
+    downloaded = {}
+    async for file in s3_download_objects(keys, AWS_CONFIG, clients=s3, retry_delay=0, **kwargs):
+        downloaded[file.key] = file
+    return downloaded
+
+
+async def test_transient_errors_are_retried():
+    s3 = FakeS3({"a": b"1"}, {"a": [client_error("SlowDown", 503), asyncio.TimeoutError()]})
+
+    downloaded = await download(s3, ["a"], decode=decode_json)
+
+    assert downloaded["a"].error is None
+    assert downloaded["a"].content == 1
+    assert s3.calls["a"] == 3
+
+
+async def test_failures_are_reported_per_key_without_ending_the_download():
+    s3 = FakeS3(
+        {"ok": b"1", "bad_json": b"{", "flaky": b"2"},
+        {"missing": [client_error("NoSuchKey", 404)], "flaky": [client_error("InternalError", 500)] * 5},
+    )
+
+    downloaded = await download(s3, ["ok", "missing", "bad_json", "flaky"], decode=decode_json, retries=2)
+
+    assert downloaded["ok"].content == 1
+    assert isinstance(downloaded["missing"].error, ClientError)
+    assert s3.calls["missing"] == 1
+    assert isinstance(downloaded["bad_json"].error, ValueError)
+    assert isinstance(downloaded["flaky"].error, ClientError)
+    assert s3.calls["flaky"] == 3
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+async def test_every_key_is_yielded_once_within_a_small_window(ordered):
+    keys = [str(i) for i in range(50)]
+    s3 = FakeS3({key: key.encode() for key in keys}, {})
+
+    downloaded = await download(s3, keys, concurrency=3, buffer_size=2, ordered=ordered)
+
+    assert sorted(downloaded) == sorted(keys)
+    assert all(file.content.getvalue() == key.encode() for key, file in downloaded.items())
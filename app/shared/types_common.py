@@ -1,10 +1,11 @@
+from pydantic import conint, conlist
 from pydantic.dataclasses import dataclass
 from enum import Enum, unique
-from typing import Generic, Optional, Type, TypeVar, Union
+from typing import Any, Generic, List, Optional, Type, TypeVar, Union
 from pydantic.generics import GenericModel
 from fastapi import Request
 
-from shared.view_models import Annotations
+from shared.view_models import Annotations, Image
 
 RequestT = TypeVar("RequestT")
 ResponseT = TypeVar("ResponseT")
@@ -44,6 +45,8 @@ class TenyksExtractionRequest:
     type: ExtractionTypes
     image_search_filter: Optional[ImageSearchFilter] = ImageSearchFilter.ALL 
     image_name: Optional[str] = None
+    # Ignore cached results and extract every image again
+    force_recompute: bool = False
     
 @dataclass
 class TenyksDatasetsRequest:
@@ -58,6 +61,45 @@ class TenyksImagesRequest:
     dataset_name: str
     image_name: Optional[str] = None
 
+@dataclass 
+class TenyksImagesPageRequest:
+    dataset_name: str
+    after_id: int = 0
+    limit: int = 1000
+
+@dataclass 
+class TenyksImagesBulkRequest:
+    dataset_name: str
+    images: List[Image]
+
+@dataclass 
+class TenyksBboxQueryRequest:
+    dataset_name: str
+    model_name: Optional[str] = None
+    region: Optional[conlist(int, min_items=4, max_items=4)] = None
+    categories: Optional[List[int]] = None
+    min_area: Optional[int] = None
+    max_area: Optional[int] = None
+    min_aspect: Optional[float] = None
+    max_aspect: Optional[float] = None
+    after_id: int = 0
+    limit: int = 1000
+
+@dataclass 
+class TenyksHeatmapRegionRequest:
+    dataset_name: str
+    image_name: str
+    model_name: str
+    level: int = 0
+    # [x_min, y_min, x_max, y_max] in the pixel coordinates of the requested level
+    region: Optional[conlist(int, min_items=4, max_items=4)] = None
+
+@dataclass 
+class TenyksDuplicatesRequest:
+    dataset_name: str
+    # Largest difference hash distance, in bits, for two images to count as near duplicates
+    max_distance: conint(ge=0, le=16) = 4
+
 @dataclass 
 class TenyksModelImagesRequest:
     image_id: int
@@ -65,6 +107,9 @@ class TenyksModelImagesRequest:
     dataset_name: str
     extraction_type: ExtractionTypes
     result_path: Optional[str] = None
+    # Stored dtype and shape of a heatmap result, or the shape of every layer for activations
+    result_dtype: Optional[str] = None
+    result_shape: Optional[List[Any]] = None
     model_annotations: Optional[Annotations] = None
 
 
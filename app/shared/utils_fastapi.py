@@ -8,13 +8,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 
+from .request_handlers import http_clients
+from .s3_utils import s3_clients
+
 logger = logging.getLogger(__name__)
 
+# Prepared statements asyncpg keeps per connection, least recently used evicted first
+PSQL_STATEMENT_CACHE_SIZE = int(os.environ.get("PSQL_STATEMENT_CACHE_SIZE", 256))
+
 
 def create_start_app_handler(
     app: FastAPI,
 ) -> Callable:  # type: ignore
     async def start_app() -> None:
+        app.state.http_clients = http_clients
         try:
             await connect_to_db(app,)
         except:
@@ -25,7 +32,14 @@ def create_start_app_handler(
 
 def create_stop_app_handler(app: FastAPI) -> Callable:  # type: ignore
     async def stop_app() -> None:
-        await close_db_connection(app)
+        # Close the shared clients even if the pool fails to close or was never opened
+        try:
+            await close_db_connection(app)
+        finally:
+            try:
+                await http_clients.aclose()
+            finally:
+                await s3_clients.close()
 
     return stop_app
 
@@ -37,7 +51,8 @@ async def connect_to_db(app: FastAPI, ) -> None:
         host="postgres",
         # port=5432,
         database=os.getenv("PSQL_DATABASE"),
-        server_settings={"search_path": os.getenv("PSQL_SCHEMA")}
+        server_settings={"search_path": os.getenv("PSQL_SCHEMA")},
+        statement_cache_size=PSQL_STATEMENT_CACHE_SIZE,
     )
     
     # logger.info("Connection established")
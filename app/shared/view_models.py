@@ -1,4 +1,6 @@
+from datetime import datetime
 from typing import Any, List, Optional
+from dataclasses import field
 from enum import Enum, unique
 from pydantic.dataclasses import dataclass
 import numpy as np
@@ -66,7 +68,133 @@ class Image:
     dataset_name: str
     annotations: Annotations
     id: Optional[int] = None
+    image_etag: Optional[str] = None
+    annotation_etag: Optional[str] = None
+    # File facts captured at ingest from the image header, so nothing needs a decode to learn them
+    width: Optional[int] = None
+    height: Optional[int] = None
+    channels: Optional[int] = None
+    format: Optional[str] = None
+    byte_size: Optional[int] = None
+    content_hash: Optional[str] = None
+    # 64 bit difference hash of the pixels, only computed when near duplicates are looked for
+    dhash: Optional[int] = None
     model_annotations: Optional[Annotations] = None
     model_activations: Optional[Activations] = None
     model_heatmap: Optional[Heatmap] = None
 
+
+
+@dataclass
+class IngestSummary:
+    """Outcome of ingesting a batch of images"""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # Inserted images whose content was already held by another image, in any dataset
+    duplicates: int = 0
+
+
+@dataclass
+class DuplicateImage:
+    """One dataset image in a group of duplicates"""
+
+    id: int
+    name: str
+    dataset_name: str
+
+
+@dataclass
+class DuplicateGroup:
+    """
+    Images with identical bytes (distance 0), or whose difference hashes are at most distance
+    bits apart for near duplicates
+    """
+
+    images: List[DuplicateImage]
+    distance: int = 0
+    content_hash: Optional[str] = None
+
+
+@dataclass
+class DuplicatesReport:
+    """Exact and near duplicates of the images of a dataset"""
+
+    dataset_name: str
+    images: int = 0
+    unique_contents: int = 0
+    exact: List[DuplicateGroup] = field(default_factory=list)
+    near: List[DuplicateGroup] = field(default_factory=list)
+
+
+@dataclass
+class ImagesPage:
+    """A page of images in a dataset and the cursor to fetch the next one"""
+
+    images: List[Image]
+    next_after_id: Optional[int] = None
+
+
+@dataclass
+class StageStats:
+    """Items through one pipeline stage and how long it took"""
+
+    name: str
+    concurrency: int
+    items_in: int = 0
+    items_out: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    items_per_second: float = 0.0
+
+
+@dataclass
+class ExtractionSummary:
+    """Outcome of an extraction run over a dataset"""
+
+    images: int = 0
+    failed: int = 0
+    # Images whose result was reused from the result cache instead of being computed
+    cached: int = 0
+    stages: List[StageStats] = field(default_factory=list)
+
+
+@dataclass
+class ResultCacheGcSummary:
+    """Outcome of a garbage collection of the extraction result cache"""
+
+    entries: int = 0
+    objects: int = 0
+
+
+@unique
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class ExtractionJob:
+    """State and progress of a background extraction"""
+
+    id: int
+    status: JobStatus
+    dataset_name: str
+    model_name: str
+    extraction_type: str
+    image_name: Optional[str] = None
+    total: Optional[int] = None
+    done: int = 0
+    failed: int = 0
+    items_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    error: Optional[str] = None
+    summary: Optional[ExtractionSummary] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,9 @@
+--
+-- Record the S3 ETags an image and its annotations were ingested from so that
+-- re-running an ingest can skip unchanged objects and update changed ones.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+ALTER TABLE image ADD COLUMN IF NOT EXISTS image_etag VARCHAR(64);
+ALTER TABLE image ADD COLUMN IF NOT EXISTS annotation_etag VARCHAR(64);
@@ -0,0 +1,19 @@
+--
+-- Secondary indexes for the joins and lookups made by the backend repositories,
+-- and image name uniqueness scoped to a dataset instead of the whole table.
+--
+-- dataset(dataset_name) lookups are already served by the UNIQUE (dataset_name, dataset_path)
+-- index and model(name) by UNIQUE(name), so neither gets a second index here.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+ALTER TABLE image DROP CONSTRAINT IF EXISTS image_name_key;
+ALTER TABLE image DROP CONSTRAINT IF EXISTS image_dataset_id_name_key;
+ALTER TABLE image ADD CONSTRAINT image_dataset_id_name_key UNIQUE (dataset_id, name);
+
+CREATE INDEX IF NOT EXISTS image_bbox_image_id_idx ON image_bbox (image_id);
+CREATE INDEX IF NOT EXISTS image_bbox_category_id_idx ON image_bbox (category_id);
+CREATE INDEX IF NOT EXISTS model_image_bbox_image_id_model_id_idx ON model_image_bbox (image_id, model_id);
+CREATE INDEX IF NOT EXISTS model_image_bbox_category_id_idx ON model_image_bbox (category_id);
+CREATE INDEX IF NOT EXISTS model_dataset_dataset_id_idx ON model_dataset (dataset_id);
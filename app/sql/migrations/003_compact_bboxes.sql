@@ -0,0 +1,62 @@
+--
+-- Store bounding boxes as fixed int4 coordinate columns with their category inline,
+-- replacing the JSON bbox_json column and the one-row-per-box category tables.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+ALTER TABLE image_bbox
+    ADD COLUMN category INT,
+    ADD COLUMN x_min INT,
+    ADD COLUMN y_min INT,
+    ADD COLUMN x_max INT,
+    ADD COLUMN y_max INT;
+
+UPDATE image_bbox ib
+SET
+    category=ic.category,
+    x_min=(ib.bbox_json->>0)::numeric::int,
+    y_min=(ib.bbox_json->>1)::numeric::int,
+    x_max=(ib.bbox_json->>2)::numeric::int,
+    y_max=(ib.bbox_json->>3)::numeric::int
+FROM image_category ic
+WHERE ib.category_id=ic.id;
+
+ALTER TABLE image_bbox
+    ALTER COLUMN category SET NOT NULL,
+    ALTER COLUMN x_min SET NOT NULL,
+    ALTER COLUMN y_min SET NOT NULL,
+    ALTER COLUMN x_max SET NOT NULL,
+    ALTER COLUMN y_max SET NOT NULL,
+    DROP COLUMN bbox_json,
+    DROP COLUMN category_id;
+
+DROP TABLE image_category;
+
+ALTER TABLE model_image_bbox
+    ADD COLUMN category INT,
+    ADD COLUMN x_min INT,
+    ADD COLUMN y_min INT,
+    ADD COLUMN x_max INT,
+    ADD COLUMN y_max INT;
+
+UPDATE model_image_bbox mib
+SET
+    category=mic.category,
+    x_min=(mib.bbox_json->>0)::numeric::int,
+    y_min=(mib.bbox_json->>1)::numeric::int,
+    x_max=(mib.bbox_json->>2)::numeric::int,
+    y_max=(mib.bbox_json->>3)::numeric::int
+FROM model_image_category mic
+WHERE mib.category_id=mic.id;
+
+ALTER TABLE model_image_bbox
+    ALTER COLUMN category SET NOT NULL,
+    ALTER COLUMN x_min SET NOT NULL,
+    ALTER COLUMN y_min SET NOT NULL,
+    ALTER COLUMN x_max SET NOT NULL,
+    ALTER COLUMN y_max SET NOT NULL,
+    DROP COLUMN bbox_json,
+    DROP COLUMN category_id;
+
+DROP TABLE model_image_category;
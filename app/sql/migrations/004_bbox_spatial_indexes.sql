@@ -0,0 +1,13 @@
+--
+-- Spatial and shape indexes over bounding boxes, backing the bbox query endpoint.
+-- The indexed expressions must match the ones built by ImagesRepository.query_images_by_bbox.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+CREATE INDEX IF NOT EXISTS image_bbox_box_idx ON image_bbox USING GIST (box(point(x_min, y_min), point(x_max, y_max)));
+CREATE INDEX IF NOT EXISTS image_bbox_area_idx ON image_bbox (((x_max - x_min) * (y_max - y_min)));
+CREATE INDEX IF NOT EXISTS image_bbox_aspect_idx ON image_bbox (((x_max - x_min)::float8 / NULLIF(y_max - y_min, 0)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_box_idx ON model_image_bbox USING GIST (box(point(x_min, y_min), point(x_max, y_max)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_model_id_area_idx ON model_image_bbox (model_id, ((x_max - x_min) * (y_max - y_min)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_model_id_aspect_idx ON model_image_bbox (model_id, ((x_max - x_min)::float8 / NULLIF(y_max - y_min, 0)));
@@ -0,0 +1,27 @@
+--
+-- Background extraction jobs and their progress.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+CREATE TABLE IF NOT EXISTS extraction_job(
+    id INT GENERATED BY DEFAULT AS IDENTITY,
+    dataset_id INT NOT NULL,
+    model_id INT NOT NULL,
+    extraction_type VARCHAR(32) NOT NULL,
+    image_name VARCHAR(128),
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    total INT,
+    done INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    summary JSON,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_tenyks_extraction_job_dataset FOREIGN KEY (dataset_id) REFERENCES dataset(id),
+    CONSTRAINT fk_tenyks_extraction_job_model FOREIGN KEY (model_id) REFERENCES model(id)
+);
+
+CREATE INDEX IF NOT EXISTS extraction_job_status_idx ON extraction_job (status);
@@ -0,0 +1,14 @@
+--
+-- Heatmap and activations results are stored as .npy/.npz arrays, record their stored
+-- dtype and shape next to the object path.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+ALTER TABLE model_image_heatmap
+    ADD COLUMN IF NOT EXISTS dtype VARCHAR(16),
+    ADD COLUMN IF NOT EXISTS shape JSON;
+
+ALTER TABLE model_image_activations
+    ADD COLUMN IF NOT EXISTS dtype VARCHAR(16),
+    ADD COLUMN IF NOT EXISTS shape JSON;
@@ -0,0 +1,24 @@
+--
+-- Extraction results keyed by model, image content hash, extraction type and parameters, so
+-- images shared across datasets or extracted again reuse the stored result.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+CREATE TABLE IF NOT EXISTS extraction_result_cache(
+    model_id INT NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    extraction_type VARCHAR(32) NOT NULL,
+    params_hash VARCHAR(64) NOT NULL,
+    result_path VARCHAR(1024),
+    dtype VARCHAR(16),
+    shape JSON,
+    predictions JSON,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (model_id, content_hash, extraction_type, params_hash),
+    CONSTRAINT fk_tenyks_extraction_result_cache_model FOREIGN KEY (model_id) REFERENCES model(id)
+);
+
+CREATE INDEX IF NOT EXISTS image_image_etag_idx ON image (image_etag);
+CREATE INDEX IF NOT EXISTS extraction_result_cache_last_used_at_idx ON extraction_result_cache (last_used_at);
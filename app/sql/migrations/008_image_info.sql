@@ -0,0 +1,19 @@
+--
+-- Image dimensions, channels, format, byte size and content hash captured at ingest from the
+-- image header. Existing rows are left without these facts, so the next ingest sees them as
+-- changed and fills them in from the image headers. Result cache lookups now go through the
+-- content hash instead of the ETag.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+ALTER TABLE image
+    ADD COLUMN IF NOT EXISTS width INT,
+    ADD COLUMN IF NOT EXISTS height INT,
+    ADD COLUMN IF NOT EXISTS channels SMALLINT,
+    ADD COLUMN IF NOT EXISTS format VARCHAR(16),
+    ADD COLUMN IF NOT EXISTS byte_size BIGINT,
+    ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+DROP INDEX IF EXISTS image_image_etag_idx;
+CREATE INDEX IF NOT EXISTS image_content_hash_idx ON image (content_hash);
@@ -0,0 +1,64 @@
+--
+-- One physical image_content row per distinct image file, referenced by every dataset image
+-- holding the same bytes. The file facts captured at ingest move from image to image_content,
+-- along with an optional 64 bit difference hash (dhash) used to find near duplicates.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+CREATE TABLE IF NOT EXISTS image_content(
+    id INT GENERATED BY DEFAULT AS IDENTITY,
+    content_hash VARCHAR(64) NOT NULL,
+    width INT,
+    height INT,
+    channels SMALLINT,
+    format VARCHAR(16),
+    byte_size BIGINT,
+    dhash BIGINT,
+    PRIMARY KEY (id),
+    UNIQUE(content_hash)
+);
+
+ALTER TABLE image ADD COLUMN IF NOT EXISTS content_id INT;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT FROM pg_constraint
+        WHERE conname='fk_tenyks_image_image_content' AND connamespace=current_schema()::regnamespace
+    ) THEN
+        ALTER TABLE image
+            ADD CONSTRAINT fk_tenyks_image_image_content FOREIGN KEY (content_id) REFERENCES image_content(id);
+    END IF;
+END $$;
+
+-- Only while the file facts are still on image, so the migration can be run again
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema=current_schema() AND table_name='image' AND column_name='content_hash'
+    ) THEN
+        INSERT INTO image_content(content_hash, width, height, channels, format, byte_size)
+        SELECT DISTINCT ON (content_hash) content_hash, width, height, channels, format, byte_size
+        FROM image
+        WHERE content_hash IS NOT NULL
+        ORDER BY content_hash, width IS NULL, id
+        ON CONFLICT (content_hash) DO NOTHING;
+
+        UPDATE image im
+        SET content_id=ic.id
+        FROM image_content ic
+        WHERE ic.content_hash=im.content_hash;
+
+        ALTER TABLE image
+            DROP COLUMN width,
+            DROP COLUMN height,
+            DROP COLUMN channels,
+            DROP COLUMN format,
+            DROP COLUMN byte_size,
+            DROP COLUMN content_hash;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS image_content_id_idx ON image (content_id);
@@ -0,0 +1,27 @@
+--
+-- Statement level triggers sending the table name on the tenyks_metadata channel after every
+-- write to the tables the backend metadata caches read. Notifications are only delivered once
+-- the writing transaction commits.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+CREATE OR REPLACE FUNCTION notify_metadata_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('tenyks_metadata', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS dataset_type_notify_metadata_change ON dataset_type;
+CREATE TRIGGER dataset_type_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dataset_type
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS dataset_notify_metadata_change ON dataset;
+CREATE TRIGGER dataset_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dataset
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS model_notify_metadata_change ON model;
+CREATE TRIGGER model_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON model
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS model_dataset_notify_metadata_change ON model_dataset;
+CREATE TRIGGER model_dataset_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON model_dataset
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
@@ -0,0 +1,90 @@
+--
+-- Model results attach to the image_content row of an image instead of the dataset image, so a
+-- result extracted through one dataset is shared by every dataset holding the same bytes.
+-- Results of images ingested without a content hash have no content to attach to and are
+-- dropped. Where several images of the same content hold a result of the same model, the one
+-- of the lowest image id is kept.
+--
+-- Run against an existing database with search_path set to the target schema.
+--
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema=current_schema() AND table_name='model_image_bbox' AND column_name='image_id'
+    ) THEN
+        ALTER TABLE model_image_bbox ADD COLUMN content_id INT;
+
+        UPDATE model_image_bbox b
+        SET content_id=im.content_id
+        FROM image im
+        WHERE im.id=b.image_id;
+
+        DELETE FROM model_image_bbox b
+        WHERE b.content_id IS NULL OR b.image_id > (
+            SELECT min(o.image_id)
+            FROM model_image_bbox o
+            WHERE o.content_id=b.content_id AND o.model_id=b.model_id
+        );
+
+        ALTER TABLE model_image_bbox
+            DROP COLUMN image_id,
+            ALTER COLUMN content_id SET NOT NULL,
+            ADD CONSTRAINT fk_tenyks_model_image_bbox_image_content FOREIGN KEY (content_id) REFERENCES image_content(id);
+    END IF;
+
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema=current_schema() AND table_name='model_image_heatmap' AND column_name='image_id'
+    ) THEN
+        ALTER TABLE model_image_heatmap ADD COLUMN content_id INT;
+
+        UPDATE model_image_heatmap r
+        SET content_id=im.content_id
+        FROM image im
+        WHERE im.id=r.image_id;
+
+        DELETE FROM model_image_heatmap r
+        WHERE r.content_id IS NULL OR EXISTS (
+            SELECT 1
+            FROM model_image_heatmap o
+            WHERE o.content_id=r.content_id AND o.model_id=r.model_id AND o.image_id < r.image_id
+        );
+
+        ALTER TABLE model_image_heatmap
+            DROP CONSTRAINT model_image_heatmap_pkey,
+            DROP COLUMN image_id,
+            ALTER COLUMN content_id SET NOT NULL,
+            ADD PRIMARY KEY (content_id, model_id),
+            ADD CONSTRAINT fk_tenyks_model_image_heatmap_image_content FOREIGN KEY (content_id) REFERENCES image_content(id);
+    END IF;
+
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema=current_schema() AND table_name='model_image_activations' AND column_name='image_id'
+    ) THEN
+        ALTER TABLE model_image_activations ADD COLUMN content_id INT;
+
+        UPDATE model_image_activations r
+        SET content_id=im.content_id
+        FROM image im
+        WHERE im.id=r.image_id;
+
+        DELETE FROM model_image_activations r
+        WHERE r.content_id IS NULL OR EXISTS (
+            SELECT 1
+            FROM model_image_activations o
+            WHERE o.content_id=r.content_id AND o.model_id=r.model_id AND o.image_id < r.image_id
+        );
+
+        ALTER TABLE model_image_activations
+            DROP CONSTRAINT model_image_activations_pkey,
+            DROP COLUMN image_id,
+            ALTER COLUMN content_id SET NOT NULL,
+            ADD PRIMARY KEY (content_id, model_id),
+            ADD CONSTRAINT fk_tenyks_model_image_activations_image_content FOREIGN KEY (content_id) REFERENCES image_content(id);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS model_image_bbox_content_id_model_id_idx ON model_image_bbox (content_id, model_id);
@@ -49,62 +49,159 @@ CREATE TABLE IF NOT EXISTS model_dataset(
     CONSTRAINT fk_tenyks_model_dataset_model FOREIGN KEY (model_id) REFERENCES model(id)
 );
 
-CREATE TABLE IF NOT EXISTS image(
+CREATE TABLE IF NOT EXISTS image_content(
     id INT GENERATED BY DEFAULT AS IDENTITY,
-    dataset_id INT NOT NULL,
-    name VARCHAR(128) NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    width INT,
+    height INT,
+    channels SMALLINT,
+    format VARCHAR(16),
+    byte_size BIGINT,
+    dhash BIGINT,
     PRIMARY KEY (id),
-    UNIQUE(name),
-    CONSTRAINT fk_tenyks_image_dataset FOREIGN KEY (dataset_id) REFERENCES dataset(id)
+    UNIQUE(content_hash)
 );
 
-CREATE TABLE IF NOT EXISTS image_category(
+CREATE TABLE IF NOT EXISTS image(
     id INT GENERATED BY DEFAULT AS IDENTITY,
-    category INT NOT NULL,
-    PRIMARY KEY (id)
+    dataset_id INT NOT NULL,
+    name VARCHAR(128) NOT NULL,
+    image_etag VARCHAR(64),
+    annotation_etag VARCHAR(64),
+    content_id INT,
+    PRIMARY KEY (id),
+    UNIQUE(dataset_id, name),
+    CONSTRAINT fk_tenyks_image_dataset FOREIGN KEY (dataset_id) REFERENCES dataset(id),
+    CONSTRAINT fk_tenyks_image_image_content FOREIGN KEY (content_id) REFERENCES image_content(id)
 );
 
 CREATE TABLE IF NOT EXISTS image_bbox(
     id INT GENERATED BY DEFAULT AS IDENTITY,
     image_id INT NOT NULL,
-    category_id INT NOT NULL,
-    bbox_json JSON NOT NULL,
-    PRIMARY KEY (id),
-    CONSTRAINT fk_tenyks_image_bbox_image FOREIGN KEY (image_id) REFERENCES image(id),
-    CONSTRAINT fk_tenyks_image_bbox_image_category FOREIGN KEY (category_id) REFERENCES image_category(id)
-);
-
-CREATE TABLE IF NOT EXISTS model_image_category(
-    id INT GENERATED BY DEFAULT AS IDENTITY,
     category INT NOT NULL,
-    PRIMARY KEY (id)
+    x_min INT NOT NULL,
+    y_min INT NOT NULL,
+    x_max INT NOT NULL,
+    y_max INT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_tenyks_image_bbox_image FOREIGN KEY (image_id) REFERENCES image(id)
 );
 
 CREATE TABLE IF NOT EXISTS model_image_bbox(
     id INT GENERATED BY DEFAULT AS IDENTITY,
-    image_id INT NOT NULL,
+    content_id INT NOT NULL,
     model_id INT NOT NULL,
-    category_id INT NOT NULL,
-    bbox_json JSON NOT NULL,
+    category INT NOT NULL,
+    x_min INT NOT NULL,
+    y_min INT NOT NULL,
+    x_max INT NOT NULL,
+    y_max INT NOT NULL,
     PRIMARY KEY (id),
-    CONSTRAINT fk_tenyks_model_image_bbox_image FOREIGN KEY (image_id) REFERENCES image(id),
-    CONSTRAINT fk_tenyks_model_image_bbox_image_category FOREIGN KEY (category_id) REFERENCES model_image_category(id)
+    CONSTRAINT fk_tenyks_model_image_bbox_image_content FOREIGN KEY (content_id) REFERENCES image_content(id)
 );
 
 CREATE TABLE IF NOT EXISTS model_image_heatmap(
-    image_id INT NOT NULL,
+    content_id INT NOT NULL,
     model_id INT NOT NULL, 
     result_path VARCHAR(1024) NOT NULL,
-    PRIMARY KEY (image_id, model_id),
-    CONSTRAINT fk_tenyks_model_image_heatmap_image FOREIGN KEY (image_id) REFERENCES image(id),
+    dtype VARCHAR(16),
+    shape JSON,
+    PRIMARY KEY (content_id, model_id),
+    CONSTRAINT fk_tenyks_model_image_heatmap_image_content FOREIGN KEY (content_id) REFERENCES image_content(id),
     CONSTRAINT fk_tenyks_model_image_heatmap_model FOREIGN KEY (model_id) REFERENCES model(id)
 );
 
 CREATE TABLE IF NOT EXISTS model_image_activations(
-    image_id INT NOT NULL,
+    content_id INT NOT NULL,
     model_id INT NOT NULL, 
     result_path VARCHAR(1024) NOT NULL,
-    PRIMARY KEY (image_id, model_id),
-    CONSTRAINT fk_tenyks_model_image_activations_image FOREIGN KEY (image_id) REFERENCES image(id),
+    dtype VARCHAR(16),
+    shape JSON,
+    PRIMARY KEY (content_id, model_id),
+    CONSTRAINT fk_tenyks_model_image_activations_image_content FOREIGN KEY (content_id) REFERENCES image_content(id),
     CONSTRAINT fk_tenyks_model_image_activations_model FOREIGN KEY (model_id) REFERENCES model(id)
 );
+
+CREATE TABLE IF NOT EXISTS extraction_job(
+    id INT GENERATED BY DEFAULT AS IDENTITY,
+    dataset_id INT NOT NULL,
+    model_id INT NOT NULL,
+    extraction_type VARCHAR(32) NOT NULL,
+    image_name VARCHAR(128),
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    total INT,
+    done INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    summary JSON,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_tenyks_extraction_job_dataset FOREIGN KEY (dataset_id) REFERENCES dataset(id),
+    CONSTRAINT fk_tenyks_extraction_job_model FOREIGN KEY (model_id) REFERENCES model(id)
+);
+
+CREATE TABLE IF NOT EXISTS extraction_result_cache(
+    model_id INT NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    extraction_type VARCHAR(32) NOT NULL,
+    params_hash VARCHAR(64) NOT NULL,
+    result_path VARCHAR(1024),
+    dtype VARCHAR(16),
+    shape JSON,
+    predictions JSON,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (model_id, content_hash, extraction_type, params_hash),
+    CONSTRAINT fk_tenyks_extraction_result_cache_model FOREIGN KEY (model_id) REFERENCES model(id)
+);
+
+--
+-- Secondary indexes. dataset(dataset_name), model(name) and image_content(content_hash) are served
+-- by their UNIQUE constraints and image(dataset_id) by UNIQUE(dataset_id, name).
+--
+
+CREATE INDEX IF NOT EXISTS image_bbox_image_id_idx ON image_bbox (image_id);
+CREATE INDEX IF NOT EXISTS model_image_bbox_content_id_model_id_idx ON model_image_bbox (content_id, model_id);
+CREATE INDEX IF NOT EXISTS model_dataset_dataset_id_idx ON model_dataset (dataset_id);
+CREATE INDEX IF NOT EXISTS extraction_job_status_idx ON extraction_job (status);
+CREATE INDEX IF NOT EXISTS image_content_id_idx ON image (content_id);
+CREATE INDEX IF NOT EXISTS extraction_result_cache_last_used_at_idx ON extraction_result_cache (last_used_at);
+
+--
+-- Spatial and shape indexes over bounding boxes. The indexed expressions must match the ones
+-- built by ImagesRepository.query_images_by_bbox.
+--
+
+CREATE INDEX IF NOT EXISTS image_bbox_box_idx ON image_bbox USING GIST (box(point(x_min, y_min), point(x_max, y_max)));
+CREATE INDEX IF NOT EXISTS image_bbox_area_idx ON image_bbox (((x_max - x_min) * (y_max - y_min)));
+CREATE INDEX IF NOT EXISTS image_bbox_aspect_idx ON image_bbox (((x_max - x_min)::float8 / NULLIF(y_max - y_min, 0)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_box_idx ON model_image_bbox USING GIST (box(point(x_min, y_min), point(x_max, y_max)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_model_id_area_idx ON model_image_bbox (model_id, ((x_max - x_min) * (y_max - y_min)));
+CREATE INDEX IF NOT EXISTS model_image_bbox_model_id_aspect_idx ON model_image_bbox (model_id, ((x_max - x_min)::float8 / NULLIF(y_max - y_min, 0)));
+
+--
+-- Cache invalidation. The backend caches dataset, model and dataset type rows in memory and
+-- clears them when these triggers notify the tenyks_metadata channel with the written table.
+--
+
+CREATE OR REPLACE FUNCTION notify_metadata_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('tenyks_metadata', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS dataset_type_notify_metadata_change ON dataset_type;
+CREATE TRIGGER dataset_type_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dataset_type
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS dataset_notify_metadata_change ON dataset;
+CREATE TRIGGER dataset_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dataset
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS model_notify_metadata_change ON model;
+CREATE TRIGGER model_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON model
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();
+DROP TRIGGER IF EXISTS model_dataset_notify_metadata_change ON model_dataset;
+CREATE TRIGGER model_dataset_notify_metadata_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON model_dataset
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change();